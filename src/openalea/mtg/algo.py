@@ -20,6 +20,8 @@
 
 __docformat__ = "restructuredtext"
 
+import numbers
+
 import traversal
 
 try:
@@ -28,6 +30,28 @@ except ImportError:
     from openalea.container.tree import InvalidVertex
 
 
+def contained_in(g, complex_id):
+    """ Return a predicate which tests if a vertex is contained in `complex_id`.
+
+    The containment index of `g` is used when it has been built.
+
+    :Parameters:
+        - `g`: an MTG
+        - `complex_id`: a vertex id which belongs to `g`
+
+    :Returns:
+        a function `f(vid) -> bool`
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.build_containment_index`
+    """
+    index = g.containment_index()
+    if index is not None and complex_id in index:
+        return lambda v: index.contains(complex_id, v)
+
+    c_scale = g.scale(complex_id)
+    return lambda v: g.complex_at_scale(v, scale=c_scale) == complex_id
+
+
 def ancestors(g, vid, **kwds):
     """ Return the vertices from vid to the root. 
 
@@ -45,7 +69,7 @@ def ancestors(g, vid, **kwds):
     ci = kwds.get('ContainedIn')
 
     if ci is not None:
-        c_scale = g.scale(ci)
+        is_contained = contained_in(g, ci)
 
     v = vid
 
@@ -54,12 +78,225 @@ def ancestors(g, vid, **kwds):
         if rt == 'SameComplex':
             if g.complex(v) != g.complex(vid):
                 break
-        if ci and g.complex_at_scale(v, scale=c_scale) != ci:
+        if ci and not is_contained(v):
             break
 
         yield v
         v = g.parent(v)
 
+def _lca_index(g, *vids):
+    """ LCA index of the scale of `vids` if it has been built, or None. """
+    if not hasattr(g, 'lca_index') or any(v not in g for v in vids):
+        return None
+    index = g.lca_index(g.scale(vids[0]), build=False)
+    if index is None or any(v not in index for v in vids):
+        return None
+    return index
+
+
+def _descriptor_index(g, *vids):
+    """ Memoised descriptors of the scale of `vids` (see
+    :meth:`~openalea.mtg.mtg.MTG.cache_descriptors`), or None.
+    """
+    if not hasattr(g, 'descriptor_index') or any(v not in g for v in vids):
+        return None
+    index = g.descriptor_index(g.scale(vids[0]))
+    if index is None or any(v not in index for v in vids):
+        return None
+    return index
+
+
+def _oriented(index, v1, v2):
+    """ Ancestor, descendant and sign of the path between v1 and v2
+    (sign is 0 if they are not in an ancestor relationship).
+    """
+    if index.is_ancestor(v1, v2):
+        return v1, v2, 1
+    elif index.is_ancestor(v2, v1):
+        return v2, v1, -1
+    return None, None, 0
+
+
+def is_ancestor(g, vid1, vid2):
+    """ Return True if `vid1` is `vid2` or one of its ancestors at the same scale.
+
+    The traversal index of the scale is built if needed
+    (see :meth:`~openalea.mtg.mtg.MTG.traversal_index`),
+    then each query is done in O(1).
+
+    .. seealso:: :func:`descendants`, :func:`lca`
+    """
+    scale = g.scale(vid1)
+    if scale != g.scale(vid2):
+        return False
+    return g.traversal_index(scale).is_ancestor(vid1, vid2)
+
+
+def lca(g, vid1, vid2):
+    """ Lowest common ancestor of two vertices at the same scale.
+
+    The LCA index of the scale is built if needed
+    (see :meth:`~openalea.mtg.mtg.MTG.lca_index`).
+
+    :Parameters:
+        - `g`: an MTG
+        - `vid1`, `vid2`: two vertices, or two sequences of vertices
+          of the same length.
+
+    :Returns:
+        the lowest common ancestor (None if the vertices belong to different
+        trees), or an array of vertices (-1 for vertices in different trees).
+
+    .. seealso:: :func:`path_length`, :func:`lowestCommonAncestor`
+    """
+    if isinstance(vid1, numbers.Integral):
+        return g.lca_index(g.scale(vid1)).lca(vid1, vid2)
+
+    vid1, vid2 = list(vid1), list(vid2)
+    if len(vid1) != len(vid2):
+        raise ValueError('The two sequences of vertices have different lengths')
+    if not vid1:
+        import numpy as np
+        return np.array([], dtype=int)
+    return g.lca_index(g.scale(vid1[0])).lca_array(vid1, vid2)
+
+
+def path_length(g, vid1, vid2):
+    """ Number of edges on the path between two vertices at the same scale.
+
+    The path goes through the lowest common ancestor of the vertices.
+    The LCA index of the scale is built if needed
+    (see :meth:`~openalea.mtg.mtg.MTG.lca_index`).
+
+    :Returns:
+        the number of edges, or None if the vertices belong to different trees.
+
+    .. seealso:: :func:`lca`
+    """
+    return g.lca_index(g.scale(vid1)).path_length(vid1, vid2)
+
+
+def _distance_setup(g, vids, weight):
+    """ LCA index, positions of `vids` and sums of the weights from the roots. """
+    import numpy as np
+
+    if vids is None:
+        vids = g.vertices(scale=g.max_scale())
+    vids = list(vids)
+    scale = g.scale(vids[0]) if vids else g.max_scale()
+    index = g.lca_index(scale)
+
+    if weight is None:
+        sums = index._depth
+    elif weight in ('+', '<'):
+        sums = index._counts[weight][0]
+    else:
+        weight = _values(g, weight)
+        sums = index.path_sums([weight.get(v, 0) for v in index.vertices.tolist()])
+    return index, index.positions(vids), np.asarray(sums, dtype=float)
+
+
+# Memory used by the temporary arrays of a block of distances (in bytes)
+_DISTANCE_BLOCK_BYTES = 64 * 2**20
+# Estimated memory of the temporary arrays for each pair of vertices
+_DISTANCE_PAIR_BYTES = 128
+
+def _distance_block_size(n):
+    """ Number of rows of n distances which fit in `_DISTANCE_BLOCK_BYTES`. """
+    return max(1, _DISTANCE_BLOCK_BYTES // (_DISTANCE_PAIR_BYTES * max(n, 1)))
+
+def distance_blocks(g, vids=None, weight=None, block_size=None):
+    """ Topological distances between vertices, by blocks of rows.
+
+    The rows of the matrix of :func:`distance_matrix` are computed
+    `block_size` rows at a time, so that the n x n matrix is never stored.
+    By default, the number of rows is chosen from the number of vertices
+    so that the temporary arrays of a block use about 64 MB.
+
+    :Parameters:
+        - `g`: an MTG
+        - `vids`: vertices at the same scale (all the vertices
+          of the finest scale if None)
+        - `weight`: see :func:`distance_matrix`
+        - `block_size`: number of rows of each block (computed from
+          the number of vertices if None)
+
+    :Returns: iter of (first_row, block), where block is an array
+        of shape (nb_rows, len(vids)).
+
+    .. seealso:: :func:`distance_matrix`
+    """
+    import numpy as np
+
+    index, positions, sums = _distance_setup(g, vids, weight)
+    n = len(positions)
+    if block_size is None:
+        block_size = _distance_block_size(n)
+    for start in range(0, n, block_size):
+        rows = positions[start:start + block_size]
+        i = np.repeat(rows, n)
+        j = np.tile(positions, len(rows))
+        k = index._lca_positions(i, j)
+        block = sums[i] + sums[j] - 2 * sums[k]
+        block[k < 0] = np.inf
+        yield start, block.reshape(len(rows), n)
+
+
+def distance_matrix(g, vids=None, weight=None, condensed=False, block_size=None):
+    """ Topological distances between all the pairs of vertices.
+
+    The distance between two vertices is the weight of the path between
+    them, which goes through their lowest common ancestor. It is computed
+    from the depths of the vertices and of their LCAs (see :func:`lca`).
+
+    :Parameters:
+        - `g`: an MTG
+        - `vids`: vertices at the same scale (all the vertices
+          of the finest scale if None)
+        - `weight`: None to count the edges, '+' or '<' to count the edges
+          of one type, or a dict vid -> weight (or a property name) which
+          gives the weight of the edge between a vertex and its parent.
+        - `condensed`: if True, returns the upper triangle of the matrix
+          without the diagonal, row by row (as `scipy.spatial.distance.pdist`).
+        - `block_size`: number of rows computed at a time (see :func:`distance_blocks`).
+
+    :Returns:
+        an array of float of shape (n, n), or (n * (n-1) / 2,) if `condensed`.
+        The distance between vertices in different trees is `inf`.
+
+    :Examples:
+
+    .. code-block:: python
+
+        leaves = g.Extremities(g.component_roots_at_scale(g.root, 3)[0])
+        d = distance_matrix(g, leaves)
+        nb_branchings = distance_matrix(g, leaves, weight='+', condensed=True)
+
+    .. seealso:: :func:`distance_blocks`, :func:`path_length`
+    """
+    import numpy as np
+
+    if vids is None:
+        vids = g.vertices(scale=g.max_scale())
+    vids = list(vids)
+    n = len(vids)
+    blocks = distance_blocks(g, vids, weight, block_size)
+
+    if not condensed:
+        matrix = np.empty((n, n))
+        for start, block in blocks:
+            matrix[start:start + len(block)] = block
+        return matrix
+
+    result = np.empty(n * (n - 1) // 2)
+    offset = 0
+    for start, block in blocks:
+        for row, distances in enumerate(block, start):
+            result[offset:offset + n - row - 1] = distances[row + 1:]
+            offset += n - row - 1
+    return result
+
+
 def path(g, vid1, vid2=None):
     """
     Compute the vertices between v1 and v2.
@@ -73,6 +310,16 @@ def path(g, vid1, vid2=None):
     if v2 is None:
         return ancestors(g,v1), sign
 
+    index = _lca_index(g, v1, v2)
+    if index is not None:
+        top, bottom, sign = _oriented(index, v1, v2)
+        if not sign:
+            return iter([]), 0
+        l = [bottom]
+        for i in xrange(index.depth(bottom) - index.depth(top)):
+            l.append(g.parent(l[-1]))
+        return reversed(l), sign
+
     l= list(ancestors(g,v2))
     try: 
         index = l.index(v1)
@@ -90,6 +337,22 @@ def edge_type(g,v):
     return g.property('edge_type').get(v)
 
 def topological_path(g,v1, v2=None, edge=None):
+    index = _descriptor_index(g, v1, *([] if v2 is None else [v2])) if edge in (None, '+') else None
+    if index is not None:
+        if v2 is None:
+            return (index.height[v1] + 1 if edge is None else index.order[v1]), 1
+        top, bottom, sign = _oriented(index, v1, v2)
+        if sign == 0:
+            return None
+        return index.count(top, bottom, edge), sign
+
+    index = _lca_index(g, v1, v2) if v2 is not None and edge in (None, '+', '<') else None
+    if index is not None:
+        top, bottom, sign = _oriented(index, v1, v2)
+        if sign == 0:
+            return None
+        return index.count(top, bottom, edge), sign
+
     p, sign = path(g,v1,v2)
     if sign == 0:
         return None
@@ -100,9 +363,23 @@ def topological_path(g,v1, v2=None, edge=None):
         return sum(1 for v in p if g.edge_type(v)==edge), sign
         
 def order(g, v1, v2=None):
-    return topological_path(g, v1, v2, '+')[0]
+    p = topological_path(g, v1, v2, '+')
+    if p is not None:
+        return p[0]
 
 def alg_rank(g, v1, v2=None):
+    if v2 is None:
+        index = _descriptor_index(g, v1)
+        if index is not None:
+            return index.rank[v1]
+
+    index = _lca_index(g, v1, v2) if v2 is not None else None
+    if index is not None:
+        top, bottom, sign = _oriented(index, v1, v2)
+        if sign == 0:
+            return 0
+        return index.successor_run(top, bottom) * sign
+
     p, sign = path(g,v1,v2)
     count = 0
     for v in p:
@@ -116,18 +393,20 @@ def rank(g, v1, v2=None):
     return abs(alg_rank(g,v1,v2))
 
 def height(g, v1, v2=None):
-    return topological_path(g, v1, v2 )[0]-1
+    p = topological_path(g, v1, v2 )
+    if p is not None:
+        return p[0]-1
 
 def alg_order(g, v1, v2=None):
-    p, s = topological_path(g, v1, v2, '+')
+    p = topological_path(g, v1, v2, '+')
     if p is not None:
-        return p*s
+        return p[0]*p[1]
 
 
 def alg_height(g, v1, v2=None):
-    p, s = topological_path(g, v1, v2)
+    p = topological_path(g, v1, v2)
     if p is not None:
-        return p*s
+        return p[0]*p[1]
 
 def father(g, vid, scale=-1, **kwds):
     """
@@ -143,7 +422,7 @@ def father(g, vid, scale=-1, **kwds):
     if scale <= 0 or scale == current_scale:
         p = g.parent(vid)
     elif scale < current_scale:
-        vid = g.complex_at_scale(vid)
+        vid = g.complex_at_scale(vid, scale=scale)
         p = g.parent(vid)
     else:
         vid = g.component_roots_at_scale_iter(vid, scale=scale).next()
@@ -162,9 +441,8 @@ def father(g, vid, scale=-1, **kwds):
             if edge_type[vid] == '+':
                 return None
 
-    if ci is not None:
-        c_scale = g.scale(ci)
-        if g.complex_at_scale(vid, scale=c_scale) != g.complex_at_scale(p, scale=c_scale) != ci:
+    if ci is not None and p is not None:
+        if not contained_in(g, ci)(p):
             return None
         
     return p
@@ -191,8 +469,7 @@ def successor(g, vid, **kwds):
             return None
 
     if ci is not None:
-        c_scale = g.scale(ci)
-        if g.complex_at_scale(vid, scale=c_scale) != g.complex_at_scale(son, scale=c_scale) != ci:
+        if not contained_in(g, ci)(son):
             return None
 
     return son
@@ -254,8 +531,8 @@ def sons(g, vid, **kwds):
     if et != '*':
         children = (v for v in children if edge_type[v] == et)
     if ci is not None:
-        c_scale = g.scale(ci)
-        children = (v for v in children if g.complex_at_scale(v) == ci)
+        is_contained = contained_in(g, ci)
+        children = (v for v in children if is_contained(v))
 
     return list(children)
 
@@ -268,7 +545,7 @@ def full_ancestors(g, v1, **kwds):
 
     v = v1
     if ci is not None:
-        c_scale = g.scale(ci)
+        is_contained = contained_in(g, ci)
 
     while v is not None:
         if et != '*' and edge_type.get(v) != et:
@@ -280,7 +557,7 @@ def full_ancestors(g, v1, **kwds):
         elif rt == 'SameAxis':
             if edge_type.get(v) == '+':
                 break
-        if ci and g.complex_at_scale(v, scale=c_scale) != ci:
+        if ci and not is_contained(v):
             break
         yield v
         v = g.parent(v)
@@ -295,13 +572,13 @@ def axis(g, vtx_id, scale=-1, **kwds):
     kwds['EdgeType'] = '<'
 
     if ci is not None:
-        c_scale = g.scale(ci)
+        is_contained = contained_in(g, ci)
 
     for v in ancestors(g, vtx_id, **kwds):
         if rt == 'SameComplex':
             if g.complex(v) != g.complex(vtx_id):
                 break
-        if ci and g.complex_at_scale(v, scale=c_scale) != ci:
+        if ci and not is_contained(v):
             break
 
         if edge_type.get(v) == '+':
@@ -319,10 +596,15 @@ def descendants(g, vtx_id, scale=-1, **kwds):
     ci = kwds.get('ContainedIn')
 
     if ci is not None:
-        c_scale = g.scale(ci)
+        is_contained = contained_in(g, ci)
 
     vtx_id = vertex_at_scale(g, vtx_id, scale)
 
+    if et == '*' and rt == 'NoRestriction' and ci is None and hasattr(g, 'traversal_index'):
+        index = g.traversal_index(g.scale(vtx_id), build=False)
+        if index is not None:
+            return iter(index.pre_order(vtx_id))
+
     v = vtx_id
 
     if rt == 'SameComplex':
@@ -337,7 +619,7 @@ def descendants(g, vtx_id, scale=-1, **kwds):
         elif rt == 'SameAxis' and edge_type.get(v) == '+':
                 return False
 
-        if ci and g.complex_at_scale(v, scale=c_scale) != ci:
+        if ci and not is_contained(v):
             return False
         return True
 
@@ -346,8 +628,19 @@ def descendants(g, vtx_id, scale=-1, **kwds):
         
 def extremities(g, vid, **kwds):
     """ TODO see aml doc
-    Implement the method more efficiently...
+
+    Without restriction, the extremities of an MTG are a slice of the leaves
+    of its traversal index, in pre order, once the index is built
+    (see :meth:`~openalea.mtg.mtg.MTG.traversal_index`).
     """
+    defaults = (('EdgeType', '*'), ('RestrictedTo', 'NoRestriction'), ('ContainedIn', None), ('scale', -1))
+    if all(kwds.get(k, d) == d for k, d in defaults) and hasattr(g, 'traversal_index'):
+        index = g.traversal_index(g.scale(vid), build=False)
+        if index is not None:
+            return iter(index.extremities(vid))
+    return _extremities(g, vid, **kwds)
+
+def _extremities(g, vid, **kwds):
     vertices = set(descendants(g,vid, **kwds))
     for v in vertices:
         if g.is_leaf(v):
@@ -374,7 +667,7 @@ def local_axis(g, vtx_id, scale=-1, **kwds):
     vtx_id = vertex_at_scale(g, vtx_id, scale)
 
     if ci is not None:
-        c_scale = g.scale(ci)
+        is_contained = contained_in(g, ci)
 
     
     v = vtx_id
@@ -388,7 +681,7 @@ def local_axis(g, vtx_id, scale=-1, **kwds):
                 if rt == 'SameComplex':
                     if g.complex(v) != g.complex(vtx_id):
                         v = None
-                if ci and g.complex_at_scale(v, scale=c_scale) != ci:
+                if ci and v is not None and not is_contained(v):
                     v = None
 
 def vertex_at_scale(g, vtx_id, scale):
@@ -510,6 +803,337 @@ def heights(g, scale=-1):
 
     return heights
 
+def _scale_levels(g, scale):
+    """ Levels (see :func:`traversal.levels`) of each tree at `scale`. """
+    if scale < 0:
+        scale = g.max_scale()
+    for rid in g.roots_iter(scale=scale):
+        yield list(traversal.levels(g, rid))
+
+
+def _edge_mask(g, vids, parent_vids, edge_type=None, same_complex=False):
+    """ Boolean mask of the edges (parent_vids[i], vids[i]) which are kept. """
+    import numpy as np
+
+    mask = np.ones(len(vids), dtype=bool)
+    if edge_type is not None:
+        et = g.property('edge_type')
+        mask &= np.array([et.get(v) == edge_type for v in vids], dtype=bool)
+    if same_complex:
+        complex = g.complex
+        mask &= np.array([complex(v) == complex(p) for v, p in zip(vids, parent_vids)], dtype=bool)
+    return mask
+
+
+def _values(g, values):
+    """ Mapping vid -> value from a property name or a mapping. """
+    if isinstance(values, basestring):
+        return g.property(values)
+    return values
+
+
+def _reduction(g, values, op):
+    """ Common setup of :func:`subtree_reduce` and :func:`path_accumulate`.
+
+    :Returns: the mapping of values (or None), the NumPy ufunc of `op`,
+        its initial value and whether the results are integers.
+    """
+    import numpy as np
+
+    if op not in ('sum', 'max', 'min', 'count'):
+        raise ValueError("Unknown operation %s. Use 'sum', 'max', 'min' or 'count'." % op)
+    values = _values(g, values)
+    ufunc = np.maximum if op == 'max' else np.minimum if op == 'min' else np.add
+    fill = {'max': -np.inf, 'min': np.inf}.get(op, 0.)
+
+    if op == 'count' or values is None:
+        integral = True
+    else:
+        integral = all(isinstance(v, numbers.Integral) for v in values.itervalues())
+    return values, ufunc, fill, integral
+
+
+def _level_values(vids, values, op, fill):
+    """ Initial values of the vertices `vids` of a level and
+    the mask of the vertices which have a value.
+    """
+    import numpy as np
+
+    n = len(vids)
+    if op == 'count' or values is None:
+        acc = np.array([values is None or v in values for v in vids], dtype=float)
+        defined = np.ones(n, dtype=bool)
+    else:
+        defined = np.array([v in values for v in vids], dtype=bool)
+        acc = np.empty(n, dtype=float)
+        acc.fill(fill)
+        acc[defined] = [values[v] for v in vids[defined].tolist()]
+        if op == 'sum':
+            defined[:] = True
+    return acc, defined
+
+
+def subtree_reduce(g, values=None, op='sum', scale=-1, edge_type=None, same_complex=False):
+    """ Reduce the values of the vertices of each sub tree.
+
+    For each vertex `v` at `scale`, the values of `v` and of its descendants
+    are reduced with `op`. The computation is done level by level,
+    from the leaves to the roots, with NumPy operations.
+
+    :Parameters:
+        - `g`: an MTG
+        - `values`: a dict vid -> value or the name of a property.
+          Vertices without value are ignored. If None, the value of
+          each vertex is 1 (e.g. the sum is the size of the sub tree).
+        - `op`: 'sum', 'max', 'min' or 'count' (number of vertices which
+          have a value, or number of vertices if `values` is None).
+        - `scale`: the scale of the vertices (the finest scale if -1).
+        - `edge_type`: if '<' or '+', only the descendants connected by
+          this type of edges are considered (e.g. '<' for the rest of the axis).
+        - `same_complex`: if True, only the descendants which have the same
+          complex than `v` are considered.
+
+    :Returns:
+        a dict vid -> reduced value. For 'max' and 'min', the vertices
+        whose sub tree has no value are not in the dict.
+
+    :Examples:
+
+    .. code-block:: python
+
+        nb_descendants = subtree_reduce(g, op='count')
+        total_length = subtree_reduce(g, 'length', op='sum')
+
+    .. seealso:: :func:`path_accumulate`, :func:`traversal.levels`
+    """
+    values, reduce, fill, integral = _reduction(g, values, op)
+
+    result = {}
+    for levels in _scale_levels(g, scale):
+        below = None
+        for vids, parents in reversed(levels):
+            acc, defined = _level_values(vids, values, op, fill)
+
+            if below is not None:
+                child_vids, child_parents, child_acc, child_defined = below
+                keep = child_defined & _edge_mask(g, child_vids, vids[child_parents],
+                                                  edge_type, same_complex)
+                reduce.at(acc, child_parents[keep], child_acc[keep])
+                defined[child_parents[keep]] = True
+
+            below = vids, parents, acc, defined
+
+            for vid, value in zip(vids[defined].tolist(), acc[defined].tolist()):
+                result[vid] = int(value) if integral else value
+
+    return result
+
+
+def path_accumulate(g, values=None, op='sum', scale=-1, reset_on=None):
+    """ Accumulate the values along the path from the root to each vertex.
+
+    For each vertex `v` at `scale`, the values of the vertices from the
+    root (or from the last reset) to `v` included are accumulated with `op`.
+    The computation is done level by level, from the roots to the leaves,
+    with NumPy operations.
+
+    :Parameters:
+        - `g`: an MTG
+        - `values`: a dict vid -> value or the name of a property.
+          Vertices without value are ignored. If None, the value of
+          each vertex is 1 (e.g. the sum is the number of vertices on the path).
+        - `op`: 'sum', 'max', 'min' or 'count' (number of vertices which
+          have a value, or number of vertices if `values` is None).
+        - `scale`: the scale of the vertices (the finest scale if -1).
+        - `reset_on`: the accumulation restarts at the vertices connected
+          to their parent by a '+' edge (`reset_on='+'`) or by a '<' edge,
+          or which do not belong to the complex of their parent
+          (`reset_on='complex'`). A list of these conditions may be given.
+
+    :Returns:
+        a dict vid -> accumulated value. For 'max' and 'min', the vertices
+        without any value on their path are not in the dict.
+
+    :Examples:
+
+    .. code-block:: python
+
+        distance_to_base = path_accumulate(g, 'Length')
+        height = dict((v, n-1) for v, n in path_accumulate(g, op='count').iteritems())
+        rank = dict((v, n-1) for v, n in path_accumulate(g, op='count', reset_on='+').iteritems())
+        plus = dict((v, 1) for v in g.vertices(scale=g.max_scale()) if g.edge_type(v) == '+')
+        order = path_accumulate(g, plus)
+
+    .. seealso:: :func:`subtree_reduce`, :func:`orders`, :func:`heights`
+    """
+    import numpy as np
+
+    values, accumulate, fill, integral = _reduction(g, values, op)
+
+    if reset_on is None:
+        reset_on = []
+    elif isinstance(reset_on, basestring):
+        reset_on = [reset_on]
+
+    result = {}
+    for levels in _scale_levels(g, scale):
+        above = None
+        for vids, parents in levels:
+            acc, defined = _level_values(vids, values, op, fill)
+
+            if above is not None:
+                parent_vids, parent_acc, parent_defined = above
+                keep = np.ones(len(vids), dtype=bool)
+                for condition in reset_on:
+                    if condition == 'complex':
+                        keep &= _edge_mask(g, vids, parent_vids[parents], same_complex=True)
+                    else:
+                        keep &= ~_edge_mask(g, vids, parent_vids[parents], edge_type=condition)
+                keep &= parent_defined[parents]
+                acc[keep] = accumulate(acc[keep], parent_acc[parents[keep]])
+                defined |= keep
+
+            above = vids, acc, defined
+
+            for vid, value in zip(vids[defined].tolist(), acc[defined].tolist()):
+                result[vid] = int(value) if integral else value
+
+    return result
+
+
+_BRANCHING_ORDERS = ('strahler', 'horton', 'gravelius', 'size', 'leaf_distance')
+
+def branching_orders(g, scale=-1, kinds=('strahler',), as_arrays=False):
+    """ Compute branching orders of all the vertices at a scale.
+
+    The orders are computed for all the vertices in one pass from the
+    leaves to the roots, and one pass from the roots to the leaves for
+    the Horton and Gravelius orders, with NumPy operations on each level.
+
+    The available kinds are:
+
+        - 'strahler': 1 for the leaves. A vertex has the highest order of
+          its children, plus one if at least two children have this order.
+        - 'horton': the order of the root is its Strahler order. The main
+          child of a vertex (highest Strahler order, then furthest leaf,
+          then '<' edge) has the Horton order of its parent, the other
+          children have their Strahler order.
+        - 'gravelius': 1 for the roots. The main child of a vertex (furthest
+          leaf, then '<' edge) has the order of its parent, the other
+          children the order of their parent plus one.
+        - 'size': number of vertices in the sub tree.
+        - 'leaf_distance': number of edges to the furthest leaf.
+
+    :Parameters:
+        - `g`: an MTG
+        - `scale`: the scale of the vertices (the finest scale if -1).
+        - `kinds`: the orders to compute.
+        - `as_arrays`: if True, returns arrays instead of dicts.
+
+    :Returns:
+        a dict kind -> {vid: order}, or if `as_arrays` is True,
+        the array of vertices and a dict kind -> array of orders.
+
+    :Examples:
+
+    .. code-block:: python
+
+        orders = branching_orders(g, kinds=['strahler', 'gravelius'])
+        g.properties()['strahler'] = orders['strahler']
+
+    .. seealso:: :func:`orders`, :func:`subtree_reduce`
+    """
+    import numpy as np
+
+    if isinstance(kinds, basestring):
+        kinds = [kinds]
+    for kind in kinds:
+        if kind not in _BRANCHING_ORDERS:
+            raise ValueError('Unknown order %s. Use one of %s.' % (kind, ', '.join(_BRANCHING_ORDERS)))
+
+    et = g.property('edge_type')
+    all_vertices = []
+    all_orders = dict((kind, []) for kind in kinds)
+
+    for levels in _scale_levels(g, scale):
+        n_levels = len(levels)
+        size = [None] * n_levels
+        leaf_distance = [None] * n_levels
+        strahler = [None] * n_levels
+
+        # 1. from the leaves to the roots
+        for l in reversed(range(n_levels)):
+            vids, parents = levels[l]
+            n = len(vids)
+            size[l] = np.ones(n, dtype=int)
+            leaf_distance[l] = np.zeros(n, dtype=int)
+            strahler[l] = np.ones(n, dtype=int)
+            if l + 1 == n_levels:
+                continue
+
+            child_parents = levels[l + 1][1]
+            child_strahler = strahler[l + 1]
+            child_leaf_distance = leaf_distance[l + 1]
+
+            np.add.at(size[l], child_parents, size[l + 1])
+            np.maximum.at(leaf_distance[l], child_parents, child_leaf_distance + 1)
+
+            highest = np.zeros(n, dtype=int)
+            np.maximum.at(highest, child_parents, child_strahler)
+            nb_highest = np.zeros(n, dtype=int)
+            np.add.at(nb_highest, child_parents, child_strahler == highest[child_parents])
+            has_children = highest > 0
+            strahler[l][has_children] = highest[has_children] + (nb_highest[has_children] >= 2)
+
+        # 2. from the roots to the leaves
+        orders = {}
+        for l, (vids, parents) in enumerate(levels):
+            n = len(vids)
+            if l == 0:
+                orders['horton'] = strahler[0].copy()
+                orders['gravelius'] = np.ones(n, dtype=int)
+            else:
+                successor = np.array([et.get(v) == '<' for v in vids.tolist()], dtype=int)
+                first = -np.arange(n)
+
+                horton_main = _main_children(parents, (first, successor, leaf_distance[l], strahler[l]))
+                horton = np.where(horton_main, orders['horton'][parents], strahler[l])
+
+                gravelius_main = _main_children(parents, (first, successor, leaf_distance[l]))
+                gravelius = orders['gravelius'][parents] + np.logical_not(gravelius_main)
+                orders['horton'], orders['gravelius'] = horton, gravelius
+
+            orders.update(strahler=strahler[l], size=size[l], leaf_distance=leaf_distance[l])
+            all_vertices.append(vids)
+            for kind in kinds:
+                all_orders[kind].append(orders[kind])
+
+    vertices = np.concatenate(all_vertices) if all_vertices else np.array([], dtype=int)
+    for kind in kinds:
+        values = all_orders[kind]
+        all_orders[kind] = np.concatenate(values) if values else np.array([], dtype=int)
+
+    if as_arrays:
+        return vertices, all_orders
+    vertices = vertices.tolist()
+    return dict((kind, dict(zip(vertices, values.tolist()))) for kind, values in all_orders.iteritems())
+
+
+def _main_children(parents, keys):
+    """ Boolean array which is True for the child with the greatest `keys`
+    (the last key is the primary key) of each parent.
+    """
+    import numpy as np
+
+    order = np.lexsort(tuple(keys) + (parents,))
+    sorted_parents = parents[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = sorted_parents[1:] != sorted_parents[:-1]
+    main = np.zeros(len(order), dtype=bool)
+    main[order[last]] = True
+    return main
+
+
 def lookForCommonAncestor(g, commonAncestors, currentNode):       
     while not(currentNode is None):
         for i in range(len(commonAncestors)):
@@ -520,11 +1144,22 @@ def lookForCommonAncestor(g, commonAncestors, currentNode):
                 return 
             i += 1
         currentNode = g.parent(currentNode)
+    # no common ancestor (vertices in disjoint trees)
+    commonAncestors.clear()
 
 
 def lowestCommonAncestor(g, nodes):
     """LCA algorithm"""     
     from collections import deque
+    index = _lca_index(g, *nodes) if len(nodes) > 1 else None
+    if index is not None:
+        ancestor = nodes[0]
+        for vid in nodes[1:]:
+            ancestor = index.lca(ancestor, vid)
+            if ancestor is None:
+                break
+        return ancestor
+
     lca = None
     if (len(nodes) > 1):
         
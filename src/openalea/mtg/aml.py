@@ -18,6 +18,17 @@
 """
 Interface to use the new MTG implementation with the old AMAPmod interface.
 
+The query functions :func:`Class`, :func:`Index`, :func:`Scale`,
+:func:`Feature`, :func:`Order`, :func:`Rank`, :func:`Height`, :func:`Father`,
+:func:`Successor`, :func:`Complex` and :func:`Sons` also accept a list or an
+array of vertices. They then return an array aligned with the vertices,
+where undefined results are NaN (numbers) or None (other values):
+
+.. code-block:: python
+
+    fathers = Father(vids, EdgeType='+')
+    lengths = Feature(vids, 'Length')
+
 .. testsetup:: *
 
     from openalea.mtg.aml import *
@@ -26,13 +37,75 @@ Interface to use the new MTG implementation with the old AMAPmod interface.
 """
 __docformat__ = "restructuredtext"
 
+import numbers
+
 import openalea.mtg.mtg as mtg
 from openalea.mtg.io import read_mtg_file
 import openalea.mtg.algo as algo
+import openalea.mtg.dynamic as dynamic
 
 # Current graph which is a global variable.
 _g = None
 
+def _is_sequence(v):
+    """ True if `v` is a list, a tuple or an array of vertices. """
+    return isinstance(v, (list, tuple)) or getattr(v, 'ndim', 0) > 0
+
+def _aligned(values):
+    """ Array of `values`.
+
+    Numbers are stored in a numeric array, where None is NaN.
+    Other values are stored in an object array.
+    """
+    import numpy as np
+    defined = [x for x in values if x is not None]
+    if all(isinstance(x, numbers.Number) for x in defined):
+        if len(defined) == len(values):
+            return np.array(values)
+        return np.array([np.nan if x is None else x for x in values], dtype=float)
+    result = np.empty(len(values), dtype=object)
+    for i, x in enumerate(values):
+        result[i] = x
+    return result
+
+def _map(f, vids):
+    """ Apply `f` to each vertex of `vids` (None for undefined vertices). """
+    global _g
+    return _aligned([f(v) if v in _g else None for v in vids])
+
+def _path_descriptor(v1, v2, descriptor, f):
+    """ Order, rank or height of the vertices `v1` with respect to their
+    root (if `v2` is None) or to `v2`.
+    """
+    import numpy as np
+    global _g
+
+    if v2 is not None:
+        v2 = v2 if _is_sequence(v2) else [v2] * len(v1)
+        for scale in set(_g.scale(v) for v in v1 if v in _g):
+            _g.lca_index(scale)
+        return _aligned([f(_g, x, y) if x in _g and y in _g else None
+                         for x, y in zip(v1, v2)])
+
+    result = np.empty(len(v1))
+    result.fill(np.nan)
+    rows = {}
+    for i, v in enumerate(v1):
+        if v in _g:
+            rows.setdefault(_g.scale(v), []).append(i)
+    for scale, i in rows.iteritems():
+        index = _g.lca_index(scale)
+        vids = [v1[k] for k in i]
+        if descriptor == 'order':
+            result[i] = index.edge_counts(vids, '+')
+        elif descriptor == 'rank':
+            result[i] = index.successor_runs(vids)
+        else:
+            result[i] = index.depths(vids)
+    if not np.isnan(result).any():
+        result = result.astype(int)
+    return result
+
 def MTG(filename):
     """
     MTG constructor.
@@ -254,6 +327,8 @@ def Class(vid):
     .. seealso:: :func:`MTG`, :func:`Index`, :func:`Scale`.
     """
     global _g
+    if _is_sequence(vid):
+        return _map(Class, vid)
     labels = _g.property('label')
     label = labels.get(vid, '')
     if label:
@@ -289,6 +364,8 @@ def Index(vid):
     .. seealso:: :func:`MTG`, :func:`Class`, :func:`Scale`
     """
     global _g
+    if _is_sequence(vid):
+        return _map(Index, vid)
     indices = _g.property('index')
     return indices.get(vid, vid)
 
@@ -316,6 +393,8 @@ def Scale(vid):
 
     """
     global _g
+    if _is_sequence(vid):
+        return _map(_g.scale, vid)
     return _g.scale(vid)
 
 def Feature(vid, fname, date=None):
@@ -350,18 +429,27 @@ def Feature(vid, fname, date=None):
 
         This date must be a valid date appearing in the coding file for a considered vertex.
         Otherwise `None` is returned.
+        Dates are :class:`datetime.date` or strings 'DD/MM/YYYY' or 'DD/MM/YY'.
 
     :Background:
 
         MTGs and Dynamic MTGs.
 
-    .. todo:: specify the format of `date`
-
     .. seealso:: :func:`MTG`, :func:`Class`, :func:`Index`, :func:`Scale`.
 
     """
     global _g
-    return _g.property(fname).get(vid)
+    if date is not None:
+        if _is_sequence(vid):
+            return _aligned([dynamic.feature(_g, v, fname, date) for v in vid])
+        return dynamic.feature(_g, vid, fname, date)
+    prop = _g.property(fname)
+    if _is_sequence(vid):
+        if getattr(prop, 'dtype', None) == 'float64':
+            # PropertyColumn: undefined values are already NaN
+            return prop.array(vid)
+        return _aligned([prop.get(v) for v in vid])
+    return prop.get(vid)
 
 def ClassScale(c):
     """
@@ -495,6 +583,8 @@ def Order(v1, v2=None):
 
     """
     global _g
+    if _is_sequence(v1):
+        return _path_descriptor(v1, v2, 'order', algo.order)
     return algo.order(_g,v1,v2)
 
 def Rank(v1, v2=None):
@@ -528,6 +618,8 @@ def Rank(v1, v2=None):
 
     """
     global _g
+    if _is_sequence(v1):
+        return _path_descriptor(v1, v2, 'rank', algo.rank)
     return algo.rank(_g,v1,v2)
 
 def Height(v1, v2=None):
@@ -568,6 +660,8 @@ def Height(v1, v2=None):
 
     """
     global _g
+    if _is_sequence(v1):
+        return _path_descriptor(v1, v2, 'height', algo.height)
     return algo.height(_g, v1, v2)
 
 
@@ -756,6 +850,9 @@ def Father(v, EdgeType='*', RestrictedTo='NoRestriction', ContainedIn=None, Scal
     if RestrictedTo not in ['SameComplex', 'SameAxis', 'NoRestriction']:
         raise Exception('Invalid argument %s. Value of RestrictedTo is SameComplex, SameAxis, NoRestriction .'%RestrictedTo)
 
+    if _is_sequence(v):
+        return _map(lambda x: algo.father(_g, x, scale=Scale, EdgeType=EdgeType,
+                                          RestrictedTo=RestrictedTo, ContainedIn=ContainedIn), v)
     return algo.father(_g, v, scale=Scale, EdgeType=EdgeType, RestrictedTo=RestrictedTo, ContainedIn=ContainedIn)
 
 def Successor(v, RestrictedTo='NoRestriction', ContainedIn=None):
@@ -804,6 +901,9 @@ def Successor(v, RestrictedTo='NoRestriction', ContainedIn=None):
     .. seealso:: :func:`MTG`, :func:`Sons`, :func:`Predecessor`.
     """
     global _g
+    if _is_sequence(v):
+        return _map(lambda x: algo.successor(_g, x, RestrictedTo=RestrictedTo,
+                                             ContainedIn=ContainedIn), v)
     return algo.successor(_g, v, RestrictedTo=RestrictedTo, ContainedIn=ContainedIn)
 
 
@@ -932,6 +1032,8 @@ def Complex(v, Scale=-1):
     .. seealso:: :func:`MTG`, :func:`Components`.
     """
     global _g
+    if _is_sequence(v):
+        return _map(lambda x: Complex(x, Scale=Scale), v)
     if Scale == -1 or Scale == _g.scale(v)-1:
         return _g.complex(v)
     else:
@@ -1050,6 +1152,9 @@ def Sons(v, RestrictedTo='NoRestriction', EdgeType='*', Scale=-1, ContainedIn= N
     .. seealso:: :func:`MTG`, :func:`Father`, :func:`Successor`, :func:`Descendants`.
     """
     global _g
+    if _is_sequence(v):
+        return _map(lambda x: algo.sons(_g, x, EdgeType=EdgeType, RestrictedTo=RestrictedTo,
+                                        Scale=Scale, ContainedIn=ContainedIn), v)
     return algo.sons(_g, v, EdgeType=EdgeType, RestrictedTo=RestrictedTo, Scale=Scale, ContainedIn=ContainedIn)
 
 def Ancestors(v, EdgeType='*', RestrictedTo='NoRestriction', ContainedIn=None):
@@ -1417,7 +1522,7 @@ def Trunk(v, Scale=-1):
 # Date functions
 ################################################################################
 
-def DateSample(e1):
+def DateSample(v, MinDate=None, MaxDate=None):
     """
     Array of observation dates of a vertex.
 
@@ -1444,22 +1549,21 @@ def DateSample(e1):
 
     :Returns:
 
-        list of date
+        list of date (:class:`datetime.date`)
 
     .. seealso:: :func:`MTG`, :func:`FirstDefinedFeature`, :func:`LastDefinedFeature`, :func:`PreviousDate`, :func:`NextDate`.
 
     """
     global _g
-    raise NotImplementedError("Function not yet implemented")
-    pass
+    return dynamic.date_sample(_g, v, MinDate, MaxDate)
 
-def FirstDefinedFeature(e1, e2):
+def FirstDefinedFeature(v, fname, MinDate=None, MaxDate=None):
     """
     Date of first observation of a vertex.
 
     Returns the date `d` for which the attribute `fname` is defined for the first time
     on the vertex `v` passed as an argument. This date must be greater than
-    the option `MinDate` and/or less than the maximum `MaxData` when specified.
+    the option `MinDate` and/or less than the maximum `MaxDate` when specified.
     Otherwise the returned date is None.
 
     :Usage:
@@ -1477,26 +1581,25 @@ def FirstDefinedFeature(e1, e2):
     :Optional Properties:
 
         - MinDate (date) : minimum date of interest.
-        - MaxData (date) : maximum date of interest.
+        - MaxDate (date) : maximum date of interest.
 
     :Returns:
 
-        date
+        date (:class:`datetime.date`)
 
     .. seealso:: :func:`MTG`, :func:`DateSample`, :func:`LastDefinedFeature`, :func:`PreviousDate`, :func:`NextDate`.
 
     """
     global _g
-    raise NotImplementedError("Function not yet implemented")
-    pass
+    return dynamic.first_defined_feature(_g, v, fname, MinDate, MaxDate)
 
-def LastDefinedFeature(e1, e2):
+def LastDefinedFeature(v, fname, MinDate=None, MaxDate=None):
     """
     Date of last observation of a given attribute of a vertex.
 
     Returns the date `d` for which the attribute `fname` is defined for the last time
     on the vertex `v` passed as an argument. This date must be greater than
-    the option `MinDate` and/or less than the maximum `MaxData` when specified.
+    the option `MinDate` and/or less than the maximum `MaxDate` when specified.
     Otherwise the returned date is None.
 
     :Usage:
@@ -1514,19 +1617,18 @@ def LastDefinedFeature(e1, e2):
     :Optional Properties:
 
         - MinDate (date) : minimum date of interest.
-        - MaxData (date) : maximum date of interest.
+        - MaxDate (date) : maximum date of interest.
 
     :Returns:
 
-        date
+        date (:class:`datetime.date`)
 
     .. seealso:: :func:`MTG`, :func:`DateSample`, :func:`FirstDefinedFeature`, :func:`PreviousDate`, :func:`NextDate`.
     """
     global _g
-    raise NotImplementedError("Function not yet implemented")
-    pass
+    return dynamic.last_defined_feature(_g, v, fname, MinDate, MaxDate)
 
-def NextDate(e1):
+def NextDate(v, d):
     """
     Next date at which a vertex has been observed after a specified date
 
@@ -1547,15 +1649,14 @@ def NextDate(e1):
 
     :Returns:
 
-       date
+       date (:class:`datetime.date`)
 
     .. seealso:: :func:`MTG`, :func:`DateSample`, :func:`FirstDefinedFeature`, :func:`LastDefinedFeature`, :func:`PreviousDate`.
     """
     global _g
-    raise NotImplementedError("Function not yet implemented")
-    pass
+    return dynamic.next_date(_g, v, d)
 
-def PreviousDate(e1):
+def PreviousDate(v, d):
     """
     Previous date at which a vertex has been observed after a specified date.
 
@@ -1576,13 +1677,12 @@ def PreviousDate(e1):
 
     :Returns:
 
-       date
+       date (:class:`datetime.date`)
 
     .. seealso:: :func:`MTG`, :func:`DateSample`, :func:`FirstDefinedFeature`, :func:`LastDefinedFeature`, :func:`NextDate`.
     """
     global _g
-    raise NotImplementedError("Function not yet implemented")
-    pass
+    return dynamic.previous_date(_g, v, d)
 
 
 
@@ -0,0 +1,313 @@
+# -*- python -*-
+#
+#       OpenAlea.mtg
+#
+#       Copyright 2008-2016 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.pradal.at.cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+################################################################################
+"""Typed storage of the properties of an MTG.
+
+By default, a property is a `{vid: value}` dict.
+A :class:`PropertyColumn` has the same interface but stores the values
+in a NumPy array indexed by vid, with a mask of the defined values.
+The supported types are:
+
+    - `float64` (or `float`, `REAL`): undefined values are NaN,
+    - `int64` (or `int`, `INT`): undefined values are 0,
+    - `bool`: undefined values are False,
+    - `categorical`: the values are stored as codes in a list of categories.
+      Undefined values are -1.
+
+:Usage:
+
+.. code-block:: python
+
+    g.add_property('length', dtype='float64')
+    g.property('length')[vid] = 1.5
+    lengths = g.property_array('length', scale=3)
+
+.. seealso:: :meth:`openalea.mtg.mtg.MTG.add_property`,
+    :meth:`openalea.mtg.mtg.MTG.property_array`
+"""
+
+__docformat__ = "restructuredtext"
+
+import collections
+import numbers
+import sys
+
+import numpy as np
+
+_DTYPES = {'float64': 'float64', 'float': 'float64', 'REAL': 'float64', float: 'float64',
+           'int64': 'int64', 'int': 'int64', 'INT': 'int64', int: 'int64',
+           'bool': 'bool', bool: 'bool',
+           'categorical': 'categorical',
+           }
+
+_FILL = {'float64': np.nan, 'int64': 0, 'bool': False, 'categorical': -1}
+
+
+def dtype_name(dtype):
+    """ Normalise the name of a column type.
+
+    :Returns: 'float64', 'int64', 'bool' or 'categorical'
+    """
+    try:
+        return _DTYPES[dtype]
+    except (KeyError, TypeError):
+        raise ValueError('Unknown property type %s' % (dtype,))
+
+
+def infer_dtype(values):
+    """ Smallest column type able to store all the `values`. """
+    values = list(values)
+    if not values:
+        return 'float64'
+    if all(isinstance(v, (bool, np.bool_)) for v in values):
+        return 'bool'
+    if all(isinstance(v, numbers.Integral) for v in values):
+        return 'int64'
+    if all(isinstance(v, numbers.Real) for v in values):
+        return 'float64'
+    return 'categorical'
+
+
+def estimate_nbytes(d):
+    """ Estimate the memory used by the values of `d` stored in a column.
+
+    :Parameters:
+        - `d` - a mapping between vid and value
+
+    :Returns:
+        the type of the column and its size in bytes, or (None, None) if
+        the values can not be stored in a column (e.g. lists or geometries).
+    """
+    if not d:
+        return 'float64', 0
+    if any(not isinstance(vid, numbers.Integral) or vid < 0 for vid in d):
+        return None, None
+    values = d.values()
+    dtype = infer_dtype(values)
+    size = max(d) + 1
+    if dtype != 'categorical':
+        return dtype, size * (np.dtype(dtype).itemsize + 1)
+    if not all(isinstance(v, basestring) for v in values):
+        return None, None
+    categories = set(values)
+    nbytes = size * (np.dtype('int32').itemsize + 1)
+    nbytes += sys.getsizeof(list(categories)) + sum(sys.getsizeof(c) for c in categories)
+    return dtype, nbytes
+
+
+class PropertyColumn(collections.MutableMapping):
+    """ Mapping between a vid and a typed value stored in NumPy arrays.
+
+    Values are stored in the array `values` at the index `vid`.
+    The array `valid` indicates which vertices have a value.
+    """
+
+    # True while the arrays are shared with a copy of the column
+    _shared = False
+
+    def __init__(self, dtype='float64', data=None):
+        self.dtype = dtype_name(dtype)
+        code_type = 'int32' if self.dtype == 'categorical' else self.dtype
+
+        self._values = np.empty(0, dtype=code_type)
+        self._valid = np.zeros(0, dtype=bool)
+        self._size = 0
+        self._len = 0
+
+        if self.dtype == 'categorical':
+            self.categories = []
+            self._codes = {}
+
+        if data is not None:
+            self.update(data)
+
+    @classmethod
+    def from_dict(cls, d, dtype=None):
+        """ Create a column from a `{vid: value}` mapping.
+
+        If `dtype` is None, it is inferred from the values.
+        """
+        if dtype is None:
+            dtype = infer_dtype(d.itervalues())
+        return cls(dtype, d)
+
+    @classmethod
+    def from_array(cls, values, mask=None):
+        """ Create a column from an array of values indexed by vid.
+
+        The type of the column is deduced from the type of the array.
+        If `mask` is None, all the values are defined, except NaN values
+        for float arrays.
+        """
+        values = np.asarray(values)
+        if values.dtype.kind == 'f':
+            dtype = 'float64'
+        elif values.dtype.kind in 'iu':
+            dtype = 'int64'
+        elif values.dtype.kind == 'b':
+            dtype = 'bool'
+        else:
+            return cls('categorical', (item for item in enumerate(values.tolist())
+                                       if mask is None or mask[item[0]]))
+
+        if mask is None:
+            mask = ~np.isnan(values) if dtype == 'float64' else np.ones(len(values), dtype=bool)
+        mask = np.asarray(mask, dtype=bool)
+
+        column = cls(dtype)
+        column._values = values.astype(dtype)
+        column._values[~mask] = _FILL[dtype]
+        column._valid = mask.copy()
+        column._size = len(values)
+        column._len = int(mask.sum())
+        return column
+
+    def empty(self):
+        """ Return an empty column with the same type. """
+        return self.__class__(self.dtype)
+
+    def copy(self):
+        """ Return a copy which shares its arrays with this column
+        until one of them is modified.
+        """
+        column = self.empty()
+        column._values = self._values
+        column._valid = self._valid
+        column._size = self._size
+        column._len = self._len
+        if self.dtype == 'categorical':
+            column.categories = self.categories
+            column._codes = self._codes
+        column._shared = self._shared = True
+        return column
+
+    def _own(self):
+        # copy the shared arrays before a modification
+        if not self._shared:
+            return
+        self._values = self._values.copy()
+        self._valid = self._valid.copy()
+        if self.dtype == 'categorical':
+            self.categories = list(self.categories)
+            self._codes = dict(self._codes)
+        self._shared = False
+
+    def _reserve(self, size):
+        capacity = len(self._values)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity, 16)
+
+        values = np.empty(capacity, dtype=self._values.dtype)
+        values.fill(_FILL[self.dtype])
+        values[:len(self._values)] = self._values
+        valid = np.zeros(capacity, dtype=bool)
+        valid[:len(self._valid)] = self._valid
+
+        self._values = values
+        self._valid = valid
+
+    def _code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            code = self._codes[value] = len(self.categories)
+            self.categories.append(value)
+        return code
+
+    def __getitem__(self, vid):
+        try:
+            if vid < 0 or not self._valid[vid]:
+                raise KeyError(vid)
+        except (IndexError, TypeError):
+            raise KeyError(vid)
+        value = self._values[vid]
+        if self.dtype == 'categorical':
+            return self.categories[value]
+        return value.item()
+
+    def __setitem__(self, vid, value):
+        if not isinstance(vid, numbers.Integral) or vid < 0:
+            raise KeyError(vid)
+        self._own()
+        if self.dtype == 'categorical':
+            value = self._code(value)
+        self._reserve(vid + 1)
+        self._values[vid] = value
+        if not self._valid[vid]:
+            self._valid[vid] = True
+            self._len += 1
+            self._size = max(self._size, vid + 1)
+
+    def __delitem__(self, vid):
+        if vid not in self:
+            raise KeyError(vid)
+        self._own()
+        self._valid[vid] = False
+        self._values[vid] = _FILL[self.dtype]
+        self._len -= 1
+
+    def discard(self, vids):
+        """ Remove the values of the vertices `vids` if they are defined. """
+        vids = np.fromiter((vid for vid in vids if vid in self), dtype=int)
+        self._own()
+        self._valid[vids] = False
+        self._values[vids] = _FILL[self.dtype]
+        self._len -= len(vids)
+
+    def __contains__(self, vid):
+        try:
+            return vid >= 0 and bool(self._valid[vid])
+        except (IndexError, TypeError):
+            return False
+
+    def __iter__(self):
+        return iter(np.flatnonzero(self._valid[:self._size]).tolist())
+
+    def __len__(self):
+        return self._len
+
+    def __repr__(self):
+        return '%s(%r, %r)' % (self.__class__.__name__, self.dtype, dict(self.iteritems()))
+
+    def array(self, vids=None):
+        """ Values of the vertices `vids`.
+
+        If `vids` is None, return a view on the values indexed by vid.
+        Undefined values are NaN (float), 0 (int), False (bool)
+        or -1 (codes of the categories).
+        """
+        values = self._values[:self._size]
+        if vids is None:
+            return values
+        vids = np.asarray(vids, dtype=int)
+        result = np.empty(len(vids), dtype=values.dtype)
+        result.fill(_FILL[self.dtype])
+        inside = (vids >= 0) & (vids < self._size)
+        result[inside] = values[vids[inside]]
+        return result
+
+    def mask(self, vids=None):
+        """ Boolean array which is True for the vertices which have a value.
+
+        If `vids` is None, return a view indexed by vid.
+        """
+        valid = self._valid[:self._size]
+        if vids is None:
+            return valid
+        vids = np.asarray(vids, dtype=int)
+        result = np.zeros(len(vids), dtype=bool)
+        inside = (vids >= 0) & (vids < self._size)
+        result[inside] = valid[vids[inside]]
+        return result
@@ -0,0 +1,456 @@
+# -*- python -*-
+#
+#       OpenAlea.mtg
+#
+#       Copyright 2008-2016 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.pradal.at.cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+################################################################################
+"""Dated observations of the vertices of a dynamic MTG.
+
+In a dynamic MTG, a vertex is observed at several dates.
+The values of a feature observed at several dates are stored in a
+:class:`TimeSeries`: the dates are sorted, and the value at a date,
+the first or last date of a time window, the next or previous
+observation are found by binary search.
+
+The date feature (`Date` by default) of a vertex observed several
+times is itself a :class:`TimeSeries` of the observation dates.
+A value which is not a :class:`TimeSeries` has been observed at
+the first observation date of the vertex.
+
+:func:`at_date` returns a read-only view of the MTG as it was at a date:
+the vertices observed later are hidden and each value is the last one
+observed before the date.
+
+:Usage:
+
+.. code-block:: python
+
+    g = read_mtg_file('dynamic.mtg')
+    dates = date_sample(g, vid, min_date='01/01/2008')
+    length = feature(g, vid, 'Long', dates[0])
+
+.. seealso:: :func:`openalea.mtg.aml.DateSample`, :func:`openalea.mtg.aml.Feature`
+"""
+
+__docformat__ = "restructuredtext"
+
+import copy
+import datetime
+from bisect import bisect_left, bisect_right
+
+from storage import _ReadOnlyMap
+
+# Features which are not observed at each date
+STATIC_FEATURES = ('index', 'label', 'edge_type', '_line')
+
+
+def to_date(d):
+    """ Convert `d` to a :class:`datetime.date`.
+
+    :Parameters:
+        - `d`: a date or a string 'DD/MM/YYYY', 'DD/MM/YY', 'DD-MM-YYYY'
+          or 'DD-MM-YY'.
+    """
+    if isinstance(d, datetime.datetime):
+        return d.date()
+    if isinstance(d, datetime.date):
+        return d
+    try:
+        day, month, year = d.replace('/', '-').split('-')
+        if len(year) == 2:
+            return datetime.datetime.strptime(d.replace('/', '-'), '%d-%m-%y').date()
+        return datetime.date(int(year), int(month), int(day))
+    except (AttributeError, ValueError):
+        raise ValueError('Invalid date %r' % (d,))
+
+
+class TimeSeries(object):
+    """ Values of a feature of a vertex observed at several dates.
+
+    The dates are stored in increasing order in `dates`,
+    and the values in the same order in `values`.
+    """
+
+    __slots__ = ('dates', 'values')
+
+    def __init__(self, items=()):
+        self.dates = []
+        self.values = []
+        for date, value in items:
+            self[date] = value
+
+    def __len__(self):
+        return len(self.dates)
+
+    def __iter__(self):
+        return iter(self.dates)
+
+    def items(self):
+        """ List of the (date, value) observations in increasing order. """
+        return zip(self.dates, self.values)
+
+    def __eq__(self, other):
+        return isinstance(other, TimeSeries) and self.items() == other.items()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.items())
+
+    def _find(self, date):
+        date = to_date(date)
+        i = bisect_left(self.dates, date)
+        return date, i, i < len(self.dates) and self.dates[i] == date
+
+    def __contains__(self, date):
+        return self._find(date)[2]
+
+    def __getitem__(self, date):
+        date, i, found = self._find(date)
+        if not found:
+            raise KeyError(date)
+        return self.values[i]
+
+    def get(self, date, default=None):
+        """ Value observed at `date`, or `default`. """
+        date, i, found = self._find(date)
+        return self.values[i] if found else default
+
+    def __setitem__(self, date, value):
+        dates = self.dates
+        date = to_date(date)
+        if not dates or dates[-1] < date:
+            # observations are usually added in chronological order
+            dates.append(date)
+            self.values.append(value)
+            return
+        date, i, found = self._find(date)
+        if found:
+            self.values[i] = value
+        else:
+            dates.insert(i, date)
+            self.values.insert(i, value)
+
+    def at(self, date):
+        """ Value of the last observation at or before `date`.
+
+        Raise a KeyError if there is no observation before `date`.
+        """
+        i = bisect_right(self.dates, to_date(date))
+        if not i:
+            raise KeyError(date)
+        return self.values[i - 1]
+
+    def window(self, min_date=None, max_date=None):
+        """ Positions [first, last[ of the dates between `min_date`
+        and `max_date` (included).
+        """
+        dates = self.dates
+        first = 0 if min_date is None else bisect_left(dates, to_date(min_date))
+        last = len(dates) if max_date is None else bisect_right(dates, to_date(max_date))
+        return first, max(first, last)
+
+    def dates_between(self, min_date=None, max_date=None):
+        """ Dates between `min_date` and `max_date` (included). """
+        first, last = self.window(min_date, max_date)
+        return self.dates[first:last]
+
+    def first_defined(self, min_date=None, max_date=None):
+        """ First date between `min_date` and `max_date` with a value, or None. """
+        first, last = self.window(min_date, max_date)
+        values = self.values
+        for i in xrange(first, last):
+            if values[i] is not None:
+                return self.dates[i]
+
+    def last_defined(self, min_date=None, max_date=None):
+        """ Last date between `min_date` and `max_date` with a value, or None. """
+        first, last = self.window(min_date, max_date)
+        values = self.values
+        for i in xrange(last - 1, first - 1, -1):
+            if values[i] is not None:
+                return self.dates[i]
+
+    def next_date(self, date):
+        """ First date after `date`, or None. """
+        i = bisect_right(self.dates, to_date(date))
+        return self.dates[i] if i < len(self.dates) else None
+
+    def previous_date(self, date):
+        """ Last date before `date`, or None. """
+        i = bisect_left(self.dates, to_date(date))
+        return self.dates[i - 1] if i else None
+
+
+def date_feature(g):
+    """ Name of the feature which stores the observation dates of `g`. """
+    name = g.graph_properties().get('date_feature')
+    if name is None:
+        names = g.property_names()
+        name = 'date' if 'date' in names and 'Date' not in names else 'Date'
+    return name
+
+
+def series(g, vid, name):
+    """ Observations of the feature `name` of `vid` (:class:`TimeSeries`).
+
+    A value which is not a time series is observed at the first
+    observation date of the vertex.
+    """
+    value = g.property(name).get(vid)
+    if isinstance(value, TimeSeries):
+        return value
+    dates = g.properties().get(date_feature(g), {}).get(vid)
+    if value is None or dates is None:
+        return TimeSeries()
+    if isinstance(dates, TimeSeries):
+        return TimeSeries([(dates.dates[0], value)])
+    return TimeSeries([(dates, value)])
+
+
+def add_observation(g, vid, date, values):
+    """ Add the `values` observed at `date` on `vid`.
+
+    The values of `vid` already observed are converted to time series.
+
+    :Parameters:
+        - `g`: a dynamic MTG
+        - `vid`: the observed vertex
+        - `date`: the date of the observation
+        - `values`: dict of the observed features (the date feature
+          and the static features are ignored)
+    """
+    name = date_feature(g)
+    dates = g.property(name)
+    old_date = dates.get(vid)
+    # first observation date, before the new date is added
+    first_date = None
+    if old_date is None:
+        dates[vid] = date
+    else:
+        if not isinstance(old_date, TimeSeries):
+            old_date = dates[vid] = TimeSeries([(old_date, old_date)])
+        first_date = old_date.dates[0]
+        old_date[date] = date
+
+    for feature, value in values.iteritems():
+        if feature == name or feature in STATIC_FEATURES:
+            continue
+        prop = g.property(feature)
+        old = prop.get(vid)
+        if isinstance(old, TimeSeries):
+            old[date] = value
+        elif old is not None and first_date is not None:
+            prop[vid] = TimeSeries([(first_date, old), (date, value)])
+        else:
+            prop[vid] = TimeSeries([(date, value)])
+
+    # the first observation date of vid may have changed
+    g._traversal_cache().pop('births', None)
+
+
+def date_sample(g, vid, min_date=None, max_date=None):
+    """ Observation dates of `vid` between `min_date` and `max_date`. """
+    return series(g, vid, date_feature(g)).dates_between(min_date, max_date)
+
+
+def feature(g, vid, name, date=None):
+    """ Value of the feature `name` of `vid` observed at `date`.
+
+    If `date` is None, return the value or the time series of the feature.
+    Return None if `vid` has not been observed at `date`.
+    """
+    if date is None:
+        return g.property(name).get(vid)
+    return series(g, vid, name).get(date)
+
+
+def first_defined_feature(g, vid, name, min_date=None, max_date=None):
+    """ First date between `min_date` and `max_date` at which the
+    feature `name` of `vid` is defined, or None.
+    """
+    return series(g, vid, name).first_defined(min_date, max_date)
+
+
+def last_defined_feature(g, vid, name, min_date=None, max_date=None):
+    """ Last date between `min_date` and `max_date` at which the
+    feature `name` of `vid` is defined, or None.
+    """
+    return series(g, vid, name).last_defined(min_date, max_date)
+
+
+def next_date(g, vid, date):
+    """ First observation date of `vid` after `date`, or None. """
+    return series(g, vid, date_feature(g)).next_date(date)
+
+
+def previous_date(g, vid, date):
+    """ Last observation date of `vid` before `date`, or None. """
+    return series(g, vid, date_feature(g)).previous_date(date)
+
+
+################################################################################
+# Views of an MTG at a date
+################################################################################
+
+class _DatedMap(_ReadOnlyMap):
+    """ Read-only view of the items of a mapping whose vertex is visible. """
+
+    def __init__(self, d, visible):
+        self._map = d
+        self._visible = visible
+
+    def _frozen(self, *args, **kwds):
+        from storage import FrozenGraphError
+        raise FrozenGraphError('A view of an MTG at a date can not be edited.')
+
+    __setitem__ = __delitem__ = _frozen
+    setdefault = update = pop = popitem = clear = mutable = _frozen
+
+    def _arrays(self):
+        return ()
+
+    def _value(self, value):
+        return value
+
+    def __getitem__(self, vid):
+        if not self._visible(vid):
+            raise KeyError(vid)
+        return self._value(self._map[vid])
+
+    def __contains__(self, vid):
+        try:
+            self[vid]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return (vid for vid in self._map if vid in self)
+
+    def __len__(self):
+        return sum(1 for vid in self)
+
+
+class _VertexMap(_DatedMap):
+    """ vid -> vid (parent, complex). Hidden vertices are None. """
+
+    def _value(self, vid):
+        return vid if vid is None or self._visible(vid) else None
+
+
+class _VerticesMap(_DatedMap):
+    """ vid -> [vid] (children, components) without the hidden vertices. """
+
+    def _value(self, vids):
+        visible = self._visible
+        return [vid for vid in vids if visible(vid)]
+
+
+class _ScaleView(_DatedMap):
+    """ vid -> scale, with the vertices of each scale. """
+
+    def vertices_at(self, scale):
+        visible = self._visible
+        return [vid for vid in self._map.vertices_at(scale) if visible(vid)]
+
+    def nb_vertices_at(self, scale):
+        return len(self.vertices_at(scale))
+
+    def scales(self):
+        return [scale for scale in self._map.scales() if self.vertices_at(scale)]
+
+
+class _PropertyView(_DatedMap):
+    """ vid -> value observed at the last date before `date`. """
+
+    def __init__(self, d, visible, date):
+        _DatedMap.__init__(self, d, visible)
+        self._date = date
+
+    def _value(self, value):
+        if isinstance(value, TimeSeries):
+            return value.at(self._date)
+        return value
+
+
+def births(g):
+    """ First observation date of the vertices of `g`.
+
+    A vertex without date is observed with its complex.
+    The dates are computed once for a given version of the topology,
+    and again after :func:`add_observation`. Call
+    :meth:`~openalea.mtg.mtg.MTG.clear_caches` after editing the
+    observation dates by other means.
+
+    :Returns: a dict vid -> date (None for vertices which are always visible)
+    """
+    dates = g.properties().get(date_feature(g), {})
+    cache = g._traversal_cache()
+    key = (id(dates), len(dates))
+    cached = cache.get('births')
+    if cached is not None and cached[0] == key:
+        result = cached[1]
+    else:
+        result = {}
+        for scale in sorted(g.scales()):
+            for vid in g.vertices(scale=scale):
+                d = dates.get(vid)
+                if isinstance(d, TimeSeries):
+                    d = d.dates[0] if d.dates else None
+                elif d is not None:
+                    d = to_date(d)
+                else:
+                    cid = g.complex(vid)
+                    d = None if cid is None else result.get(cid)
+                result[vid] = d
+        cache['births'] = key, result
+    return result
+
+
+def at_date(g, date):
+    """ Read-only view of `g` at `date`.
+
+    The view shares the topology and the properties of `g`:
+
+        - the vertices observed after `date` are hidden,
+        - the value of a time series is the last value observed
+          at or before `date`.
+
+    Editing the view raises a :class:`~openalea.mtg.storage.FrozenGraphError`.
+
+    :Returns: an MTG
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.at_date`
+    """
+    date = to_date(date)
+    born = births(g)
+
+    def visible(vid):
+        d = born.get(vid, date)
+        return d is None or d <= date
+
+    view = copy.copy(g)
+    view._parent = _VertexMap(g._parent, visible)
+    view._complex = _VertexMap(g._complex, visible)
+    view._children = _VerticesMap(g._children, visible)
+    view._components = _VerticesMap(g._components, visible)
+    view._scale = _ScaleView(g._scale, visible)
+    view._properties = dict((name, _PropertyView(p, visible, date))
+                            for name, p in g._properties.iteritems())
+    view._graph_properties = dict(g._graph_properties, date=date)
+    view._resolved_complex = {}
+    view._traversal_orders = {}
+    view._traversal_state = None
+    view._topology_changed()
+    return view
@@ -0,0 +1,558 @@
+# -*- python -*-
+#
+#       OpenAlea.mtg
+#
+#       Copyright 2008-2016 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.pradal.at.cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+################################################################################
+"""Indices to speed up topological queries on an MTG.
+
+An index is computed once from the topology of an MTG and answers some
+queries without walking the graph.
+Indices are not updated when the MTG is edited: the MTG drops them
+on each topological edition and they have to be built again.
+"""
+
+__docformat__ = "restructuredtext"
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+
+def _components(g, cid):
+    """ Components of `cid` in the order of :meth:`MTG.components_iter`.
+
+    Non recursive version of the traversal: each component root is
+    traversed in pre order ('+' children before '<' children)
+    without leaving the complex `cid`.
+    """
+    edge_type = g.property('edge_type')
+    complex = g.complex
+
+    components = []
+    for root in g.component_roots_iter(cid):
+        stack = [root]
+        while stack:
+            vid = stack.pop()
+            components.append(vid)
+            children = [v for v in g.children_iter(vid) if complex(v) == cid]
+            successors = [v for v in children if edge_type.get(v) == '<']
+            branches = [v for v in children if edge_type.get(v) != '<']
+            stack.extend(reversed(successors))
+            stack.extend(reversed(branches))
+    return components
+
+
+class ContainmentIndex(object):
+    """ Index of the decomposition relation of an MTG.
+
+    The vertices are numbered in pre order of the decomposition tree
+    (a complex, then its components at all the finer scales).
+    The components of a vertex `c` at any scale are then numbered in the
+    interval [start(c), end(c)].
+    For each scale, the positions of the vertices are sorted,
+    so that the queries are done in O(1) or O(log n):
+
+        - `v` is contained in `c` if start(c) <= start(v) <= end(c),
+        - the complex of `v` at a scale is found by bisection,
+        - the components of `c` at a scale are a slice of a sorted list.
+
+    :Usage:
+
+    .. code-block:: python
+
+        index = g.build_containment_index()
+        index.contains(complex_id, vid)
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.build_containment_index`
+    """
+
+    def __init__(self, g):
+        start = {}
+        end = {}
+        positions = {}
+        vertices = {}
+        scale = g.scale
+
+        order = []
+        children = {}
+        stack = [g.root]
+        while stack:
+            vid = stack.pop()
+            start[vid] = len(order)
+            order.append(vid)
+
+            s = scale(vid)
+            positions.setdefault(s, []).append(start[vid])
+            vertices.setdefault(s, []).append(vid)
+
+            components = children[vid] = _components(g, vid)
+            stack.extend(reversed(components))
+
+        for vid in reversed(order):
+            components = children.pop(vid)
+            end[vid] = end[components[-1]] if components else start[vid]
+
+        self._start = start
+        self._end = end
+        self._positions = positions
+        self._vertices = vertices
+
+    def __contains__(self, vid):
+        return vid in self._start
+
+    def contains(self, complex_id, vid):
+        """ Return True if `vid` is `complex_id` or one of its components
+        at any scale.
+        """
+        try:
+            pos = self._start[vid]
+            return self._start[complex_id] <= pos <= self._end[complex_id]
+        except KeyError:
+            return False
+
+    def complex_at_scale(self, vid, scale):
+        """ Return the complex of `vid` at `scale` (or None). """
+        pos = self._start[vid]
+        positions = self._positions.get(scale)
+        if not positions:
+            return None
+        i = bisect_right(positions, pos) - 1
+        if i < 0:
+            return None
+        cid = self._vertices[scale][i]
+        if self._end[cid] < pos:
+            return None
+        return cid
+
+    def components_at_scale(self, complex_id, scale):
+        """ Return the list of the components of `complex_id` at `scale`. """
+        positions = self._positions.get(scale)
+        if not positions:
+            return []
+        first = bisect_left(positions, self._start[complex_id])
+        last = bisect_right(positions, self._end[complex_id])
+        return self._vertices[scale][first:last]
+
+
+class TraversalIndex(object):
+    """ Pre order traversal of the vertices at a scale of an MTG.
+
+    The vertices are stored in pre order, the '+' children before the '<'
+    children, as in :func:`~openalea.mtg.traversal.pre_order2`.
+    The vertices of the sub tree rooted on `v` are then stored in the
+    interval [position(v), position(v) + size(v)[:
+
+        - :meth:`pre_order` (the descendants of `v`) is a slice of the order,
+        - :meth:`post_order` is the reversed slice, which is the order of
+          :func:`~openalea.mtg.traversal.post_order2`,
+        - :meth:`is_ancestor` compares the positions of two vertices,
+        - :meth:`extremities` is a slice of the leaves in pre order.
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.traversal_index`
+    """
+
+    def __init__(self, g, scale):
+        edge_type = g.property('edge_type')
+        order = array('l')
+        position = {}
+        size = array('l')
+
+        roots = [v for v in g.vertices_iter(scale) if g.parent(v) is None]
+        stack = list(reversed(roots))
+        while stack:
+            vid = stack.pop()
+            if vid < 0:
+                # all the sub tree of ~vid has been traversed
+                vid = ~vid
+                i = position[vid]
+                size[i] = len(order) - i
+                continue
+
+            position[vid] = len(order)
+            order.append(vid)
+            size.append(1)
+            stack.append(~vid)
+
+            children = list(g.children_iter(vid))
+            stack.extend(reversed([v for v in children if edge_type.get(v) == '<']))
+            stack.extend(reversed([v for v in children if edge_type.get(v) != '<']))
+
+        self.order = order
+        self._position = position
+        self._size = size
+        self._leaf_positions = array('l', (i for i, n in enumerate(size) if n == 1))
+        self.leaves = array('l', (order[i] for i in self._leaf_positions))
+
+    def __contains__(self, vid):
+        return vid in self._position
+
+    def __len__(self):
+        return len(self.order)
+
+    def size(self, vid):
+        """ Number of vertices in the sub tree rooted on `vid`. """
+        return self._size[self._position[vid]]
+
+    def pre_order(self, vid):
+        """ Vertices of the sub tree rooted on `vid` in pre order (array). """
+        i = self._position[vid]
+        return self.order[i:i + self._size[i]]
+
+    def post_order(self, vid):
+        """ Vertices of the sub tree rooted on `vid` in post order (array). """
+        order = self.pre_order(vid)
+        order.reverse()
+        return order
+
+    def is_ancestor(self, vid1, vid2):
+        """ Return True if `vid1` is `vid2` or one of its ancestors. """
+        i, j = self._position[vid1], self._position[vid2]
+        return i <= j < i + self._size[i]
+
+    def extremities(self, vid):
+        """ Leaves of the sub tree rooted on `vid` in pre order (array). """
+        i = self._position[vid]
+        positions = self._leaf_positions
+        first = bisect_left(positions, i)
+        last = bisect_left(positions, i + self._size[i])
+        return self.leaves[first:last]
+
+
+class LCAIndex(object):
+    """ Index of the ancestors of the vertices at a scale of an MTG.
+
+    The ancestors of each vertex at distance 1, 2, 4, ..., 2^k are stored
+    in NumPy arrays (binary lifting), so that:
+
+        - the lowest common ancestor of two vertices is found in O(log n),
+          and in one vectorised pass for arrays of vertices (:meth:`lca_array`),
+        - the ancestor relation and the length of a path are computed
+          in O(log n).
+
+    The number of '+' and of '<' edges from the root to each vertex are
+    stored too, to count the edges on a path without walking it.
+
+    :Usage:
+
+    .. code-block:: python
+
+        index = g.lca_index(scale=3)
+        index.lca(v1, v2)
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.lca_index`,
+        :func:`openalea.mtg.algo.lca`
+    """
+
+    def __init__(self, g, scale, traversal_index=None):
+        import numpy as np
+
+        if traversal_index is None:
+            traversal_index = TraversalIndex(g, scale)
+        vertices = np.array(traversal_index.order, dtype=int)
+        position = traversal_index._position
+        n = len(vertices)
+
+        edge_type = g.property('edge_type')
+        is_plus = [int(edge_type.get(v) == '+') for v in traversal_index.order]
+        is_successor = [int(edge_type.get(v) == '<') for v in traversal_index.order]
+
+        parent = range(n)
+        depth = [0] * n
+        root = range(n)
+        # number of '+' and '<' vertices from the root
+        plus = list(is_plus)
+        successor = list(is_successor)
+
+        # the vertices are in pre order: a parent is before its children
+        for i, vid in enumerate(traversal_index.order):
+            p = position.get(g.parent(vid), -1)
+            if p >= 0:
+                parent[i] = p
+                depth[i] = depth[p] + 1
+                root[i] = root[p]
+                plus[i] += plus[p]
+                successor[i] += successor[p]
+
+        depth = np.array(depth, dtype=int)
+        root = np.array(root, dtype=int)
+
+        levels = max(1, int(depth.max()).bit_length()) if n else 1
+        up = np.empty((levels, n), dtype=int)
+        up[0] = np.array(parent, dtype=int)
+        for k in range(1, levels):
+            up[k] = up[k - 1][up[k - 1]]
+
+        self.vertices = vertices
+        self._position = position
+        self._size = traversal_index._size
+        self._depth = depth
+        self._root = root
+        self._up = up
+        self._counts = dict((edge, (np.array(counts, dtype=int), np.array(flags, dtype=int)))
+                            for edge, counts, flags in (('+', plus, is_plus),
+                                                        ('<', successor, is_successor)))
+
+    def __contains__(self, vid):
+        return vid in self._position
+
+    def __len__(self):
+        return len(self.vertices)
+
+    def depth(self, vid):
+        """ Number of edges between `vid` and its root. """
+        return int(self._depth[self._position[vid]])
+
+    def _ancestor(self, i, distance):
+        """ Position of the ancestor of the vertex at position `i`. """
+        up = self._up
+        k = 0
+        while distance:
+            if distance & 1:
+                i = int(up[k, i])
+            distance >>= 1
+            k += 1
+        return i
+
+    def _lca(self, i, j):
+        depth = self._depth
+        if self._root[i] != self._root[j]:
+            return None
+        if depth[i] < depth[j]:
+            i, j = j, i
+        i = self._ancestor(i, int(depth[i] - depth[j]))
+        if i == j:
+            return i
+        up = self._up
+        for k in reversed(range(len(up))):
+            if up[k, i] != up[k, j]:
+                i, j = int(up[k, i]), int(up[k, j])
+        return int(up[0, i])
+
+    def lca(self, vid1, vid2):
+        """ Lowest common ancestor of `vid1` and `vid2` (None if they
+        belong to different trees).
+        """
+        i = self._lca(self._position[vid1], self._position[vid2])
+        return None if i is None else int(self.vertices[i])
+
+    def lca_array(self, vids1, vids2):
+        """ Lowest common ancestors of two arrays of vertices.
+
+        :Returns: an array of vertices (-1 for vertices in different trees).
+        """
+        i, j = self.positions(vids1), self.positions(vids2)
+        result = self._lca_positions(i, j)
+        vertices = self.vertices[result]
+        vertices[result < 0] = -1
+        return vertices
+
+    def positions(self, vids):
+        """ Positions of the vertices `vids` in the index (array). """
+        import numpy as np
+
+        position = self._position
+        return np.array([position[v] for v in vids], dtype=int)
+
+    def _lca_positions(self, i, j):
+        """ Positions of the lowest common ancestors of the vertices at
+        positions `i` and `j` (arrays), -1 for vertices in different trees.
+        """
+        import numpy as np
+
+        i, j = i.copy(), j.copy()
+        depth, up = self._depth, self._up
+
+        # i is the deepest vertex
+        swap = depth[i] < depth[j]
+        i[swap], j[swap] = j[swap], i[swap].copy()
+
+        distance = depth[i] - depth[j]
+        for k in range(len(up)):
+            lift = (distance >> k) & 1 == 1
+            i[lift] = up[k][i[lift]]
+
+        for k in reversed(range(len(up))):
+            differ = up[k][i] != up[k][j]
+            i[differ] = up[k][i[differ]]
+            j[differ] = up[k][j[differ]]
+
+        result = np.where(i == j, i, up[0][i])
+        result[self._root[i] != self._root[j]] = -1
+        return result
+
+    def path_sums(self, weights):
+        """ Sum of the weights of the vertices from the root to each vertex.
+
+        :Parameters:
+            - `weights`: array of weights, in the order of `vertices`.
+
+        :Returns: an array in the order of `vertices`.
+        """
+        import numpy as np
+
+        sums = np.asarray(weights, dtype=float).tolist()
+        parent = self._up[0].tolist()
+        # the vertices are in pre order: a parent is before its children
+        for i, p in enumerate(parent):
+            if p != i:
+                sums[i] += sums[p]
+        return np.array(sums)
+
+    def is_ancestor(self, vid1, vid2):
+        """ Return True if `vid1` is `vid2` or one of its ancestors. """
+        i, j = self._position[vid1], self._position[vid2]
+        return i <= j < i + self._size[i]
+
+    def path_length(self, vid1, vid2):
+        """ Number of edges between `vid1` and `vid2` (None if they
+        belong to different trees).
+        """
+        i, j = self._position[vid1], self._position[vid2]
+        k = self._lca(i, j)
+        if k is None:
+            return None
+        depth = self._depth
+        return int(depth[i] + depth[j] - 2 * depth[k])
+
+    def count(self, ancestor, vid, edge_type=None):
+        """ Number of vertices on the path from `ancestor` to `vid` (both
+        included) whose edge type is `edge_type` ('+' or '<', or any if None).
+
+        `ancestor` has to be an ancestor of `vid`.
+        """
+        i, j = self._position[ancestor], self._position[vid]
+        if edge_type is None:
+            return int(self._depth[j] - self._depth[i]) + 1
+        counts, flags = self._counts[edge_type]
+        return int(counts[j] - counts[i] + flags[i])
+
+    def successor_run(self, ancestor, vid):
+        """ Number of consecutive '<' vertices on the path from `ancestor`
+        to `vid`, starting at `ancestor`.
+
+        `ancestor` has to be an ancestor of `vid`.
+        """
+        i, j = self._position[ancestor], self._position[vid]
+        counts, flags = self._counts['<']
+        if not flags[i]:
+            return 0
+
+        # counts - depth decreases along a path, except on '<' vertices
+        depth, up = self._depth, self._up
+        base = counts[i] - depth[i]
+        if counts[j] - depth[j] == base:
+            return int(depth[j] - depth[i]) + 1
+
+        # shallowest vertex below i which is not a '<' vertex
+        for k in reversed(range(len(up))):
+            a = up[k, j]
+            if depth[a] > depth[i] and counts[a] - depth[a] < base:
+                j = a
+        return int(depth[j] - depth[i])
+
+    def depths(self, vids):
+        """ Number of edges between each vertex of `vids` and its root (array). """
+        return self._depth[self.positions(vids)]
+
+    def edge_counts(self, vids, edge_type):
+        """ Number of `edge_type` ('+' or '<') vertices on the path from
+        the root to each vertex of `vids` (array).
+        """
+        counts, flags = self._counts[edge_type]
+        return counts[self.positions(vids)]
+
+    def successor_runs(self, vids):
+        """ Number of consecutive '<' vertices on the path from each vertex
+        of `vids` to its root, starting at the vertex (array).
+        """
+        import numpy as np
+
+        i = self.positions(vids)
+        counts, flags = self._counts['<']
+        depth, up = self._depth, self._up
+
+        # counts - depth - flags is constant along a run of '<' vertices
+        # and increases above it
+        key = counts - depth - flags
+        j = i.copy()
+        for k in reversed(range(len(up))):
+            a = up[k][j]
+            move = (depth[a] < depth[j]) & (key[a] == key[i])
+            j[move] = a[move]
+        runs = depth[i] - depth[j] + 1
+        runs[flags[i] == 0] = 0
+        return runs
+
+
+class DescriptorIndex(object):
+    """ Topological descriptors of the vertices at a scale of an MTG.
+
+    The descriptors are computed in one pre order traversal and stored
+    in dicts, so that each query is O(1):
+
+        - `order`: number of '+' vertices from the root to the vertex,
+        - `height`: number of edges between the root and the vertex,
+        - `rank`: number of consecutive '<' vertices from the vertex
+          to the root, starting at the vertex,
+        - `axis`: first vertex of the axis of the vertex.
+
+    The ancestor relation is given by the :class:`TraversalIndex`.
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.cache_descriptors`
+    """
+
+    def __init__(self, g, scale, traversal_index=None):
+        if traversal_index is None:
+            traversal_index = TraversalIndex(g, scale)
+        edge_type = g.property('edge_type')
+
+        order, height, rank, axis = {}, {}, {}, {}
+        # the vertices are in pre order: a parent is before its children
+        for vid in traversal_index.order:
+            et = edge_type.get(vid)
+            pid = g.parent(vid)
+            if pid is None:
+                order[vid], height[vid] = int(et == '+'), 0
+                rank[vid], axis[vid] = int(et == '<'), vid
+            else:
+                order[vid] = order[pid] + (et == '+')
+                height[vid] = height[pid] + 1
+                rank[vid] = rank[pid] + 1 if et == '<' else 0
+                axis[vid] = axis[pid] if et == '<' else vid
+
+        self.order = order
+        self.height = height
+        self.rank = rank
+        self.axis = axis
+        self._traversal_index = traversal_index
+        self._edge_type = edge_type
+
+    def __contains__(self, vid):
+        return vid in self.height
+
+    def __len__(self):
+        return len(self.height)
+
+    def is_ancestor(self, vid1, vid2):
+        """ Return True if `vid1` is `vid2` or one of its ancestors. """
+        return self._traversal_index.is_ancestor(vid1, vid2)
+
+    def count(self, ancestor, vid, edge_type=None):
+        """ Number of vertices on the path from `ancestor` to `vid` (both
+        included) whose edge type is `edge_type` ('+', or any if None).
+
+        `ancestor` has to be an ancestor of `vid`.
+        """
+        if edge_type is None:
+            return self.height[vid] - self.height[ancestor] + 1
+        return (self.order[vid] - self.order[ancestor] +
+                (self._edge_type.get(ancestor) == '+'))
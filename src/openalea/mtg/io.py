@@ -22,6 +22,7 @@ from warnings import warn
 
 from mtg import *
 from traversal import iter_mtg, iter_mtg_with_filter
+import dynamic
 
 try:
     from openalea.core.logger import get_logger, logging
@@ -88,12 +89,14 @@ def replace_date(s, format):
 
     return re.sub(rawstr, change_date, s)
 
-def multiscale_edit(s, symbol_at_scale = {}, class_type={}, has_date = False, mtg=None):
+def multiscale_edit(s, symbol_at_scale = {}, class_type={}, has_date = False, mtg=None, typed=False):
     """Construction of an MTG from a string.
 
     :Parameters:
 
-    - `s`: The string representing the MTG.
+    - `s`: The string representing the MTG, or an iterable of consecutive
+      pieces of this string (e.g. one piece per line of a file), which
+      are parsed one after the other. A node can not be split between pieces.
     - `symbol_at_scale`: A dict containing the scale for each symbol name.
 
     :Optional parameters:
@@ -101,6 +104,9 @@ def multiscale_edit(s, symbol_at_scale = {}, class_type={}, has_date = False, mt
     - `class_type`: A dict containing the type of the properties.
 	- `has_date`: Is the MTG is a Dynamic MTG?
 	- `mtg`: An existing MTG
+	- `typed`: Store the INT and REAL properties in typed columns
+	  (see :meth:`~openalea.mtg.mtg.MTG.add_property`).
+	  Ignored for dynamic MTGs.
 
 
 
@@ -136,31 +142,12 @@ def multiscale_edit(s, symbol_at_scale = {}, class_type={}, has_date = False, mt
         return args
 
     def add_dynamic_properties(mtg, vid, args):
-        print "Existing properties at ", vid, " ", mtg.get_vertex_property(vid)
-        print "New property: ", args
-
-        # a property can be a list but not a timeserie.
-        # Create a real timeserie object...
-        static_properties = ['index', 'label']
-        is_time_series= lambda x: isinstance(x,list)
-        date = 'Date'
-
-        new_date = args.get(date)
+        log('New observation of', vid, args)
 
+        new_date = args.get(date_name)
         if new_date is None:
             return
-
-        old_date = mtg.property(date)[vid]
-        for prop in args:
-            if prop == date:
-                continue
-            old = mtg.property(prop).get(vid)
-            if is_time_series(old):
-                old.append((new_date, args[prop]))
-            elif old:
-                mtg.property(prop)[vid] = [(old_date, old), (new_date, args[prop])]
-            else:
-                mtg.property(prop)[vid] = [(new_date, args[prop])]
+        dynamic.add_observation(mtg, vid, new_date, args)
 
 
 
@@ -184,37 +171,49 @@ def multiscale_edit(s, symbol_at_scale = {}, class_type={}, has_date = False, mt
     scale = 0
 
     # 2. add some properties to the MTG
-    mtg.add_property('index')
-    for k in class_type:
-        mtg.add_property(k)
+    if typed and not has_date:
+        _dtype = dict([('INT', 'int64'), ('REAL', 'float64')])
+        mtg.add_property('index', dtype='int64')
+        for k in class_type:
+            mtg.add_property(k, dtype=_dtype.get(class_type[k]))
+    else:
+        mtg.add_property('index')
+        for k in class_type:
+            mtg.add_property(k)
 
     # remove from the date format the /
+    date_name = 'Date'
     if has_date:
-        print 'replace all the date format by -'
+        date_names = [k for k, t in class_type.iteritems() if t in ('DD/MM/YY', 'DD/MM/YYYY')]
+        if date_names:
+            date_name = date_names[0]
+        mtg.graph_properties()['date_feature'] = date_name
         if 'DD/MM/YY' in class_type.values():
             date_format = 'DD/MM/YY'
         else:
             date_format = 'DD/MM/YYYY'
-        s = replace_date(s, date_format)
-
 
-    for edge_type in symbols:
-        if edge_type != '/' or not symbol_at_scale:
-            s = s.replace(edge_type, '\n%s'%edge_type)
-        else:
-            # do not consider the date format
-            for klass in symbol_at_scale.keys():
-                s = s.replace('/%s'%klass, '\n/%s'%klass)
-    s = s.replace('<\n<', '<<')
-    # TODO: Write a regular expression to allow several spaces
-    s = s.replace(')(', ')\n(')
-    s = s.replace(') (', ')\n(')
-    s = s.replace('*(', '\n(')
-
-
-    l = filter( None, s.split('\n'))
-
-    for node in l:
+    def split_nodes(s):
+        if has_date:
+            s = replace_date(s, date_format)
+        for edge_type in symbols:
+            if edge_type != '/' or not symbol_at_scale:
+                s = s.replace(edge_type, '\n%s'%edge_type)
+            else:
+                # do not consider the date format
+                for klass in symbol_at_scale.keys():
+                    s = s.replace('/%s'%klass, '\n/%s'%klass)
+        s = s.replace('<\n<', '<<')
+        # TODO: Write a regular expression to allow several spaces
+        s = s.replace(')(', ')\n(')
+        s = s.replace(') (', ')\n(')
+        s = s.replace('*(', '\n(')
+        return filter( None, s.split('\n'))
+
+    pieces = [s] if isinstance(s, basestring) else s
+    nodes = (node for piece in pieces for node in split_nodes(piece))
+
+    for node in nodes:
         if node.startswith('<<'):
             tag = '<<'
             name = node[2:]
@@ -234,7 +233,6 @@ def multiscale_edit(s, symbol_at_scale = {}, class_type={}, has_date = False, mt
             scale = mtg.scale(vid)
         elif tag == '*':
             args = get_properties(name, vid=vid, time=True)
-            print vid, '*(', args, ')'
             # CPL Manage Dynamic_MTG
             add_dynamic_properties(mtg, vid, args)
         else:
@@ -891,15 +889,22 @@ class Reader(object):
     The mtg format is composed of a header and the mtg code.
     The header is used to construct and validate the mtg.
     The code contains topology relations and properties.
+
+    The lines are read one after the other from a string or a file object.
+    Only the lines of the header are stored: each line of the code is
+    converted and added to the MTG before the next one is read.
     """
 
-    def __init__(self, string, has_line_as_param=True, mtg=None, has_date=False):
+    def __init__(self, string, has_line_as_param=True, mtg=None, has_date=False, typed=False):
         self.mtg = mtg
 
-        # First implementation.
-        # Do not store 3 time the structure (mtg, txt and lines)
-        self.txt = string
-        self.lines = string.splitlines()
+        if isinstance(string, basestring):
+            string = string.splitlines()
+        self._file = iter(string)
+        # lines of the header
+        self.lines = []
+        self._keep_lines = True
+        self._nb_read = 0
 
         # header information
         self._code = ""
@@ -907,6 +912,7 @@ class Reader(object):
         self._description = None
         self._features = {}
         self.has_date = has_date
+        self.typed = typed
 
         # debug
         self._no_line = 0
@@ -1091,18 +1097,31 @@ class Reader(object):
         if self.has_line_as_param:
             self._features['_line'] = 'INT'
 
+    def _read_line(self):
+        """ Read the next line of the file (None at the end of the file). """
+        for l in self._file:
+            l = l.rstrip('\r\n')
+            self._nb_read += 1
+            if self._keep_lines:
+                self.lines.append(l)
+            return l
+
     def _next_line(self):
-        self._no_line += 1
-        if self._no_line == len(self.lines):
-            self._no_line -= 1
-            return ""
+        """ Next line which is neither empty nor a comment ("" at the end). """
+        while True:
+            self._no_line += 1
+            if self._no_line < self._nb_read:
+                # the line has already been read by the previous section
+                l = self.lines[self._no_line]
+            else:
+                l = self._read_line()
+                if l is None:
+                    self._no_line -= 1
+                    return ""
 
-        l = self.lines[self._no_line]
-        l1 = l.strip()
-        if not l1 or l1[0] == '#':
-            return self._next_line()
-        else:
-            return l
+            l1 = l.strip()
+            if l1 and l1[0] != '#':
+                return l
 
     def next_line_iter(self):
         l = self._next_line()
@@ -1150,7 +1169,6 @@ class Reader(object):
         nb_cols = len(code_topo.split('\t'))
         self._feature_slice = slice(nb_cols-1, nb_cols-1+self._nb_features)
 
-        self.preprocess_code()
         self.build_mtg()
 
 
@@ -1221,15 +1239,17 @@ class Reader(object):
         return s, edge_type
 
 
-    def preprocess_code(self):
-
-        code = [l for l in self.lines[self._no_line+1:] if l.strip() and not l.strip().startswith('#')]
+    def code_iter(self):
+        """
+        Convert the lines of the code, one after the other, into pieces
+        of the string parsed by :func:`multiscale_edit`.
+        """
+        # the lines of the code are not stored
+        self._keep_lines = False
 
         indent = [0]
         edge_type = []
-        new_code = []
 
-        #for l in code:
         for l in self.next_line_iter():
             #l = l.expandtabs(4)
             s = l.strip()
@@ -1251,28 +1271,37 @@ class Reader(object):
             #s = self.preprocess_line(s, diff_space, indent, nb_spaces, edge_type)
             s, edge_type = self.preprocess_line(s, diff_space, indent, nb_spaces, edge_type)
 
-            new_code.append(s)
+            yield s
 
         while edge_type:
             edge = edge_type.pop()
             if edge in ['+','/']:
-                new_code.append(']')
+                yield ']'
 
-        self._new_code = ''.join(new_code)
+    def preprocess_code(self):
+        """
+        Convert the code into the string parsed by :func:`multiscale_edit`
+        (stored in `_new_code`).
+        """
+        self._new_code = ''.join(self.code_iter())
         if debug:
             print self._new_code
 
     def build_mtg(self):
         """
+        Build the MTG while reading the code.
         """
-        self.mtg = multiscale_edit(self._new_code, self._symbols, self._features, self.has_date, mtg=self.mtg)
+        self.mtg = multiscale_edit(self.code_iter(), self._symbols, self._features, self.has_date, mtg=self.mtg,
+                                   typed=self.typed)
         #self.mtg = multiscale_edit(self._new_code, {}, self._features)
 
-def read_mtg(s, mtg=None, has_date=False):
+def read_mtg(s, mtg=None, has_date=False, typed=False):
     """ Create an MTG from its string representation in the MTG format.
 
     :Parameter:
-        - s (string) - a multi-lines string
+        - s (string) - a multi-lines string, or a file object which
+          is read line by line
+        - typed (bool) - store the INT and REAL features in typed columns
 
     :Return: an MTG
 
@@ -1288,11 +1317,11 @@ def read_mtg(s, mtg=None, has_date=False):
     .. seealso:: :func:`read_mtg_file`.
 
     """
-    reader = Reader(s, mtg=mtg, has_date=has_date)
+    reader = Reader(s, mtg=mtg, has_date=has_date, typed=typed)
     g = reader.parse()
     return g
 
-def read_mtg_file(fn, mtg=None, has_date=False):
+def read_mtg_file(fn, mtg=None, has_date=False, typed=False):
     """ Create an MTG from a filename.
 
     :Usage:
@@ -1301,10 +1330,11 @@ def read_mtg_file(fn, mtg=None, has_date=False):
 
     .. seealso:: :func:`read_mtg`.
     """
-    f = open(fn)
-    txt = f.read()
-    f.close()
-    return read_mtg(txt, mtg=mtg, has_date=has_date)
+    f = open(fn, 'rU')
+    try:
+        return read_mtg(f, mtg=mtg, has_date=has_date, typed=typed)
+    finally:
+        f.close()
 
 
 def mtg_display(g, vtx_id, tab='  ', edge_type=None, label=None):
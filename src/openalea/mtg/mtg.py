@@ -28,11 +28,18 @@ import re
 import warnings
 import random
 import copy
+import collections
+import itertools
+from contextlib import contextmanager
 
 import traversal
 import algo
 
-from tree import PropertyTree, InvalidVertex
+from tree import PropertyTree, InvalidVertex, mutable_list
+from storage import ScaleMap, LabelIndex, LabelProperty, VersionedProperty
+
+# Topology versions are unique among all the MTGs
+_topology_versions = itertools.count(1)
 
 
 class MTG(PropertyTree):
@@ -79,7 +86,7 @@ class MTG(PropertyTree):
         super(MTG, self).__init__()
 
         # Map a vid to its scale
-        self._scale = {0:0}
+        self._scale = ScaleMap({0:0})
 
         # Multiscale tree:
         # complex <=> parent : vid -> vid
@@ -87,6 +94,20 @@ class MTG(PropertyTree):
         self._complex = {}
         self._components = {}
 
+        # Cache of the complex resolved by walking the parents: vid -> vid
+        self._resolved_complex = {}
+        # Index of the decomposition (see build_containment_index)
+        self._containment_index = None
+        # Depth of nested bulk_edit
+        self._bulk_level = 0
+        # Version of the topology, changed at each topological edition
+        self._topology_version = next(_topology_versions)
+        # Traversal orders computed for a version of the topology
+        self._traversal_orders = {}
+        self._traversal_state = None
+        # Memoise the order, height, rank and axis (see cache_descriptors)
+        self._cache_descriptors = False
+
         # add default properties
         self.add_property('edge_type')
         self.add_property('label')
@@ -148,9 +169,8 @@ class MTG(PropertyTree):
         :Returns Type:
             int
 
-        .. note:: The complexity is :math:`O(n)`.
         '''
-        return len(set(self._scale.itervalues()))
+        return len(self._scale.scales())
 
     def scales_iter(self):
         '''Return the different scales of the mtg.
@@ -158,9 +178,8 @@ class MTG(PropertyTree):
         :Returns:
             Iterator on scale identifiers (ints).
 
-        .. note:: The complexity is :math:`O(n)`.
         '''
-        return iter(set(self._scale.itervalues()))
+        return iter(self._scale.scales())
 
     def scales(self):
         '''Return the different scales of the mtg.
@@ -168,7 +187,6 @@ class MTG(PropertyTree):
         :Returns:
             Iterator on scale identifiers (ints).
 
-        .. note:: The complexity is :math:`O(n)`.
         '''
         return list(self.scales_iter())
 
@@ -183,7 +201,6 @@ class MTG(PropertyTree):
         :Returns:
             S, the maximum scale identifier.
 
-        .. note:: The complexity is :math:`O(n)`.
         .. seealso:: :func:`scale`, :func:`scales`
         '''
         return max(self.scales_iter())
@@ -209,11 +226,13 @@ class MTG(PropertyTree):
         :Returns:
             Number of vertices at `scale` or total
             number of vertices if scale < 0.
+
+        .. note:: The complexity is :math:`O(1)`.
         '''
         if scale < 0:
             return len(self._scale)
         else:
-            return len(self.vertices(scale=scale))
+            return self._scale.nb_vertices_at(scale)
 
     def vertices(self, scale = -1):
         '''
@@ -279,12 +298,15 @@ class MTG(PropertyTree):
 
         :Background:
 
+        .. note:: The vertices of a scale are sorted by vid. The complexity
+            is proportional to the number of vertices at `scale`.
+
         .. seealso:: :meth:`children`, :meth:`components`.
         '''
         if scale < 0:
             return self._scale.iterkeys()
         else:
-            return (vid for vid, sid in self._scale.iteritems() if sid == scale)
+            return iter(self._scale.vertices_at(scale))
 
 
     #########################################################################
@@ -419,6 +441,7 @@ class MTG(PropertyTree):
 
 
         if self.nb_components(vid) == 0:
+            self._topology_changed(vid)
             super(MTG, self).remove_vertex(vid, reparent_child=reparent_child)
             if vid in self._components:
                 del self._components[vid]
@@ -426,7 +449,7 @@ class MTG(PropertyTree):
                 del self._scale[vid]
             if vid in self._complex:
                 cid = self._complex[vid]
-                l = self._components[cid]
+                l = mutable_list(self._components, cid)
                 try:
                     i = l.index(vid)
                     del l[i]
@@ -437,6 +460,49 @@ class MTG(PropertyTree):
             raise InvalidVertex('Can not remove vertex %d with components.'
             'Use remove_tree instead.'%vid)
 
+    def _check_removal(self, bunch):
+        """ Raise an InvalidVertex if the set of vertices can not be removed.
+
+        The children and the components of the removed vertices
+        have to be removed too.
+        """
+        super(MTG, self)._check_removal(bunch)
+        for vid in bunch:
+            for cid in self._components.get(vid, ()):
+                if cid not in bunch:
+                    raise InvalidVertex('Can not remove vertex %d with components.'
+                    'Use remove_tree instead.'%vid)
+
+    def _remove_vertices(self, bunch):
+        """ Remove the set of vertices `bunch` and their properties
+        without any check.
+
+        The children and components which are not removed have no more
+        parent and complex.
+        """
+        for vid in bunch:
+            self._topology_changed(vid)
+
+        super(MTG, self)._remove_vertices(bunch)
+
+        complexes = self._complex
+        components = self._components
+        scales = self._scale
+
+        removed_components = {}
+        for vid in bunch:
+            cid = complexes.pop(vid, None)
+            if cid is not None and cid not in bunch:
+                removed_components.setdefault(cid, set()).add(vid)
+            for component_id in components.pop(vid, ()):
+                if component_id not in bunch:
+                    complexes.pop(component_id, None)
+            scales.pop(vid, None)
+
+        for cid, vids in removed_components.iteritems():
+            l = mutable_list(components, cid)
+            l[:] = [vid for vid in l if vid not in vids]
+
     def clear(self):
         """Remove all vertices and edges from the MTG.
 
@@ -461,6 +527,7 @@ class MTG(PropertyTree):
 
         self._complex.clear()
         self._components.clear()
+        self._topology_changed()
 
     def clear_properties(self, exclude=[]):
         """Remove all the properties of the MTG.
@@ -480,15 +547,370 @@ class MTG(PropertyTree):
         for k in props:
             del self._properties[k]
 
+    def add_property(self, property_name, dtype=None):
+        """Add a new property map between vid and a data.
+
+        The property is not defined for any vertex.
+
+        :Parameters:
+            - `property_name` (str) - the name of the property
+            - `dtype` (str) - the type of the values, if they are stored in a
+              typed column ('float64', 'int64', 'bool' or 'categorical').
+              If None, the property is a dict.
+              The `label` property is a :class:`~openalea.mtg.storage.LabelProperty`
+              and the `edge_type` property a :class:`~openalea.mtg.storage.VersionedProperty`.
+
+        :Example:
+            .. code-block:: python
+
+                >>> g.add_property('length', dtype='float64')
+                >>> g.property('length')[vid] = 1.5
+
+        .. seealso:: :meth:`property_array`, :class:`~openalea.mtg.columns.PropertyColumn`
+        """
+        if dtype is None:
+            if property_name == 'label':
+                self._properties[property_name] = LabelProperty()
+            elif property_name == 'edge_type':
+                self._properties[property_name] = VersionedProperty()
+            else:
+                self._properties[property_name] = {}
+        else:
+            from columns import PropertyColumn
+            self._properties[property_name] = PropertyColumn(dtype)
+
+    def property_array(self, name, scale=None, masked=False):
+        """Returns the values of a property as a NumPy array.
+
+        :Parameters:
+            - `name` (str) - the name of the property
+            - `scale` (int) - if None, the array is indexed by vid.
+              Otherwise, it contains the values of the vertices at `scale`
+              sorted by vid.
+            - `masked` (bool) - return a masked array where the undefined
+              values are masked.
+
+        :Returns:
+            a NumPy array. If the property is a typed column and `scale` is None,
+            the array is a view on the values (no copy).
+            Undefined values are NaN (float), 0 (int), False (bool)
+            or -1 (categorical codes, see `g.property(name).categories`).
+
+        .. seealso:: :meth:`add_property`
+        """
+        from columns import PropertyColumn
+
+        column = self.property(name)
+        if not isinstance(column, PropertyColumn):
+            column = PropertyColumn.from_dict(column)
+
+        vids = None if scale is None else self._sorted_vertices(scale)
+        values = column.array(vids)
+        if masked:
+            import numpy as np
+            values = np.ma.array(values, mask=~column.mask(vids), copy=False)
+        return values
+
+    def memory_report(self):
+        """Estimate the memory used by the topology and the properties of the MTG.
+
+        Sizes are estimated with `sys.getsizeof` on the structures and
+        the objects they contain. Objects defined in extension modules
+        (e.g. geometries) are only partially measured.
+        Each structure is measured independently: objects shared between
+        structures (or between copies of the MTG) are counted in each of them.
+
+        :Returns:
+            a dict with the keys:
+
+                - 'topology': for each topological structure (`_parent`,
+                  `_children`, `_complex`, `_components`, `_scale`),
+                  a dict with its number of items ('count') and its size ('nbytes'),
+                - 'properties': for each property, a dict with its number of
+                  values ('count'), its size ('nbytes'), the number of values
+                  of each type ('types'), and the estimated size ('compact_nbytes')
+                  and saving ('saving') if the property was stored in a typed
+                  column ('compact_dtype'). These are None if the values can
+                  not be stored in a column,
+                - 'caches': the size of the caches and indices
+                  (`_traversal_orders` contains the traversal orders,
+                  the LCA and descriptor indices and the births),
+                - 'nbytes': the total size.
+
+        :Example:
+            .. code-block:: python
+
+                >>> report = g.memory_report()
+                >>> sorted(report['properties'].iteritems(), key=lambda x: -x[1]['nbytes'])
+
+        .. seealso:: :meth:`add_property`, :class:`~openalea.mtg.columns.PropertyColumn`
+        """
+        from storage import sizeof
+        try:
+            from columns import PropertyColumn, estimate_nbytes
+        except ImportError:
+            PropertyColumn = estimate_nbytes = None
+
+        topology = {}
+        for name in ('_parent', '_children', '_complex', '_components', '_scale'):
+            d = getattr(self, name)
+            topology[name] = dict(count=len(d), nbytes=sizeof(d))
+
+        properties = {}
+        for name, p in self._properties.iteritems():
+            types = {}
+            for v in p.itervalues():
+                t = type(v).__name__
+                types[t] = types.get(t, 0) + 1
+            report = dict(count=len(p), nbytes=sizeof(p), types=types,
+                          compact_dtype=None, compact_nbytes=None, saving=None)
+
+            if PropertyColumn is not None:
+                if isinstance(p, PropertyColumn):
+                    dtype, nbytes = p.dtype, report['nbytes']
+                else:
+                    dtype, nbytes = estimate_nbytes(p)
+                if dtype is not None:
+                    report.update(compact_dtype=dtype, compact_nbytes=nbytes,
+                                  saving=max(report['nbytes'] - nbytes, 0))
+            properties[name] = report
+
+        index = self._containment_index
+        orders, seen = 0, set([id(self)])
+        for key, value in self._traversal_orders.iteritems():
+            orders += sizeof(key, seen) + sizeof(value, seen)
+            if not isinstance(value, collections.Mapping) and hasattr(value, '__dict__'):
+                orders += sizeof(vars(value), seen)
+        caches = dict(_resolved_complex=sizeof(self._resolved_complex),
+                      _containment_index=sizeof(vars(index)) if index is not None else 0,
+                      _traversal_orders=orders)
+
+        total = (sum(r['nbytes'] for r in topology.itervalues()) +
+                 sum(r['nbytes'] for r in properties.itervalues()) +
+                 sum(caches.itervalues()))
+        return dict(topology=topology, properties=properties, caches=caches, nbytes=total)
+
     def copy(self):
         """ Return a copy of the graph.
 
         :Returns:
             - `g` (MTG) - A copy of the MTG
 
+        .. seealso:: :meth:`snapshot`
         """
         return copy.deepcopy(self)
 
+    def snapshot(self):
+        """ Return a copy-on-write copy of the graph.
+
+        The topology and the property dicts of the snapshot are stored by
+        chunks of vertices. A snapshot of a snapshot shares all its chunks,
+        and a chunk is duplicated only when it is edited, either in the
+        original or in the copy. Thus, a snapshot is cheap and memory grows
+        with the number of edits. The first snapshot of an MTG builds these
+        chunks in one pass over its dicts; the MTG itself is not modified.
+
+        Unlike :meth:`copy`, the property values are shared and must not
+        be modified in place.
+
+        :Returns:
+            - `g` (MTG) - A copy of the MTG
+
+        .. seealso:: :meth:`copy`, :class:`~openalea.mtg.storage.CowDict`
+        """
+        from storage import snapshot
+        return snapshot(self)
+
+    def at_date(self, date):
+        """ Returns a read-only view of a dynamic MTG at `date`.
+
+        The view shares the topology and the properties of the MTG.
+        The vertices observed after `date` are hidden, and each dated
+        property (:class:`~openalea.mtg.dynamic.TimeSeries`) is resolved
+        lazily to its last observation at or before `date`.
+        Editing the view raises a :class:`~openalea.mtg.storage.FrozenGraphError`.
+
+        :Parameters:
+            - `date` - a :class:`datetime.date` or a string 'DD/MM/YYYY'
+
+        :Returns:
+            - `g` (MTG) - a view of the MTG
+
+        :Example:
+
+        .. code-block:: python
+
+            for d in dates:
+                lengths = g.at_date(d).property('Long')
+
+        .. seealso:: :mod:`~openalea.mtg.dynamic`
+        """
+        from dynamic import at_date
+        return at_date(self, date)
+
+    @classmethod
+    def from_arrays(cls, parent, complex, scale, edge_type=None, properties=None, fat=True):
+        """ Build an MTG from arrays indexed by vid.
+
+        The topology is set directly, without any check.
+        The vertex 0 is the root of the MTG and has to be at scale 0.
+
+        :Parameters:
+            - `parent` (sequence of int) - parent of each vertex, or a negative value
+              (or None) if the vertex has no parent.
+              The children of a vertex are ordered by vid.
+            - `complex` (sequence of int) - explicit complex of each vertex, or a
+              negative value (or None) if the complex is inherited from the parent.
+              The complex has to be defined at least for the roots of each
+              component tree.
+            - `scale` (sequence of int) - scale of each vertex.
+            - `edge_type` (sequence of str) - edge type of each vertex ('<', '+' or None).
+            - `properties` (dict) - map a property name to either a dict `{vid: value}`,
+              a NumPy array (stored in a typed column, NaN values are undefined)
+              or a sequence of values (None values are undefined).
+            - `fat` (bool) - compute the missing edges at the coarser scales
+              (see :func:`fat_mtg`).
+
+        :Returns:
+            a new MTG
+
+        :Example:
+
+        .. code-block:: python
+
+            # root, a plant and 3 internodes
+            g = MTG.from_arrays(parent=[-1, -1, -1, 2, 3],
+                                complex=[-1, 0, 1, -1, -1],
+                                scale=[0, 1, 2, 2, 2],
+                                edge_type=[None, None, None, '<', '+'],
+                                properties={'label': ['', 'P1', 'I1', 'I2', 'I3']})
+
+        .. seealso:: :meth:`bulk_edit`
+        """
+        tolist = lambda l: l.tolist() if hasattr(l, 'tolist') else list(l)
+        parent, complex, scale = tolist(parent), tolist(complex), tolist(scale)
+
+        g = cls()
+        g._scale = ScaleMap(enumerate(scale))
+
+        _parent = g._parent
+        _children = g._children
+        for vid, pid in enumerate(parent):
+            if pid is not None and pid >= 0:
+                _parent[vid] = pid
+                _children.setdefault(pid, []).append(vid)
+
+        _complex = g._complex
+        _components = g._components
+        for vid, cid in enumerate(complex):
+            if cid is not None and cid >= 0:
+                _complex[vid] = cid
+                _components.setdefault(cid, []).append(vid)
+
+        if edge_type is not None:
+            edge_type = tolist(edge_type)
+            g.property('edge_type').update((vid, et) for vid, et in enumerate(edge_type) if et)
+
+        for name, values in (properties or {}).iteritems():
+            if isinstance(values, dict):
+                g.add_property(name)
+                g.property(name).update(values)
+            elif hasattr(values, 'dtype'):
+                from columns import PropertyColumn
+                g._properties[name] = PropertyColumn.from_array(values)
+            else:
+                g.add_property(name)
+                g.property(name).update((vid, v) for vid, v in enumerate(values) if v is not None)
+
+        g._id = max(g._id, len(scale) - 1)
+        if fat:
+            fat_mtg(g)
+        return g
+
+    @contextmanager
+    def bulk_edit(self, fat=True):
+        """ Context to edit the topology of the MTG with a lot of calls.
+
+        The caches and the indices which depend on the topology (resolved
+        complexes, traversal orders, containment index) are reset once when
+        entering and once when leaving the context, instead of being updated
+        after each edition. In the context, the topology version does not
+        change and the complexes and traversal orders are computed without
+        being cached. The missing edges at the coarser scales are computed
+        once at the end (see :func:`fat_mtg`).
+
+        The vertices and edges are not validated, neither in nor out of
+        the context.
+
+        :Parameters:
+            - `fat` (bool) - compute the missing edges when leaving the context.
+
+        :Example:
+
+        .. code-block:: python
+
+            with g.bulk_edit():
+                for record in records:
+                    vid = g.add_component(complex_id, **record)
+
+        .. seealso:: :meth:`from_arrays`
+        """
+        self._topology_changed()
+        self._bulk_level += 1
+        try:
+            yield self
+        finally:
+            self._bulk_level -= 1
+            self._topology_changed()
+        if fat and not self._bulk_level:
+            fat_mtg(self)
+
+    def freeze(self):
+        """ Store the topology of the MTG in compact arrays.
+
+        The parent, complex and scale relations are stored in integer arrays
+        indexed by vid, children and components in CSR arrays
+        (see :mod:`openalea.mtg.storage`).
+        Memory usage is reduced and the MTG is read-only:
+        editing the topology raises a :class:`~openalea.mtg.storage.FrozenGraphError`.
+        Properties are not modified and can still be edited.
+
+        :Usage:
+
+        .. code-block:: python
+
+            g = read_mtg_file('orchard.mtg').freeze()
+
+        :Returns:
+            - `g` (MTG) - the MTG itself
+
+        .. seealso:: :meth:`unfreeze`, :meth:`is_frozen`
+        """
+        from storage import to_arrays
+        if not self.is_frozen():
+            to_arrays(self)
+        return self
+
+    def unfreeze(self):
+        """ Store back the topology of a frozen MTG in dicts.
+
+        :Returns:
+            - `g` (MTG) - the MTG itself, which can be edited again.
+
+        .. seealso:: :meth:`freeze`, :meth:`is_frozen`
+        """
+        from storage import to_dicts
+        if self.is_frozen():
+            to_dicts(self)
+        return self
+
+    def is_frozen(self):
+        """ Returns True if the topology is stored in compact arrays.
+
+        .. seealso:: :meth:`freeze`, :meth:`unfreeze`
+        """
+        return getattr(self._parent, 'read_only', False)
+
     def roots_iter(self, scale=0):
         ''' Returns an iterator of the roots of the tree graphs at a given scale.
 
@@ -549,6 +971,7 @@ class MTG(PropertyTree):
 
         child = super(MTG, self).add_child(parent, child, **properties)
         self._scale[child] = self._scale[parent]
+        self._topology_changed(child)
         return child
 
     def insert_sibling(self, vtx_id1, vtx_id2=None, **properties):
@@ -566,6 +989,7 @@ class MTG(PropertyTree):
         '''
         vtx_id2 = super(MTG, self).insert_sibling(vtx_id1, vtx_id2, **properties)
         self._scale[vtx_id2] = self._scale[vtx_id1]
+        self._topology_changed(vtx_id2)
         return vtx_id2
 
     def insert_parent(self, vtx_id, parent_id=None, **properties):
@@ -589,6 +1013,7 @@ class MTG(PropertyTree):
         self._scale[parent_id] = self.scale(vtx_id)
 
         parent_id = super(MTG, self).insert_parent(vtx_id, parent_id, **properties)
+        self._topology_changed(parent_id)
 
         return parent_id
 
@@ -617,6 +1042,7 @@ class MTG(PropertyTree):
         old_complex = self._complex.get(vtx_id)
 
         super(MTG, self).replace_parent(vtx_id, new_parent_id, **properties)
+        self._topology_changed(vtx_id)
 
         if old_complex is not None:
             self.replace_parent(old_complex, self.complex(new_parent_id))
@@ -639,13 +1065,81 @@ class MTG(PropertyTree):
             int
         '''
         complex_id = self._complex.get(vtx_id)
-        while complex_id is None:
-            vtx_id = self.parent(vtx_id)
-            if vtx_id is None:
+        if complex_id is not None:
+            return complex_id
+
+        resolved = self._resolved_complex
+        if vtx_id in resolved:
+            return resolved[vtx_id]
+
+        # Walk up the parents until a vertex with an explicit or an already
+        # resolved complex is found. All the visited vertices are cached.
+        path = [vtx_id]
+        vid = self.parent(vtx_id)
+        while vid is not None:
+            complex_id = self._complex.get(vid)
+            if complex_id is not None:
+                break
+            if vid in resolved:
+                complex_id = resolved[vid]
                 break
-            complex_id = self._complex.get(vtx_id)
+            path.append(vid)
+            vid = self.parent(vid)
+
+        if not self._bulk_level:
+            for vid in path:
+                resolved[vid] = complex_id
         return complex_id
 
+    def resolve_complexes(self):
+        '''
+        Compute and cache the complex of all the vertices.
+
+        The complex of a vertex is only stored explicitly for the first
+        vertex of each component tree. For the other vertices, it is
+        resolved by walking up the parents and cached by :meth:`complex`.
+        This method fills the cache for the whole MTG in linear time.
+        The cache is updated when the topology is edited.
+
+        :Returns: None
+
+        .. seealso:: :meth:`complex`
+        '''
+        complex = self.complex
+        for vid in self._scale:
+            complex(vid)
+
+    def _topology_changed(self, vtx_id=None):
+        """ Update the caches and drop the indices when the topology
+        is edited around `vtx_id` (or anywhere if `vtx_id` is None).
+        """
+        if self._bulk_level:
+            # the caches are reset at the end of bulk_edit
+            return
+        self._topology_version = next(_topology_versions)
+        self._invalidate_complex(vtx_id)
+        self._containment_index = None
+
+    def _invalidate_complex(self, vtx_id=None):
+        """ Remove the cached complex of `vtx_id` and of the vertices
+        which inherit their complex from `vtx_id`.
+
+        If `vtx_id` is None, the whole cache is cleared.
+        """
+        resolved = self._resolved_complex
+        if not resolved:
+            return
+        if vtx_id is None:
+            resolved.clear()
+            return
+
+        stack = [vtx_id]
+        while stack:
+            vid = stack.pop()
+            resolved.pop(vid, None)
+            stack.extend(cid for cid in self.children_iter(vid)
+                         if cid in resolved and self._complex.get(cid) is None)
+
     def complex_at_scale(self, vtx_id, scale):
         '''
         Returns the complex of `vtx_id` at scale `scale`.
@@ -659,12 +1153,200 @@ class MTG(PropertyTree):
         :Returns Type:
             int
         '''
+        index = self._containment_index
+        if index is not None and vtx_id in index and scale < self.scale(vtx_id):
+            return index.complex_at_scale(vtx_id, scale)
+
         complex_id = vtx_id
         current_scale = self.scale(complex_id)
         for i in range(scale, current_scale):
             complex_id = self.complex(complex_id)
         return complex_id
 
+    def build_containment_index(self):
+        '''
+        Build an index of the decomposition of the MTG.
+
+        Once the index is built, :meth:`complex_at_scale`,
+        :meth:`components_at_scale` and the `ContainedIn` arguments of the
+        algorithms (:func:`~openalea.mtg.algo.ancestors`,
+        :func:`~openalea.mtg.algo.sons`, ...) are computed without walking
+        the MTG.
+        The index is dropped when the topology of the MTG is edited.
+
+        :Returns:
+            the index (:class:`~openalea.mtg.indices.ContainmentIndex`)
+
+        .. seealso:: :meth:`containment_index`
+        '''
+        from indices import ContainmentIndex
+        self._containment_index = ContainmentIndex(self)
+        return self._containment_index
+
+    def containment_index(self):
+        '''
+        Returns the index of the decomposition or None if it is not built.
+
+        .. seealso:: :meth:`build_containment_index`
+        '''
+        return self._containment_index
+
+    def topology_version(self):
+        '''
+        Returns the version of the topology.
+
+        The version changes each time the topology is edited.
+        Versions are unique among all the MTGs (except copies that have
+        not been edited), so they can be used as keys of caches.
+
+        .. note:: The edge types are part of the topology, but editing the
+            `edge_type` property does not change this version. The traversal
+            caches also depend on the version of the `edge_type` property
+            (see :class:`~openalea.mtg.storage.VersionedProperty`), so they
+            are reset when an edge type is set or removed.
+            If `edge_type` is replaced by a plain dict, which has no version,
+            call :meth:`clear_caches` after editing it in place.
+
+        .. seealso:: :meth:`traversal_index`, :meth:`clear_caches`
+        '''
+        return self._topology_version
+
+    def clear_caches(self):
+        '''
+        Reset the caches which depend on the topology.
+
+        The caches are reset automatically when the MTG is edited through
+        its methods or when the `edge_type` property is edited.
+        Call this method after editing the topology or the edge types by
+        other means (e.g. in a `edge_type` property which is a plain dict).
+
+        .. seealso:: :meth:`topology_version`
+        '''
+        self._topology_changed()
+
+    def _traversal_cache(self):
+        """ Dict of the traversal orders valid for the current topology. """
+        if self._bulk_level:
+            # nothing is cached while the topology is edited by bulk_edit
+            return {}
+        edge_type = self._properties.get('edge_type', ())
+        version = getattr(edge_type, 'version', len(edge_type))
+        state = (self._topology_version, id(edge_type), version)
+        if state != self._traversal_state:
+            # a new dict: the previous one may be shared with a copy
+            self._traversal_orders = {}
+            self._traversal_state = state
+        return self._traversal_orders
+
+    def traversal_index(self, scale, build=True):
+        '''
+        Returns the pre order traversal of the vertices at `scale`.
+
+        The index is computed once for a given version of the topology
+        and is used by :func:`~openalea.mtg.traversal.pre_order2` and
+        :func:`~openalea.mtg.traversal.post_order2` once it is built.
+
+        :Parameters:
+            - `scale` (int) - the scale of the vertices
+            - `build` (bool) - if False, returns None when the index
+              is not already built, unless the MTG is frozen.
+
+        :Returns:
+            the index (:class:`~openalea.mtg.indices.TraversalIndex`)
+
+        .. seealso:: :meth:`topology_version`, :meth:`freeze`
+        '''
+        cache = self._traversal_cache()
+        index = cache.get(scale)
+        if index is None and (build or self.is_frozen()):
+            from indices import TraversalIndex
+            index = cache[scale] = TraversalIndex(self, scale)
+        return index
+
+    def lca_index(self, scale, build=True):
+        '''
+        Returns the index of the ancestors of the vertices at `scale`.
+
+        The index answers lowest common ancestor, ancestor and path queries
+        in O(log n). It is computed once for a given version of the topology.
+        Once it is built, :func:`~openalea.mtg.algo.path`,
+        :meth:`AlgOrder`, :meth:`AlgRank`, :meth:`AlgHeight`, ... use it.
+
+        :Parameters:
+            - `scale` (int) - the scale of the vertices
+            - `build` (bool) - if False, returns None when the index
+              is not already built.
+
+        :Returns:
+            the index (:class:`~openalea.mtg.indices.LCAIndex`)
+
+        .. seealso:: :func:`~openalea.mtg.algo.lca`, :func:`~openalea.mtg.algo.path_length`
+        '''
+        cache = self._traversal_cache()
+        key = ('lca', scale)
+        index = cache.get(key)
+        if index is None and build:
+            from indices import LCAIndex
+            index = cache[key] = LCAIndex(self, scale, self.traversal_index(scale))
+        return index
+
+    def cache_descriptors(self, enable=True):
+        '''
+        Memoise the order, height, rank and axis of the vertices.
+
+        Once enabled, the descriptors of the vertices of a scale are computed
+        in one traversal at the first query, and computed again after the
+        topology is edited. :meth:`order`, :meth:`Rank`, :meth:`Height`,
+        :meth:`AlgOrder`, :meth:`AlgHeight` and the corresponding functions
+        of :mod:`~openalea.mtg.algo` and :mod:`~openalea.mtg.aml`
+        then answer in O(1).
+
+        :Parameters:
+            - `enable` (bool) - enable or disable the cache.
+
+        .. seealso:: :meth:`descriptor_index`
+        '''
+        self._cache_descriptors = enable
+
+    def descriptor_index(self, scale):
+        '''
+        Returns the descriptors of the vertices at `scale`, or None
+        if they are not memoised (see :meth:`cache_descriptors`).
+
+        :Returns:
+            the index (:class:`~openalea.mtg.indices.DescriptorIndex`)
+
+        :Example:
+            .. code-block:: python
+
+                >>> g.cache_descriptors()
+                >>> axis = g.descriptor_index(3).axis[vid]
+        '''
+        if not self._cache_descriptors:
+            return None
+        cache = self._traversal_cache()
+        key = ('descriptors', scale)
+        index = cache.get(key)
+        if index is None:
+            from indices import DescriptorIndex
+            index = cache[key] = DescriptorIndex(self, scale, self.traversal_index(scale))
+        return index
+
+    def _mtg_order(self, vtx_id):
+        """ Order of :func:`~openalea.mtg.traversal.iter_mtg2` from `vtx_id`.
+
+        Only the order from the root is cached, so that the cache
+        uses O(n) memory. Other vertices are traversed in linear time.
+        """
+        if vtx_id != self.root:
+            return traversal._iter_mtg2(self, vtx_id)
+        from array import array
+        cache = self._traversal_cache()
+        order = cache.get('iter_mtg2')
+        if order is None:
+            order = cache['iter_mtg2'] = array('l', traversal._iter_mtg2(self, vtx_id))
+        return order
+
     def components_iter(self, vid):
         '''
         returns a vertex iterator
@@ -703,6 +1385,10 @@ class MTG(PropertyTree):
 
         cur_scale = self.scale(vid)
 
+        index = self._containment_index
+        if index is not None and vid in index and scale > cur_scale:
+            return iter(index.components_at_scale(vid, scale))
+
         gen = (vid, )
         for i in range(cur_scale, scale):
             gen = (vid for vtx in gen for vid in self.components_iter(vtx) )
@@ -782,9 +1468,10 @@ class MTG(PropertyTree):
 
         self._add_vertex_properties(component_id, properties)
 
-        self._components.setdefault(complex_id,[]).append(component_id)
+        mutable_list(self._components, complex_id, create=True).append(component_id)
         self._complex[component_id] = complex_id
         self._scale[component_id] = self._scale[complex_id]+1
+        self._topology_changed(component_id)
 
         return component_id
 
@@ -817,8 +1504,9 @@ class MTG(PropertyTree):
             self.add_child(parent_complex, complex)
         self._scale[complex] = self._scale[parent_complex]
 
-        self._components.setdefault(complex,[]).append(child)
+        mutable_list(self._components, complex, create=True).append(child)
         self._complex[child] = complex
+        self._topology_changed(child)
 
         return child, complex
 
@@ -902,40 +1590,11 @@ class MTG(PropertyTree):
             self.root = vtx_id
 
             # remove vertices by removing the element and deleting all the deges.
-            # We do not use standard methods because the graph will not be functional
-            # until the removal of all vertices.
-
-            # force remove
-            for vid in remove_bunch:
+            # The graph is not functional until the removal of all vertices,
+            # so the removal is done without any verification.
 
-                # TODO: Build specific methods (_force_remove) to edit a MTG without
-                # any verification. The MTG/Tree/whatever will be temporary invalid.
-
-                # remove properties
-                self._remove_vertex_properties(vid)
-                del self._scale[vid]
-
-                # remove parent edge
-                pid = self.parent(vid)
-                if pid is not None:
-                    self._children[pid].remove(vid)
-                    del self._parent[vid]
-                # remove children edges
-                for cid in self.children_iter(vid):
-                    self._parent[cid] = None
-                if vid in self._children:
-                    del self._children[vid]
-
-                # remove complex edges
-                complex_id = self._complex.get(vid)
-                if complex_id is not None:
-                    self._components[complex_id].remove(vid)
-                    del self._complex[vid]
-                # remove components edges
-                for cid in self.components_iter(vid):
-                    del self._complex[cid]
-                if vid in self._components:
-                    del self._components[vid]
+            self._topology_changed()
+            self._remove_vertices(remove_bunch)
 
             # Update the scale of the nodes
             scale = self._scale
@@ -952,7 +1611,7 @@ class MTG(PropertyTree):
             g.root = 0
 
             for name in self.properties():
-                g.add_property(name)
+                g.add_property(name, dtype=getattr(self.property(name), 'dtype', None))
 
             treeid_id[vtx_id] = g.root
             subtree = traversal.iter_mtg2(self, vtx_id)
@@ -1021,7 +1680,7 @@ class MTG(PropertyTree):
             g.root = mapping.setdefault(self.root,0)
 
             for name in self.properties():
-                g.add_property(name)
+                g.add_property(name, dtype=getattr(self.property(name), 'dtype', None))
 
             subtree = traversal.iter_mtg2(self, self.root)
 
@@ -1053,10 +1712,15 @@ class MTG(PropertyTree):
             self._children = dict((mapping[k], [mapping[v] for v in l]) for k, l in self._children.iteritems())
             self._complex = dict((mapping[k], mapping.get(v)) for k, v in self._complex.iteritems())
             self._components = dict((mapping[k], [mapping[v] for v in l]) for k, l in self._components.iteritems())
-            self._scale = dict((mapping[k], s) for k, s in self._scale.iteritems())
+            self._scale = ScaleMap((mapping[k], s) for k, s in self._scale.iteritems())
+            self._topology_changed()
             for name in self._properties:
                 d = self._properties[name]
-                self._properties[name] = dict((mapping[k], s) for k, s in d.iteritems())
+                if isinstance(d, dict):
+                    self._properties[name] = type(d)((mapping[k], s) for k, s in d.iteritems())
+                else:
+                    p = self._properties[name] = d.empty()
+                    p.update((mapping[k], s) for k, s in d.iteritems())
 
             return self
 
@@ -1131,6 +1795,7 @@ class MTG(PropertyTree):
         for v in inf_vertices:
             if v in g._complex:
                 del g._complex[v]
+        g._topology_changed()
 
         # And new components
         for vid, component_id in components_sup.iteritems():
@@ -1202,6 +1867,7 @@ class MTG(PropertyTree):
         for v in inf_vertices:
             if v in g._complex:
                 del g._complex[v]
+        g._topology_changed()
 
         # And new components
         for component_id, complex_id in new_complex.iteritems():
@@ -1227,6 +1893,10 @@ class MTG(PropertyTree):
         If v2 is None, the order of v1 correspond to the order of v1 with
         respect to the root.
         """
+        index = algo._descriptor_index(self, v1)
+        if index is not None:
+            return index.order[v1]
+
         _order = 0
         edge_type = self.property('edge_type')
         if not edge_type:
@@ -1290,8 +1960,12 @@ class MTG(PropertyTree):
 
         .. seealso:: :func:`MTG`, :func:`openalea.mtg.aml.Index`, :func:`openalea.mtg.aml.Class`
         """
+        labels = self.property('label')
+        if isinstance(labels, LabelIndex):
+            return labels.class_name(vid)
+
         pattern = r'[a-zA-Z]+'
-        label = self.property('label').get(vid)
+        label = labels.get(vid)
         if not label:
             return ''
         else:
@@ -1313,8 +1987,13 @@ class MTG(PropertyTree):
         The label thus provides general information about a vertex and
         enables us to encode the plant components.
         """
+        labels = self.property('label')
+        if isinstance(labels, LabelIndex):
+            index = labels.index(vid)
+            return vid if index is None else index
+
         pattern = r'[0-9]+$'
-        label = self.property('label').get(vid)
+        label = labels.get(vid)
         if not label:
             return vid
         else:
@@ -1324,6 +2003,52 @@ class MTG(PropertyTree):
             else:
                 return vid
 
+    def _labels(self):
+        labels = self.property('label')
+        if not isinstance(labels, LabelIndex):
+            labels = LabelProperty(labels)
+        return labels
+
+    def class_names(self, scale=None):
+        """Class of the vertices at a given scale.
+
+        :Parameters:
+            - `scale` (int) - if None, all the vertices of the MTG.
+
+        :Returns:
+            A NumPy array of class names (empty string if the class
+            is not defined), aligned with the vertices sorted by vid.
+
+        .. seealso:: :meth:`class_name`, :meth:`indices`
+        """
+        import numpy as np
+        labels = self._labels()
+        vids = self._sorted_vertices(scale)
+        codes = np.fromiter((labels.class_code(v) for v in vids), dtype=int, count=len(vids))
+        return np.array(labels.classes, dtype=object)[codes]
+
+    def indices(self, scale=None):
+        """Integer index of the vertices at a given scale.
+
+        :Parameters:
+            - `scale` (int) - if None, all the vertices of the MTG.
+
+        :Returns:
+            A NumPy array of int (-1 if the index is not defined),
+            aligned with the vertices sorted by vid.
+
+        .. seealso:: :meth:`index`, :meth:`class_names`
+        """
+        import numpy as np
+        labels = self._labels()
+        vids = self._sorted_vertices(scale)
+        return np.fromiter((labels.int_index(v, -1) for v in vids), dtype=int, count=len(vids))
+
+    def _sorted_vertices(self, scale=None):
+        if scale is None:
+            return sorted(self._scale)
+        return list(self._scale.vertices_at(scale))
+
     #########################################################################
     # Proxy node interface
     #########################################################################
@@ -2369,6 +3094,7 @@ def fat_mtg(slim_mtg, preserve_order=False):
                     msg += str(cref) + " / " + str(ch)
                     assert set(ch) == set(cref), msg
                     slim_mtg._children[v] = ch
+    slim_mtg._topology_changed()
     return slim_mtg
 
 
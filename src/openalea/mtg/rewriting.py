@@ -187,19 +187,14 @@ def __replace_and_produce__(mtg, vid, production):
         if mtg.parent(mchild) != lasts[mscale]:
             mtg.replace_parent(mchild, lasts[mscale])
 
-    # removal of vid and its components
-    # def remove_components(mtg, vid):
-    #     for compvid in mtg.components(vid):
-    #         remove_components(mtg, compvid)
-    #         mtg.remove_vertex(compvid)
-    #remove_components(mtg, vid)
-
-    # removal of vid
-    mtg.remove_vertex(vid)
-
-    # removal of properties of vid
-    for property in mtg.properties().values():
-        if property.has_key(vid) : del property[vid]
+    # removal of vid, its components and their properties
+    removed = [vid]
+    stack = [vid]
+    while stack:
+        components = mtg.components(stack.pop())
+        removed.extend(components)
+        stack.extend(components)
+    mtg.remove_vertices(removed)
 
 
 ############   The rewritable node and production structures ######
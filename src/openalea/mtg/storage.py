@@ -0,0 +1,912 @@
+# -*- python -*-
+#
+#       OpenAlea.mtg
+#
+#       Copyright 2008-2016 INRIA - CIRAD - INRA
+#
+#       File author(s): Christophe Pradal <christophe.pradal.at.cirad.fr>
+#
+#       Distributed under the Cecill-C License.
+#       See accompanying file LICENSE.txt or copy at
+#           http://www.cecill.info/licences/Licence_CeCILL-C_V1-en.html
+#
+#       OpenAlea WebSite : http://openalea.gforge.inria.fr
+#
+################################################################################
+"""Storage backends for the topology of an MTG.
+
+By default, the topology of a :class:`~openalea.mtg.mtg.MTG` is stored in
+Python dicts (`_parent`, `_children`, `_scale`, `_complex` and `_components`).
+This module provides read-only mappings with the same interface which store
+the same information in contiguous integer arrays:
+
+    - :class:`IntArrayMap` for `vid -> vid` relations (parent, complex, scale),
+    - :class:`CSRMap` for `vid -> [vid]` relations (children, components),
+      stored as offsets and values (Compressed Sparse Row).
+
+It also provides:
+
+    - :class:`ScaleMap`, a dict which maintains the vertices of each scale,
+    - :class:`LabelProperty`, a dict which parses the class and the index of labels,
+    - :class:`VersionedProperty`, a dict which changes its version at each edit,
+    - :class:`CowDict` and its indexed versions (:class:`CowScaleMap`,
+      :class:`CowLabelProperty`, :class:`CowVersionedProperty`), copy-on-write
+      dicts used to share the topology and the properties between snapshots,
+    - :func:`sizeof`, which estimates the memory used by these structures.
+
+Vertex identifiers are used as indices in the arrays.
+This is efficient for MTGs with dense identifiers (e.g. MTGs read from files).
+
+.. seealso:: :meth:`openalea.mtg.mtg.MTG.freeze`
+"""
+
+__docformat__ = "restructuredtext"
+
+import collections
+import copy
+import itertools
+import re
+import sys
+from array import array
+
+from tree import GraphError
+
+# Versions of the versioned properties, unique among all the properties
+_property_versions = itertools.count(1)
+
+# Encoding of the values in the arrays
+_ABSENT = -2
+_NONE = -1
+
+
+class FrozenGraphError(GraphError, TypeError):
+    """
+    exception raised when a frozen graph is edited
+    """
+
+
+def _typecode(n):
+    """ Smallest signed array typecode able to store values in [-2, n]. """
+    if n < 2**31 - 1:
+        return 'i'
+    else:
+        return 'l'
+
+
+class _ReadOnlyMap(collections.Mapping):
+    """ Base class of the array mappings.
+
+    All the editing methods raise a :class:`FrozenGraphError`.
+    """
+
+    read_only = True
+
+    def _frozen(self, *args, **kwds):
+        raise FrozenGraphError('The MTG is frozen. Use unfreeze() before editing it.')
+
+    __setitem__ = __delitem__ = _frozen
+    setdefault = update = pop = popitem = clear = mutable = _frozen
+
+    def has_key(self, vid):
+        return vid in self
+
+    def nbytes(self):
+        """ Memory used by the arrays (in bytes). """
+        return sum(a.itemsize * len(a) for a in self._arrays())
+
+
+class IntArrayMap(_ReadOnlyMap):
+    """ Read-only mapping between a vid and an int (or None).
+
+    Values are stored in an array indexed by vid.
+    Absent keys and None values are encoded with negative values.
+    """
+
+    def __init__(self, d, size=None):
+        if size is None:
+            size = max(d) + 1 if d else 0
+        values = [v for v in d.itervalues() if v is not None]
+        tc = _typecode(max(max(values) if values else 0, size))
+
+        data = array(tc, [_ABSENT]) * size
+        for k, v in d.iteritems():
+            data[k] = _NONE if v is None else v
+
+        self._data = data
+        self._len = len(d)
+
+    def _arrays(self):
+        return (self._data,)
+
+    def __getitem__(self, vid):
+        try:
+            if vid < 0:
+                raise KeyError(vid)
+            v = self._data[vid]
+        except (IndexError, TypeError):
+            raise KeyError(vid)
+        if v == _ABSENT:
+            raise KeyError(vid)
+        return None if v == _NONE else v
+
+    def get(self, vid, default=None):
+        try:
+            return self[vid]
+        except KeyError:
+            return default
+
+    def __contains__(self, vid):
+        try:
+            self[vid]
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        return (vid for vid, v in enumerate(self._data) if v != _ABSENT)
+
+    def __len__(self):
+        return self._len
+
+    def iterkeys(self):
+        return iter(self)
+
+    def itervalues(self):
+        return (None if v == _NONE else v for v in self._data if v != _ABSENT)
+
+    def iteritems(self):
+        return ((vid, None if v == _NONE else v)
+                for vid, v in enumerate(self._data) if v != _ABSENT)
+
+
+class CSRMap(_ReadOnlyMap):
+    """ Read-only mapping between a vid and a list of vids.
+
+    The lists are concatenated in one array of `values`.
+    The list of a vertex `vid` is `values[offsets[vid]:offsets[vid+1]]`.
+    Empty lists are not stored.
+    """
+
+    def __init__(self, d, size=None):
+        if size is None:
+            size = max(d) + 1 if d else 0
+        total = sum(len(l) for l in d.itervalues())
+        tc = _typecode(max(total, size))
+
+        offsets = array(tc, [0]) * (size + 1)
+        for k, l in d.iteritems():
+            offsets[k + 1] = len(l)
+        for i in xrange(size):
+            offsets[i + 1] += offsets[i]
+
+        values = array(tc, [0]) * total
+        for k, l in d.iteritems():
+            start = offsets[k]
+            values[start:start + len(l)] = array(tc, l)
+
+        self._offsets = offsets
+        self._values = values
+        self._len = sum(1 for l in d.itervalues() if l)
+
+    def _arrays(self):
+        return (self._offsets, self._values)
+
+    def _range(self, vid):
+        try:
+            if vid < 0:
+                raise KeyError(vid)
+            start, end = self._offsets[vid], self._offsets[vid + 1]
+        except (IndexError, TypeError):
+            raise KeyError(vid)
+        if start == end:
+            raise KeyError(vid)
+        return start, end
+
+    def __getitem__(self, vid):
+        start, end = self._range(vid)
+        return self._values[start:end].tolist()
+
+    def get(self, vid, default=None):
+        try:
+            return self[vid]
+        except KeyError:
+            return default
+
+    def __contains__(self, vid):
+        try:
+            self._range(vid)
+        except KeyError:
+            return False
+        return True
+
+    def __iter__(self):
+        offsets = self._offsets
+        return (vid for vid in xrange(len(offsets) - 1)
+                if offsets[vid] != offsets[vid + 1])
+
+    def __len__(self):
+        return self._len
+
+    def iterkeys(self):
+        return iter(self)
+
+    def itervalues(self):
+        return (self[vid] for vid in self)
+
+    def iteritems(self):
+        return ((vid, self[vid]) for vid in self)
+
+
+class IndexedDict(dict):
+    """ Dict which maintains secondary indices on its items.
+
+    Sub classes define :meth:`_add` and :meth:`_discard`, which are called
+    each time an item is added to or removed from the dict.
+    """
+
+    def __init__(self, *args, **kwds):
+        dict.__init__(self)
+        self._init_index()
+        self.update(*args, **kwds)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+    def _init_index(self):
+        pass
+
+    def _add(self, key, value):
+        pass
+
+    def _discard(self, key, value):
+        pass
+
+    def __setitem__(self, key, value):
+        if key in self:
+            old_value = dict.__getitem__(self, key)
+            if old_value is value:
+                return
+            self._discard(key, old_value)
+        dict.__setitem__(self, key, value)
+        self._add(key, value)
+
+    def __delitem__(self, key):
+        value = dict.pop(self, key)
+        self._discard(key, value)
+
+    def pop(self, key, *default):
+        if key not in self:
+            return dict.pop(self, key, *default)
+        value = dict.pop(self, key)
+        self._discard(key, value)
+        return value
+
+    def popitem(self):
+        key, value = dict.popitem(self)
+        self._discard(key, value)
+        return key, value
+
+    def setdefault(self, key, value=None):
+        if key not in self:
+            self[key] = value
+        return dict.__getitem__(self, key)
+
+    def update(self, *args, **kwds):
+        for key, value in dict(*args, **kwds).iteritems():
+            self[key] = value
+
+    def clear(self):
+        dict.clear(self)
+        self._init_index()
+
+    def copy(self):
+        return self.__class__(self)
+
+
+def _sorted_at(vertices, cache, scale):
+    """ Sorted list of `vertices[scale]`, kept in `cache` until the scale is modified. """
+    l = cache.get(scale)
+    if l is None:
+        l = cache[scale] = sorted(vertices.get(scale, ()))
+    return l
+
+
+class ScaleMap(IndexedDict):
+    """ Mapping between a vid and its scale.
+
+    The set of vertices of each scale is updated each time the mapping
+    is modified. Thus, the vertices of a given scale are retrieved
+    without scanning all the vertices of the MTG.
+    The sorted list of the vertices of a scale is built the first time
+    it is requested and kept until the scale is modified.
+    """
+
+    def _init_index(self):
+        self._vertices = {}
+        self._sorted = {}
+
+    def _add(self, vid, scale):
+        self._vertices.setdefault(scale, set()).add(vid)
+        self._sorted.pop(scale, None)
+
+    def _discard(self, vid, scale):
+        vertices = self._vertices[scale]
+        vertices.discard(vid)
+        if not vertices:
+            del self._vertices[scale]
+        self._sorted.pop(scale, None)
+
+    def vertices_at(self, scale):
+        """ Vertices at `scale` sorted by vid (the returned list must not be modified). """
+        return _sorted_at(self._vertices, self._sorted, scale)
+
+    def nb_vertices_at(self, scale):
+        """ Number of vertices at `scale` in O(1). """
+        return len(self._vertices.get(scale, ()))
+
+    def scales(self):
+        """ Scales which contain at least one vertex. """
+        return self._vertices.keys()
+
+
+class _Versioned(object):
+    """ Index of :class:`VersionedProperty` and :class:`CowVersionedProperty`. """
+
+    def _init_index(self):
+        self.version = next(_property_versions)
+
+    def _add(self, key, value):
+        self.version = next(_property_versions)
+
+    _discard = _add
+
+
+class VersionedProperty(_Versioned, IndexedDict):
+    """ Property which changes its `version` each time it is modified.
+
+    Versions are unique among all the versioned properties, so they can be
+    used as keys of caches. The `edge_type` property of an MTG is versioned:
+    the traversal caches are reset when an edge type is set or removed.
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.topology_version`
+    """
+
+
+class LabelIndex(object):
+    """ Class and index of the labels of a label property.
+
+    The class and the index of a label are parsed once, when the label is set.
+    Class names are interned and stored as codes (see `classes`),
+    indices as integers. The parsed values of each vid are stored in
+    `_info` as a tuple (class code, int index, index string or None).
+
+    .. seealso:: :class:`LabelProperty`, :class:`CowLabelProperty`,
+        :meth:`openalea.mtg.mtg.MTG.class_name`,
+        :meth:`openalea.mtg.mtg.MTG.index`
+    """
+
+    _class_pattern = re.compile(r'[a-zA-Z]+')
+    _index_pattern = re.compile(r'[0-9]+$')
+
+    # type of the mapping `_info`
+    _info_type = dict
+    _undefined = (0, None, None)
+
+    def _init_index(self):
+        # code 0 is the undefined class
+        self.classes = ['']
+        self._codes = {'': 0}
+        self._info = self._info_type()
+
+    def _add(self, vid, label):
+        if not label or not isinstance(label, basestring):
+            return
+
+        code = 0
+        m = self._class_pattern.match(label)
+        if m:
+            name = m.group(0)
+            code = self._codes.get(name)
+            if code is None:
+                code = self._codes[name] = len(self.classes)
+                self.classes.append(intern(str(name)))
+
+        int_index = index_str = None
+        m = self._index_pattern.search(label)
+        if m:
+            index = m.group(0)
+            int_index = int(index)
+            # indices which are not the string of an int (e.g. '01')
+            if index[0] == '0' and len(index) > 1:
+                index_str = index
+
+        if code or int_index is not None:
+            self._info[vid] = (code, int_index, index_str)
+
+    def _discard(self, vid, label):
+        self._info.pop(vid, None)
+
+    def _copy_labels(self, other, info):
+        other.classes = list(self.classes)
+        other._codes = dict(self._codes)
+        other._info = info
+
+    def class_name(self, vid):
+        """ Class of the label of `vid` or an empty string. """
+        return self.classes[self._info.get(vid, self._undefined)[0]]
+
+    def class_code(self, vid):
+        """ Code of the class of `vid` in `classes` (0 if undefined). """
+        return self._info.get(vid, self._undefined)[0]
+
+    def index(self, vid):
+        """ Index of the label of `vid` (str) or None. """
+        code, index, index_str = self._info.get(vid, self._undefined)
+        if index is None:
+            return None
+        return index_str or str(index)
+
+    def int_index(self, vid, default=None):
+        """ Index of the label of `vid` (int) or `default`. """
+        index = self._info.get(vid, self._undefined)[1]
+        return default if index is None else index
+
+
+class LabelProperty(LabelIndex, IndexedDict):
+    """ Property which maps a vid to its label.
+
+    The class and the index of a label are parsed once, when the label is set
+    (see :class:`LabelIndex`).
+
+    .. seealso:: :meth:`openalea.mtg.mtg.MTG.class_name`,
+        :meth:`openalea.mtg.mtg.MTG.index`
+    """
+
+    def copy(self):
+        """ Copy of the labels which does not parse them again. """
+        other = self.__class__()
+        dict.update(other, self)
+        self._copy_labels(other, dict(self._info))
+        return other
+
+
+# Number of bits of the keys which are not used to select the chunk
+_CHUNK_BITS = 10
+
+
+class CowDict(collections.MutableMapping):
+    """ Copy-on-write dict.
+
+    The items are stored in chunks of keys (`hash(key) >> 10`,
+    i.e. 1024 consecutive vids).
+    A copy shares all its chunks with the original dict.
+    A chunk is duplicated by a dict the first time it is modified.
+    Thus, copies are cheap and memory grows with the number of edits.
+
+    If `copy_value` is defined (e.g. `list`), the values of a duplicated
+    chunk are copied too, so that the values returned by :meth:`mutable`
+    can be modified in place.
+    """
+
+    def __init__(self, d=(), copy_value=None):
+        self._copy_value = copy_value
+        self._chunks = chunks = {}
+        items = d.iteritems() if hasattr(d, 'iteritems') else d
+        for key, value in items:
+            chunks.setdefault(hash(key) >> _CHUNK_BITS, {})[key] = value
+        self._owned = set(chunks)
+        self._len = sum(len(chunk) for chunk in chunks.itervalues())
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self.iteritems()), self._copy_value))
+
+    def _writable(self, cid):
+        if cid in self._owned:
+            return self._chunks[cid]
+        chunk = self._chunks.get(cid)
+        if chunk is None:
+            chunk = {}
+        else:
+            chunk = dict(chunk)
+            copy_value = self._copy_value
+            if copy_value is not None:
+                for key, value in chunk.iteritems():
+                    chunk[key] = copy_value(value)
+        self._chunks[cid] = chunk
+        self._owned.add(cid)
+        return chunk
+
+    def empty(self):
+        """ Return an empty dict of the same type. """
+        return self.__class__(copy_value=self._copy_value)
+
+    def copy(self):
+        """ Return a copy which shares all its chunks with this dict. """
+        other = self.empty()
+        other._chunks = dict(self._chunks)
+        other._owned = set()
+        other._len = self._len
+        # the chunks are now shared
+        self._owned = set()
+        return other
+
+    def mutable(self, key, create=False):
+        """ Returns the value of `key`, which can be modified in place.
+
+        If `create` is True and `key` is not in the dict, the value is
+        initialised with `copy_value()`.
+        """
+        cid = hash(key) >> _CHUNK_BITS
+        if cid not in self._owned:
+            chunk = self._chunks.get(cid)
+            if (chunk is None or key not in chunk) and not create:
+                raise KeyError(key)
+        chunk = self._writable(cid)
+        if create and key not in chunk:
+            chunk[key] = self._copy_value()
+            self._len += 1
+        return chunk[key]
+
+    def __getitem__(self, key):
+        try:
+            return self._chunks[hash(key) >> _CHUNK_BITS][key]
+        except KeyError:
+            raise KeyError(key)
+
+    def get(self, key, default=None):
+        chunk = self._chunks.get(hash(key) >> _CHUNK_BITS)
+        if chunk is None:
+            return default
+        return chunk.get(key, default)
+
+    def __contains__(self, key):
+        chunk = self._chunks.get(hash(key) >> _CHUNK_BITS)
+        return chunk is not None and key in chunk
+
+    def has_key(self, key):
+        return key in self
+
+    def __setitem__(self, key, value):
+        chunk = self._writable(hash(key) >> _CHUNK_BITS)
+        if key not in chunk:
+            self._len += 1
+        chunk[key] = value
+
+    def __delitem__(self, key):
+        cid = hash(key) >> _CHUNK_BITS
+        if key not in self._chunks.get(cid, ()):
+            raise KeyError(key)
+        chunk = self._writable(cid)
+        del chunk[key]
+        self._len -= 1
+        if not chunk:
+            del self._chunks[cid]
+            self._owned.discard(cid)
+
+    def clear(self):
+        self._chunks = {}
+        self._owned = set()
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for chunk in self._chunks.values():
+            for key in chunk:
+                yield key
+
+    def iterkeys(self):
+        return iter(self)
+
+    def itervalues(self):
+        for chunk in self._chunks.values():
+            for value in chunk.itervalues():
+                yield value
+
+    def iteritems(self):
+        for chunk in self._chunks.values():
+            for item in chunk.iteritems():
+                yield item
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, dict(self.iteritems()))
+
+
+class IndexedCowDict(CowDict):
+    """ Copy-on-write dict which maintains secondary indices on its items.
+
+    As for :class:`IndexedDict`, sub classes define :meth:`_init_index`,
+    :meth:`_add` and :meth:`_discard`. They also define :meth:`_copy_index`,
+    which shares the indices with a copy. The values must not be modified
+    in place (:meth:`CowDict.mutable` does not update the indices).
+    """
+
+    def __init__(self, d=(), copy_value=None):
+        CowDict.__init__(self, copy_value=copy_value)
+        self._init_index()
+        items = d.iteritems() if hasattr(d, 'iteritems') else d
+        for key, value in items:
+            self[key] = value
+
+    def _init_index(self):
+        pass
+
+    def _add(self, key, value):
+        pass
+
+    def _discard(self, key, value):
+        pass
+
+    def _copy_index(self, other):
+        pass
+
+    def __setitem__(self, key, value):
+        chunk = self._chunks.get(hash(key) >> _CHUNK_BITS)
+        if chunk is not None and key in chunk:
+            old_value = chunk[key]
+            if old_value is value:
+                return
+            self._discard(key, old_value)
+        CowDict.__setitem__(self, key, value)
+        self._add(key, value)
+
+    def __delitem__(self, key):
+        value = self[key]
+        CowDict.__delitem__(self, key)
+        self._discard(key, value)
+
+    def clear(self):
+        CowDict.clear(self)
+        self._init_index()
+
+    def copy(self):
+        """ Return a copy which shares all its chunks and its indices with this dict. """
+        other = CowDict.copy(self)
+        self._copy_index(other)
+        return other
+
+
+class CowScaleMap(IndexedCowDict):
+    """ Copy-on-write version of :class:`ScaleMap`.
+
+    The vertices of each scale are stored in a :class:`CowDict`,
+    so that they are shared between copies too.
+    """
+
+    def _init_index(self):
+        self._vertices = {}
+        self._sorted = {}
+
+    def _add(self, vid, scale):
+        vertices = self._vertices.get(scale)
+        if vertices is None:
+            vertices = self._vertices[scale] = CowDict()
+        vertices[vid] = True
+        self._sorted.pop(scale, None)
+
+    def _discard(self, vid, scale):
+        vertices = self._vertices[scale]
+        del vertices[vid]
+        if not vertices:
+            del self._vertices[scale]
+        self._sorted.pop(scale, None)
+
+    def _copy_index(self, other):
+        other._vertices = dict((scale, vertices.copy())
+                               for scale, vertices in self._vertices.iteritems())
+        # the sorted lists are never modified
+        other._sorted = dict(self._sorted)
+
+    @classmethod
+    def from_map(cls, scales):
+        """ Copy-on-write copy of a :class:`ScaleMap`. """
+        other = cls()
+        CowDict.__init__(other, scales)
+        other._vertices = dict((scale, CowDict((vid, True) for vid in vertices))
+                               for scale, vertices in scales._vertices.iteritems())
+        other._sorted = dict(scales._sorted)
+        return other
+
+    def vertices_at(self, scale):
+        """ Vertices at `scale` sorted by vid (the returned list must not be modified). """
+        return _sorted_at(self._vertices, self._sorted, scale)
+
+    def nb_vertices_at(self, scale):
+        """ Number of vertices at `scale`. """
+        return len(self._vertices.get(scale, ()))
+
+    def scales(self):
+        """ Scales which contain at least one vertex. """
+        return self._vertices.keys()
+
+
+class CowVersionedProperty(_Versioned, IndexedCowDict):
+    """ Copy-on-write version of :class:`VersionedProperty`. """
+
+    @classmethod
+    def from_property(cls, prop):
+        """ Copy-on-write copy of a :class:`VersionedProperty`. """
+        other = cls()
+        CowDict.__init__(other, prop)
+        return other
+
+
+class CowLabelProperty(LabelIndex, IndexedCowDict):
+    """ Copy-on-write version of :class:`LabelProperty`.
+
+    The parsed classes and indices are stored in a :class:`CowDict`,
+    so that they are shared between copies too.
+    """
+
+    _info_type = CowDict
+
+    def _copy_index(self, other):
+        self._copy_labels(other, self._info.copy())
+
+    @classmethod
+    def from_property(cls, labels):
+        """ Copy-on-write copy of a :class:`LabelProperty`,
+        which does not parse the labels again.
+        """
+        other = cls()
+        CowDict.__init__(other, labels)
+        labels._copy_labels(other, CowDict(labels._info))
+        return other
+
+
+class ScaleArrayMap(IntArrayMap):
+    """ Read-only version of :class:`ScaleMap` stored in an array.
+
+    The vertices of each scale are stored in lists sorted by vid.
+    """
+
+    _vertices = None
+
+    def _index(self):
+        if self._vertices is None:
+            vertices = {}
+            for vid, scale in self.iteritems():
+                vertices.setdefault(scale, []).append(vid)
+            self._vertices = vertices
+        return self._vertices
+
+    def vertices_at(self, scale):
+        return self._index().get(scale, ())
+
+    def nb_vertices_at(self, scale):
+        return len(self._index().get(scale, ()))
+
+    def scales(self):
+        return self._index().keys()
+
+
+def to_arrays(g):
+    """ Replace the topological dicts of `g` by array mappings (in place).
+
+    :Returns: `g`
+    """
+    size = max(g._scale) + 1
+    g._parent = IntArrayMap(g._parent, size)
+    g._complex = IntArrayMap(g._complex, size)
+    g._scale = ScaleArrayMap(g._scale, size)
+    g._children = CSRMap(g._children, size)
+    g._components = CSRMap(g._components, size)
+    return g
+
+
+def to_dicts(g):
+    """ Replace the topological array mappings of `g` by dicts (in place).
+
+    :Returns: `g`
+    """
+    g._parent = dict(g._parent.iteritems())
+    g._complex = dict(g._complex.iteritems())
+    g._scale = ScaleMap(g._scale.iteritems())
+    g._children = dict((k, list(l)) for k, l in g._children.iteritems())
+    g._components = dict((k, list(l)) for k, l in g._components.iteritems())
+    return g
+
+
+def _copy_on_write(p):
+    """ Copy-on-write copy of the property `p`. """
+    if isinstance(p, CowDict):
+        return p.copy()
+    if type(p) is dict:
+        return CowDict(p)
+    if isinstance(p, LabelProperty):
+        return CowLabelProperty.from_property(p)
+    if isinstance(p, VersionedProperty):
+        return CowVersionedProperty.from_property(p)
+    if hasattr(p, 'copy'):
+        return p.copy()
+    return copy.deepcopy(p)
+
+
+def snapshot(g):
+    """ Return a copy-on-write copy of `g`.
+
+    The topology and the properties of the copy are copy-on-write dicts
+    (:class:`CowDict`, :class:`CowScaleMap`, :class:`CowLabelProperty`,
+    :class:`CowVersionedProperty`), their indices included.
+    If `g` is itself a snapshot, they share all their chunks with the
+    dicts of `g`, so the copy takes a time proportional to the number of
+    chunks. Otherwise, they are built from the dicts of `g` in one pass,
+    without copying the property values nor parsing the labels again.
+    `g` is not modified.
+
+    The topology of a frozen MTG is read-only and is shared directly.
+    Typed columns share their arrays until the first write
+    (see :meth:`~openalea.mtg.columns.PropertyColumn.copy`).
+    The other attributes of `g` are deep copied and the caches are reset.
+
+    :Returns: the copy of `g`
+    """
+    h = copy.copy(g)
+
+    for name, value in vars(g).iteritems():
+        if name not in _snapshot_attributes:
+            setattr(h, name, copy.deepcopy(value))
+
+    frozen = g.is_frozen()
+    for name, copy_value in (('_parent', None), ('_complex', None),
+                             ('_children', list), ('_components', list)):
+        d = getattr(g, name)
+        if isinstance(d, CowDict):
+            d = d.copy()
+        elif not frozen:
+            items = d.iteritems()
+            if copy_value is not None:
+                items = ((k, copy_value(v)) for k, v in items)
+            d = CowDict(items, copy_value)
+        setattr(h, name, d)
+
+    if isinstance(g._scale, CowScaleMap):
+        h._scale = g._scale.copy()
+    elif not frozen:
+        h._scale = CowScaleMap.from_map(g._scale)
+
+    h._properties = dict((name, _copy_on_write(p)) for name, p in g._properties.iteritems())
+
+    h._resolved_complex = {}
+    h._containment_index = None
+    h._traversal_orders = {}
+    h._traversal_state = None
+    return h
+
+# Attributes of an MTG which are not deep copied by snapshot()
+_snapshot_attributes = frozenset(['_parent', '_complex', '_children', '_components', '_scale',
+                                  '_properties', '_resolved_complex', '_containment_index',
+                                  '_traversal_orders', '_traversal_state'])
+
+
+def sizeof(obj, seen=None):
+    """ Estimate the memory used by `obj` and the objects it contains (in bytes).
+
+    Dicts, lists, tuples and sets are traversed, as well as the attributes
+    of the mappings (e.g. the arrays of :class:`IntArrayMap`, the chunks
+    of :class:`CowDict` or the arrays of a property column).
+    Other objects are measured by `sys.getsizeof` only, so the memory
+    used by extension objects (e.g. geometries) is underestimated.
+
+    :Parameters:
+        - `obj` - any object
+        - `seen` (set) - ids of the objects already counted, which are not
+          counted again.
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for k, v in obj.iteritems():
+            size += sizeof(k, seen) + sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for v in obj:
+            size += sizeof(v, seen)
+    if isinstance(obj, collections.Mapping) and hasattr(obj, '__dict__'):
+        size += sizeof(obj.__dict__, seen)
+    return size
@@ -18,42 +18,58 @@
 
 from collections import deque
 
-def pre_order(tree, vtx_id, complex=None, visitor_filter=None):
+
+def _traversal_index(tree, vtx_id):
+    ''' Traversal index of the scale of `vtx_id` if it is already built (MTG only) or None. '''
+    if not hasattr(tree, 'traversal_index') or vtx_id not in tree:
+        return None
+    return tree.traversal_index(tree.scale(vtx_id), build=False)
+
+
+def _pre_order(tree, vtx_id, enter=None, leave=None):
     ''' 
-    Traverse a tree in a prefix way.
-    (root then children)
+    Iterative pre order traversal: '+' children before '<' children.
 
-    This is a non recursive implementation.
+    `enter(vid)` is called when `vid` is reached. If it returns False,
+    the sub tree rooted on `vid` is skipped.
+    `leave(vid)` is called when the sub tree rooted on `vid` has been traversed.
     '''
-    if complex is not None and tree.complex(vtx_id) != complex:
-        return
-    if visitor_filter and not visitor_filter.pre_order(vtx_id):
-        return
-
     edge_type = tree.property('edge_type')
 
-    # 1. select first '+' edges
-    successor = []
-    yield vtx_id
-    for vid in tree.children_iter(vtx_id):
-
-        if edge_type.get(vid) == '<':
-            successor.append(vid)
+    stack = [(vtx_id, False)]
+    while stack:
+        vid, leaving = stack.pop()
+        if leaving:
+            leave(vid)
+            continue
+        if enter and not enter(vid):
             continue
 
+        yield vid
 
-        for node in pre_order(tree, vid, complex, visitor_filter):
-            yield node
+        if leave:
+            stack.append((vid, True))
+        children = list(tree.children_iter(vid))
+        # 2. then '<' edges
+        stack.extend((v, False) for v in reversed(children) if edge_type.get(v) == '<')
+        # 1. select first '+' edges
+        stack.extend((v, False) for v in reversed(children) if edge_type.get(v) != '<')
 
 
+def pre_order(tree, vtx_id, complex=None, visitor_filter=None):
+    ''' 
+    Traverse a tree in a prefix way.
+    (root then children)
 
-    # 2. select then '<' edges
-    for vid in successor:
-        for node in pre_order(tree, vid, complex, visitor_filter):
-            yield node
+    This is a non recursive implementation.
+    '''
+    def enter(vid):
+        if complex is not None and tree.complex(vid) != complex:
+            return False
+        return not visitor_filter or visitor_filter.pre_order(vid)
 
-    if visitor_filter:
-        visitor_filter.post_order(vtx_id)
+    leave = visitor_filter.post_order if visitor_filter else None
+    return _pre_order(tree, vtx_id, enter, leave)
 
     
 def pre_order2_with_filter(tree, vtx_id, complex=None, pre_order_filter=None, post_order_visitor=None):
@@ -112,7 +128,19 @@ def pre_order2(tree, vtx_id, complex=None, visitor_filter=None):
     (root then children)
 
     This is an iterative implementation.
+    Without `complex` and `visitor_filter`, the order of the vertices of an
+    MTG is read from its traversal index once it is built
+    (see :meth:`~openalea.mtg.mtg.MTG.traversal_index`).
     '''
+    if complex is None and visitor_filter is None:
+        index = _traversal_index(tree, vtx_id)
+        if index is not None:
+            return iter(index.pre_order(vtx_id))
+    return _pre_order2(tree, vtx_id, complex, visitor_filter)
+
+
+def _pre_order2(tree, vtx_id, complex=None, visitor_filter=None):
+    ''' Implementation of :func:`pre_order2` without cache. '''
     if complex is not None and tree.complex(vtx_id) != complex:
         return
 
@@ -174,22 +202,29 @@ def post_order(tree, vtx_id, complex=None, visitor_filter=None):
     ''' 
     Traverse a tree in a postfix way.
     (from leaves to root)
-    This is a recursive implementation
-    '''
-    if complex is not None and tree.complex(vtx_id) != complex:
-        return
-    if visitor_filter and not visitor_filter.pre_order(vtx_id):
-        return
-    
-    for vid in tree.children_iter(vtx_id):
 
-        for node in post_order(tree, vid, complex, visitor_filter):
-            yield node
+    This is a non recursive implementation.
+    '''
+    def enter(vid):
+        if complex is not None and tree.complex(vid) != complex:
+            return False
+        return not visitor_filter or visitor_filter.pre_order(vid)
 
+    if not enter(vtx_id):
+        return
 
-    if visitor_filter:
-        visitor_filter.post_order(vtx_id)
-    yield vtx_id
+    stack = [(vtx_id, tree.children_iter(vtx_id))]
+    while stack:
+        vid, children = stack[-1]
+        for cid in children:
+            if enter(cid):
+                stack.append((cid, tree.children_iter(cid)))
+                break
+        else: # all the children have been visited
+            stack.pop()
+            if visitor_filter:
+                visitor_filter.post_order(vid)
+            yield vid
 
 
 def post_order2(tree, vtx_id, complex=None, pre_order_filter=None, post_order_visitor=None):
@@ -200,9 +235,19 @@ def post_order2(tree, vtx_id, complex=None, pre_order_filter=None, post_order_vi
     Same algorithm than post_order.
     The goal is to replace the post_order implementation.
 
-        
+    Without `complex`, `pre_order_filter` and `post_order_visitor`, the order
+    of the vertices of an MTG is read from its traversal index once it is built
+    (see :meth:`~openalea.mtg.mtg.MTG.traversal_index`).
     '''
+    if complex is None and pre_order_filter is None and post_order_visitor is None:
+        index = _traversal_index(tree, vtx_id)
+        if index is not None:
+            return iter(index.post_order(vtx_id))
+    return _post_order2(tree, vtx_id, complex, pre_order_filter, post_order_visitor)
+
 
+def _post_order2(tree, vtx_id, complex=None, pre_order_filter=None, post_order_visitor=None):
+    ''' Implementation of :func:`post_order2` without cache. '''
     edge_type = tree.property('edge_type')
     if pre_order_filter is None:
         pre_order_filter = lambda v: True
@@ -251,6 +296,58 @@ def post_order2(tree, vtx_id, complex=None, pre_order_filter=None, post_order_vi
             
 
 
+def levels(tree, vtx_id, scale=None):
+    """Traverse a tree level by level (breadth first).
+
+    Each level (depth 0, 1, 2, ...) is returned as an array of vertices
+    with the array of the indices of their parents in the previous level.
+    Top-down computations can then be written with NumPy operations
+    on each level instead of a Python loop on each vertex.
+
+    :Usage:
+
+    .. code-block:: python
+
+        # height of each vertex
+        for vertices, parents in levels(g, g.root, scale=g.max_scale()):
+            h = h[parents] + 1 if parents[0] >= 0 else np.zeros(len(vertices), dtype=int)
+
+    :Parameters:
+
+        - `tree`: a tree or an MTG
+        - `vtx_id`: the root of the traversal.
+        - `scale`: for an MTG, the scale of the traversed vertices.
+          If it is finer than the scale of `vtx_id`, the traversal starts
+          from the component roots of `vtx_id` at `scale`
+          (see :meth:`~openalea.mtg.mtg.MTG.component_roots_at_scale`).
+
+    :Returns: iter of (vertices, parents), two arrays of int.
+
+        The parents of the first level are -1.
+        The children of a vertex are consecutive, in the order of `children`.
+
+    .. seealso:: :func:`pre_order2`
+    """
+    import numpy as np
+
+    if scale is None or scale == tree.scale(vtx_id):
+        frontier = [vtx_id]
+    else:
+        frontier = list(tree.component_roots_at_scale_iter(vtx_id, scale))
+    parents = [-1] * len(frontier)
+
+    while frontier:
+        yield np.array(frontier, dtype=int), np.array(parents, dtype=int)
+
+        vertices = []
+        parents = []
+        for i, vid in enumerate(frontier):
+            for cid in tree.children_iter(vid):
+                vertices.append(cid)
+                parents.append(i)
+        frontier = vertices
+
+
 def traverse_tree(tree, vtx_id, visitor):
   ''' 
   Traverse a tree in a prefix or postfix way.
@@ -294,9 +391,13 @@ def iter_scale(g, vtx_id, visited):
 
     .. warning:: Do not use. This function may be removed in other version.
     """
-    if vtx_id is not None and vtx_id not in visited:
-        for v in iter_scale(g, g._complex.get(vtx_id), visited):
-            yield v
+    # complexes which have not been visited, from vtx_id
+    complexes = []
+    while vtx_id is not None and vtx_id not in visited:
+        complexes.append(vtx_id)
+        vtx_id = g._complex.get(vtx_id)
+
+    for vtx_id in reversed(complexes):
         visited[vtx_id] = True
         yield vtx_id
 
@@ -329,11 +430,6 @@ def iter_mtg(mtg, vtx_id):
 
         Do not use this function. Use :func:`iter_mtg2` instead. 
         If several trees belong to `vtx_id`, only the first one will be traversed.
-
-    .. note:: 
-        
-        This is a recursive implementation. It can be problematic for large MTG 
-        with lots of scales (e.g. >40).
     """
     visited = {vtx_id:True}
     loc = vtx_id
@@ -373,28 +469,86 @@ def iter_mtg2(mtg, vtx_id):
     .. seealso:: :func:`iter_mtg`, :func:`iter_mtg_with_filter`, :func:`iter_mtg2_with_filter`
         
     .. note:: Use this function instead of :func:`iter_mtg`
+
+    .. note:: The order of an MTG is computed once for each version
+        of its topology (see :meth:`~openalea.mtg.mtg.MTG.topology_version`).
     """
+    if hasattr(mtg, '_mtg_order') and vtx_id in mtg:
+        return iter(mtg._mtg_order(vtx_id))
+    return _iter_mtg2(mtg, vtx_id)
+
+
+def _iter_mtg2(mtg, vtx_id):
+    ''' Implementation of :func:`iter_mtg2` without cache.
+
+    The vertices at the finest scale are traversed in pre order without
+    leaving `vtx_id`. Before each vertex, its complexes which have not been
+    visited yet are yielded, from the coarsest one.
+    Whether a vertex belongs to `vtx_id` is computed once for each vertex,
+    so the traversal is done in O(n).
+    '''
     visited = {vtx_id:True}
     complex_id = vtx_id
 
+    scale = mtg.scale(complex_id)
     max_scale = mtg.max_scale()
+    edge_type = mtg.property('edge_type')
+    explicit_complex = mtg._complex
+
+    # vid -> True if vid is complex_id or one of its components
+    inside = {complex_id: True, None: False}
+    def is_inside(vid):
+        vertices = []
+        while vid not in inside:
+            if mtg.scale(vid) <= scale:
+                inside[vid] = False
+                break
+            vertices.append(vid)
+            vid = mtg.complex(vid)
+        result = inside[vid]
+        for v in vertices:
+            inside[v] = result
+        return result
 
     yield vtx_id
-    for vtx_id in mtg.component_roots_at_scale_iter(complex_id, max_scale):
-        for vid in pre_order2(mtg, vtx_id):
-            for node in iter_scale2(mtg, vid, complex_id, visited):
-                yield node
+    for root in mtg.component_roots_at_scale_iter(complex_id, max_scale):
+        stack = [root]
+        while stack:
+            vid = stack.pop()
+            # the sub tree of a visited vertex has already been traversed
+            if vid in visited or not is_inside(vid):
+                continue
+
+            # complexes which have not been visited, from vid
+            complexes = []
+            v = vid
+            while v is not None and v not in visited and is_inside(v):
+                complexes.append(v)
+                v = explicit_complex.get(v)
+            for v in reversed(complexes):
+                visited[v] = True
+                yield v
+
+            children = list(mtg.children_iter(vid))
+            stack.extend(v for v in reversed(children) if edge_type.get(v) == '<')
+            stack.extend(v for v in reversed(children) if edge_type.get(v) != '<')
 
 def iter_scale2(g, vtx_id, complex_id, visited):
     """ Internal method used by :func:`iter_mtg` and :func:`iter_mtg_with_visitor`.
 
     .. warning:: Do not use. This function may be removed in other version.
     """
-    if vtx_id is not None and \
-       vtx_id not in visited and \
-       g.complex_at_scale(vtx_id, g.scale(complex_id)) == complex_id:
-        for v in iter_scale2(g, g._complex.get(vtx_id), complex_id, visited):
-            yield v
+    scale = g.scale(complex_id)
+
+    # complexes which have not been visited, from vtx_id
+    complexes = []
+    while vtx_id is not None and \
+          vtx_id not in visited and \
+          g.complex_at_scale(vtx_id, scale) == complex_id:
+        complexes.append(vtx_id)
+        vtx_id = g._complex.get(vtx_id)
+
+    for vtx_id in reversed(complexes):
         visited[vtx_id] = True
         yield vtx_id
 
@@ -403,18 +557,25 @@ def topological_sort(g, vtx_id, visited = None):
     ''' 
     Topological sort of a directed acyclic graph.
 
-    This is not a fully recursive implementation.
+    This is a non recursive implementation.
     '''
     if visited is None:
         visited = {}
 
     yield vtx_id
     visited[vtx_id] = True
-    for vid in g.out_neighbors(vtx_id):
-        if vid in visited:
-            continue
-        for node in topological_sort(g, vid, visited):
-            yield node
+
+    stack = [iter(g.out_neighbors(vtx_id))]
+    while stack:
+        for vid in stack[-1]:
+            if vid in visited:
+                continue
+            yield vid
+            visited[vid] = True
+            stack.append(iter(g.out_neighbors(vid)))
+            break
+        else:
+            stack.pop()
 
 def pre_order_with_filter(tree, vtx_id, pre_order_filter=None, post_order_visitor=None):
     ''' 
@@ -432,30 +593,7 @@ def pre_order_with_filter(tree, vtx_id, pre_order_filter=None, post_order_visito
     tree rooted on the vertex has been visited.
     
     '''
-    if pre_order_filter and not pre_order_filter(vtx_id):
-        return
-
-    edge_type = tree.property('edge_type')
-
-    # 1. select first '+' edges
-    successor = []
-    yield vtx_id
-    for vid in tree.children_iter(vtx_id):
-        if edge_type.get(vid) == '<':
-            successor.append(vid)
-            continue
-
-        for node in pre_order_with_filter(tree, vid, pre_order_filter, post_order_visitor):
-            yield node
-
-
-    # 2. select then '<' edges
-    for vid in successor:
-        for node in pre_order_with_filter(tree, vid, pre_order_filter, post_order_visitor):
-            yield node
-
-    if post_order_visitor:
-        post_order_visitor(vtx_id)
+    return _pre_order(tree, vtx_id, pre_order_filter, post_order_visitor)
 
 def iter_mtg_with_filter(mtg, vtx_id, pre_order_filter= None, post_order_visitor=None):
     """Iterate on an MTG by traversiong `vtx_id` and all its components.
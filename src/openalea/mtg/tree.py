@@ -43,6 +43,18 @@ class InvalidVertex (GraphError, KeyError) :
     exception raised when a wrong vertex id is provided
     """
 
+def mutable_list(d, key, create=False):
+    """
+    Return the list `d[key]` in order to modify it in place.
+
+    Copy-on-write dicts (see :class:`openalea.mtg.storage.CowDict`)
+    copy the list if it is shared with another dict.
+    If `create` is True, an empty list is added if `key` is not in `d`.
+    """
+    if isinstance(d, dict):
+        return d.setdefault(key, []) if create else d[key]
+    return d.mutable(key, create)
+
 class Tree(object):
     '''
     Implementation of a rooted :class:`Tree`, 
@@ -151,13 +163,59 @@ class Tree(object):
         if self.nb_children(vid) == 0:
             p = self.parent(vid)
             if p is not None:
-                self._children[p].remove(vid)
+                mutable_list(self._children, p).remove(vid)
                 del self._parent[vid]
             if vid in self._children:
                 del self._children[vid]
         else:
             raise InvalidVertex('Can not remove vertex %d  with children. Use remove_tree instead.'% vid)
 
+    def remove_vertices(self, bunch):
+        """
+        Remove a set of vertices and all the edges attached to them.
+
+        The vertices are removed in one sweep over each structure,
+        in a time proportional to the number of removed vertices.
+        The children of the removed vertices have to be removed too.
+
+        :param bunch: iterable of vertex ids
+        :returns: the set of removed vertices
+        """
+        bunch = set(bunch)
+        self._check_removal(bunch)
+        self._remove_vertices(bunch)
+        return bunch
+
+    def _check_removal(self, bunch):
+        """ Raise an InvalidVertex if the set of vertices can not be removed. """
+        if self.root in bunch:
+            raise InvalidVertex('Removing the root node %d is forbidden.'% self.root)
+        for vid in bunch:
+            for cid in self.children_iter(vid):
+                if cid not in bunch:
+                    raise InvalidVertex('Can not remove vertex %d  with children. Use remove_tree instead.'% vid)
+
+    def _remove_vertices(self, bunch):
+        """ Remove the set of vertices `bunch` without any check.
+
+        The children which are not removed have no more parent.
+        """
+        parents = self._parent
+        children = self._children
+
+        removed_children = {}
+        for vid in bunch:
+            pid = parents.pop(vid, None)
+            if pid is not None and pid not in bunch:
+                removed_children.setdefault(pid, set()).add(vid)
+            for cid in children.pop(vid, ()):
+                if cid not in bunch:
+                    parents[cid] = None
+
+        for pid, vids in removed_children.iteritems():
+            l = mutable_list(children, pid)
+            l[:] = [vid for vid in l if vid not in vids]
+
     def clear(self):
         """
         remove all vertices and edges
@@ -304,7 +362,7 @@ class Tree(object):
             self._id += 1
             child = self._id
 
-        self._children.setdefault(parent,[]).append(child)
+        mutable_list(self._children, parent, create=True).append(child)
         self._parent[child] = parent
 
         return child
@@ -323,7 +381,7 @@ class Tree(object):
             vtx_id2 = self._id
 
         parent = self.parent(vtx_id1)
-        siblings = self._children[parent]
+        siblings = mutable_list(self._children, parent)
         index = siblings.index(vtx_id1)
         siblings.insert(index,vtx_id2)
 
@@ -347,7 +405,7 @@ class Tree(object):
 
         old_parent = self.parent(vtx_id)
         if old_parent is not None:
-            children = self._children[old_parent]
+            children = mutable_list(self._children, old_parent)
 
         self.add_child(parent_id, vtx_id)
         # replace vtx_id by parent_id in children of old_parent
@@ -379,7 +437,7 @@ class Tree(object):
 
         self.add_child(new_parent_id, vtx_id)
         if old_parent is not None:
-            children = self._children[old_parent]
+            children = mutable_list(self._children, old_parent)
             index = children.index(vtx_id)
             del children[index]
 
@@ -494,16 +552,10 @@ class Tree(object):
         """
         Remove the sub tree rooted on `vtx_id`.
 
-        :returns: bool
+        :returns: the list of removed vertices (in post order)
         """
-        vid = vtx_id
-
-        vertices = []
-        
-        for vtx_id in list(post_order(self, vid)):
-            self.remove_vertex(vtx_id)
-            vertices.append(vtx_id)
-
+        vertices = list(post_order(self, vtx_id))
+        self.remove_vertices(vertices)
         return vertices
             
 
@@ -532,7 +584,7 @@ class PropertyTree(Tree):
         :param vid: the id of the vertex to remove
         :type vid: vid
         """
-        vid = super(PropertyTree, self).remove_vertex(vid, reparent_child=reparent_child)
+        super(PropertyTree, self).remove_vertex(vid, reparent_child=reparent_child)
         self._remove_vertex_properties(vid)
 
     def add_child(self, parent, child=None, **properties):
@@ -613,7 +665,7 @@ class PropertyTree(Tree):
                 # remove parent edge
                 pid = self.parent(vid)
                 if pid is not None:
-                    self._children[pid].remove(vid)
+                    mutable_list(self._children, pid).remove(vid)
                     del self._parent[vid]
                 # remove children edges
                 for cid in self.children(vid):
@@ -683,16 +735,20 @@ class PropertyTree(Tree):
 
         return treeid_id
 
-    def remove_tree(self, vtx_id):
-        """
-        Remove the sub tree rooted on `vtx_id`.
-
-        :returns: bool
-        """
-        vids = super(PropertyTree, self).remove_tree(vtx_id)
-        for vid in vids:
-            self._remove_vertex_properties(vid)
-        return vids
+    def _remove_vertices(self, bunch):
+        """ Remove the set of vertices `bunch` and their properties without any check. """
+        super(PropertyTree, self)._remove_vertices(bunch)
+
+        for p in self._properties.itervalues():
+            if hasattr(p, 'discard'):
+                p.discard(bunch)
+            elif len(p) < len(bunch):
+                for vid in [vid for vid in p if vid in bunch]:
+                    del p[vid]
+            else:
+                for vid in bunch:
+                    if vid in p:
+                        del p[vid]
 
     #########################################################################
     # Property Interface for Tree Graph and Mutable property concept.
@@ -17,6 +17,7 @@
 from openalea.mtg.mtg import *
 from openalea.mtg.io import *
 from openalea.mtg.traversal import *
+from openalea.mtg.storage import FrozenGraphError
 
 def test_mtg_api():
     mtg = MTG()
@@ -225,3 +226,1002 @@ def test_reindex():
         assert g0[v] == g[v]
         
 
+
+def test_freeze():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    vertices = list(iter_mtg2(g, g.root))
+    complexes = [g.complex(v) for v in vertices]
+    components = [g.components(v) for v in vertices]
+    children = [g.children(v) for v in vertices]
+
+    g.freeze()
+    assert g.is_frozen()
+    assert len(g) == len(vertices)
+    assert list(iter_mtg2(g, g.root)) == vertices
+    assert [g.complex(v) for v in vertices] == complexes
+    assert [g.components(v) for v in vertices] == components
+    assert [g.children(v) for v in vertices] == children
+
+    try:
+        g.add_child(vertices[-1])
+    except FrozenGraphError:
+        pass
+    else:
+        assert False, 'A frozen MTG can not be edited'
+
+    g.unfreeze()
+    assert not g.is_frozen()
+    v = g.add_child(vertices[-1])
+    assert g.parent(v) == vertices[-1]
+
+def check_scale_index(g):
+    for scale in range(g.max_scale()+1):
+        vertices = set(v for v in g if g.scale(v) == scale)
+        assert g.vertices(scale=scale) == sorted(vertices)
+        assert g.nb_vertices(scale=scale) == len(vertices)
+    assert g.nb_scales() == len(set(g.scale(v) for v in g))
+
+def test_scale_index():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    check_scale_index(g)
+    check_scale_index(g.copy().freeze())
+
+    v = g.add_child(g.vertices(scale=g.max_scale())[-1])
+    check_scale_index(g)
+    g.remove_vertex(v)
+    check_scale_index(g)
+
+    g1 = g.sub_mtg(2)
+    check_scale_index(g1)
+    g.sub_mtg(2, copy=False)
+    check_scale_index(g)
+
+    g = g.reindex()
+    check_scale_index(g)
+
+    g = MTG()
+    random_tree(g, g.root, 3, 100)
+    g = random_mtg(g, 4)
+    check_scale_index(g)
+    g.remove_scale(2)
+    check_scale_index(g)
+
+def check_complex_cache(g):
+    for v in g:
+        c = g._complex.get(v)
+        p = v
+        while c is None:
+            p = g.parent(p)
+            if p is None:
+                break
+            c = g._complex.get(p)
+        assert g.complex(v) == c
+
+def test_complex_cache():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    g.resolve_complexes()
+    check_complex_cache(g)
+
+    vertices = g.vertices(scale=g.max_scale())
+    v = g.add_child(vertices[-1])
+    check_complex_cache(g)
+    g.remove_vertex(v)
+    check_complex_cache(g)
+
+    # move a vertex which inherits its complex into another complex
+    v = [v for v in vertices if g._complex.get(v) is None and g.nb_children(v) > 0][0]
+    w = [w for w in vertices if g.complex(w) != g.complex(v)][-1]
+    g.resolve_complexes()
+    g.replace_parent(v, w)
+    assert g.complex(v) == g.complex(w)
+    check_complex_cache(g)
+
+    g.resolve_complexes()
+    g.insert_parent(w)
+    check_complex_cache(g)
+
+    g.resolve_complexes()
+    u = g.children(w)[0]
+    c = [c for c in g.vertices(scale=g.scale(u)-1) if c != g.complex(u)][0]
+    g.add_component(c, u)
+    assert g.complex(u) == c
+    check_complex_cache(g)
+
+    g = MTG()
+    random_tree(g, g.root, 3, 100)
+    g = random_mtg(g, 4)
+    g.resolve_complexes()
+    g.remove_scale(2)
+    check_complex_cache(g)
+
+def test_containment_index():
+    from openalea.mtg import algo
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    max_scale = g.max_scale()
+    complexes = dict((v, [g.complex_at_scale(v, s) for s in range(max_scale+1)]) for v in g)
+    components = dict((v, [g.components_at_scale(v, s) for s in range(max_scale+1)]) for v in g)
+    vertices = g.vertices(scale=max_scale)
+    ci = g.complex(vertices[len(vertices)//2])
+    descendants = list(algo.descendants(g, g.component_roots(ci)[0], ContainedIn=ci))
+    ancestors = list(algo.ancestors(g, vertices[-1], ContainedIn=g.complex(vertices[-1])))
+
+    index = g.build_containment_index()
+    assert g.containment_index() is index
+    for v in g:
+        assert [g.complex_at_scale(v, s) for s in range(max_scale+1)] == complexes[v]
+        assert [g.components_at_scale(v, s) for s in range(max_scale+1)] == components[v]
+        for c in complexes[v]:
+            assert index.contains(c, v)
+    assert not index.contains(vertices[-1], vertices[0])
+    assert list(algo.descendants(g, g.component_roots(ci)[0], ContainedIn=ci)) == descendants
+    assert list(algo.ancestors(g, vertices[-1], ContainedIn=g.complex(vertices[-1]))) == ancestors
+
+    g.add_child(vertices[-1])
+    assert g.containment_index() is None
+
+def test_property_column():
+    import numpy as np
+    from openalea.mtg.columns import PropertyColumn
+
+    g = MTG()
+    random_tree(g, g.add_component(g.root), 3, 20)
+    g.add_property('length', dtype='float64')
+    g.add_property('leaf', dtype='bool')
+    g.add_property('kind', dtype='categorical')
+    vids = [v for v in g if v % 2]
+    for v in vids:
+        g.property('length')[v] = float(v)
+        g.property('leaf')[v] = g.is_leaf(v)
+        g.property('kind')[v] = 'odd'
+
+    length = g.property('length')
+    assert isinstance(length, PropertyColumn)
+    assert sorted(length) == vids
+    assert length[vids[0]] == float(vids[0])
+    assert 0 not in length
+    assert g.property('kind')[vids[0]] == 'odd'
+    assert g.get_vertex_property(vids[0])['length'] == float(vids[0])
+
+    a = g.property_array('length')
+    a[vids[0]] = 100.
+    assert length[vids[0]] == 100.
+    assert np.isnan(a[0])
+
+    a = g.property_array('length', scale=1, masked=True)
+    assert a.count() == len(vids)
+
+    g.remove_vertex(vids[-1])
+    assert vids[-1] not in length
+    assert dict(g.copy().property('length').iteritems()) == dict(length.iteritems())
+    g2 = g.reindex(copy=True)
+    assert isinstance(g2.property('length'), PropertyColumn)
+    assert sorted(g2.property('length').values()) == sorted(length.values())
+
+def test_typed_reader():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    g1 = read_mtg_file('data/test10_agraf.mtg', typed=True)
+    for name in ['XX', 'dist', 'index']:
+        assert dict(g1.property(name).iteritems()) == g.property(name)
+    assert g1.property('XX').dtype == 'float64'
+    assert g1.property('dist').dtype == 'int64'
+    xx = g1.property_array('XX', scale=g1.max_scale())
+    assert len(xx) == g1.nb_vertices(scale=g1.max_scale())
+
+def test_label_property():
+    import re
+    from openalea.mtg.storage import LabelProperty
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    labels = g.property('label')
+    assert isinstance(labels, LabelProperty)
+
+    def class_name(v):
+        m = re.match(r'[a-zA-Z]+', labels.get(v) or '')
+        return m.group(0) if m else ''
+    def index(v):
+        m = re.search(r'[0-9]+$', labels.get(v) or '')
+        return m.group(0) if m else v
+
+    for v in g:
+        assert g.class_name(v) == class_name(v)
+        assert g.index(v) == index(v)
+
+    v = g.vertices(scale=g.max_scale())[-1]
+    labels[v] = 'XY012'
+    assert g.class_name(v) == 'XY'
+    assert g.index(v) == '012'
+    del labels[v]
+    assert g.class_name(v) == ''
+    assert g.index(v) == v
+
+    scale = g.max_scale()
+    vids = sorted(g.vertices(scale=scale))
+    assert list(g.class_names(scale)) == [g.class_name(v) for v in vids]
+    assert list(g.indices(scale)) == [int(g.index(v)) if v in labels else -1 for v in vids]
+
+    g1 = g.reindex(copy=False)
+    assert isinstance(g1.property('label'), LabelProperty)
+    g1 = g.copy()
+    assert g1.class_name(vids[0]) == g.class_name(vids[0])
+
+def test_from_arrays():
+    import numpy as np
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    g = g.reindex()
+    n = len(g)
+    parent = [-1 if g.parent(v) is None else g.parent(v) for v in range(n)]
+    complex = [-1 if g._complex.get(v) is None else g._complex[v] for v in range(n)]
+    scale = [g.scale(v) for v in range(n)]
+    edge_type = [g.edge_type(v) or None for v in range(n)]
+    xx = np.array([g.property('XX').get(v, np.nan) for v in range(n)])
+    labels = [g.label(v) or None for v in range(n)]
+
+    g1 = MTG.from_arrays(parent, complex, scale, edge_type,
+                         properties={'label': labels, 'XX': xx}, fat=False)
+    assert len(g1) == n
+    for v in g:
+        assert g1.parent(v) == g.parent(v)
+        assert g1.complex(v) == g.complex(v)
+        assert sorted(g1.children(v)) == sorted(g.children(v))
+        assert g1.class_name(v) == g.class_name(v)
+        assert g1.property('XX').get(v) == g.property('XX').get(v)
+    check_scale_index(g1)
+
+    # coarse edges are computed by fat_mtg
+    parent = [p if scale[v] == g.max_scale() else -1 for v, p in enumerate(parent)]
+    g2 = MTG.from_arrays(parent, complex, scale, edge_type)
+    for v in g:
+        assert g2.parent(v) == g.parent(v)
+
+def test_bulk_edit():
+    g = MTG()
+    g.build_containment_index()
+    with g.bulk_edit():
+        assert g.containment_index() is None
+        p = g.add_component(g.root)
+        v = g.add_component(p)
+        for i in range(10):
+            v = g.add_child(v, edge_type='<')
+        p2 = g.add_component(g.root)
+        version = g.topology_version()
+        assert g.complex(v) == p
+        assert list(traversal.iter_mtg2(g, g.root))[-1] == v
+        w = g.add_component(p2, g.add_child(v, edge_type='+'))
+        # the caches are not maintained in the context
+        assert g.topology_version() == version
+        assert not g._resolved_complex
+        assert g.complex(w) == p2
+        assert list(traversal.iter_mtg2(g, g.root))[-2:] == [p2, w]
+    assert g.topology_version() != version
+    assert g.children(p) == [p2]
+    assert g.complex(v) == p
+    assert g.edge_type(p2) == '+'
+    assert g.containment_index() is None
+
+def test_copy_on_write():
+    from openalea.mtg.storage import CowDict
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    g0 = g.snapshot()
+    vertices = sorted(g.vertices(scale=g.max_scale()))
+    topology = lambda g: dict((v, (g.parent(v), g.complex(v), g.children(v), g.components(v),
+                                   g.scale(v), g.label(v))) for v in g)
+    ref = topology(g0)
+    assert topology(g) == ref
+    assert isinstance(g0._children, CowDict)
+    # the original MTG is not modified
+    assert type(g._children) is dict
+    assert type(g.property('XX')) is dict
+
+    # edit the snapshot
+    leaves = [u for u in vertices if g.is_leaf(u)]
+    g1 = g.snapshot()
+    v = g1.add_child(vertices[-1], label='I1000', edge_type='<')
+    g1.add_child(vertices[0], label='I1001', edge_type='+')
+    g1.remove_vertex(leaves[0])
+    g1.property('label')[vertices[1]] = 'X1'
+    assert topology(g) == ref
+    assert v not in g
+    assert g1.label(v) == 'I1000'
+    assert g1.class_name(vertices[1]) == 'X'
+    assert g.class_name(vertices[1]) != 'X'
+    check_scale_index(g1)
+
+    # edit a snapshot which shares its chunks
+    g2 = g1.snapshot()
+    ref2 = topology(g2)
+    g1.replace_parent(v, vertices[0])
+    g1.remove_vertex(leaves[1])
+    assert topology(g2) == ref2
+    assert topology(g) == ref
+    check_scale_index(g2)
+
+    # edit the original
+    g.add_child(vertices[0], label='I1002', edge_type='+')
+    assert topology(g0) == ref
+
+    g3 = g0.snapshot()
+    g3.clear()
+    assert topology(g0) == ref
+
+    g4 = g0.snapshot().freeze()
+    assert topology(g4) == ref
+    assert topology(g4.snapshot()) == ref
+
+def test_snapshot_sharing():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    g.add_property('length', dtype='float64')
+    vertices = sorted(g.vertices(scale=g.max_scale()))
+    for v in vertices:
+        g.property('length')[v] = float(v)
+
+    g1 = g.snapshot()
+    g2 = g1.snapshot()
+    shared = lambda d1, d2: (set(d1._chunks) == set(d2._chunks) and
+                             all(d1._chunks[c] is d2._chunks[c] for c in d1._chunks))
+
+    # the labels, the edge types and their indices are shared
+    for name in ('label', 'edge_type'):
+        assert shared(g2.property(name), g1.property(name))
+    assert shared(g2.property('label')._info, g1.property('label')._info)
+    assert shared(g2._scale, g1._scale)
+    s = g.max_scale()
+    assert shared(g2._scale._vertices[s], g1._scale._vertices[s])
+    assert g2.property('length')._values is g1.property('length')._values
+
+    # until they are modified
+    v = vertices[1]
+    g2.property('label')[v] = 'X1'
+    g2.property('edge_type')[v] = '+'
+    g2.property('length')[v] = -1.
+    w = g2.add_child(vertices[-1], label='I1000', edge_type='<')
+    assert not shared(g2.property('label'), g1.property('label'))
+    assert not shared(g2.property('label')._info, g1.property('label')._info)
+    assert g2.property('length')._values is not g1.property('length')._values
+    assert (g2.class_name(v), g2.edge_type(v), g2.property('length')[v]) == ('X', '+', -1.)
+    assert (g1.class_name(v), g1.edge_type(v), g1.property('length')[v]) == (g.class_name(v), g.edge_type(v), float(v))
+    assert w in g2.vertices(scale=s) and w not in g1.vertices(scale=s)
+    assert dict(g.property('length')) == dict(g1.property('length'))
+    check_scale_index(g1)
+    check_scale_index(g2)
+
+def test_copy():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    v = g.vertices(scale=g.max_scale())[0]
+    g.add_property('values')
+    g.property('values')[v] = [1]
+    g.graph_properties()['names'] = ['a']
+
+    g1 = g.copy()
+    g1.property('values')[v].append(2)
+    g1.graph_properties()['names'].append('b')
+    assert g.property('values')[v] == [1]
+    assert g.graph_properties()['names'] == ['a']
+
+    # the property values are shared by snapshots, not the other attributes
+    g2 = g.snapshot()
+    assert g2.property('values')[v] is g.property('values')[v]
+    g2.graph_properties()['names'].append('b')
+    assert g.graph_properties()['names'] == ['a']
+
+def test_remove_vertices():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    g.add_property('length', dtype='float64')
+    for v in g.vertices(scale=g.max_scale()):
+        g.property('length')[v] = float(v)
+    g.build_containment_index()
+
+    # a branch at the finest scale
+    branch = [v for v in g.vertices(scale=g.max_scale())
+              if g.edge_type(v) == '+' and g.nb_children(v) > 0][0]
+    removed = g.remove_tree(branch)
+    assert removed[-1] == branch
+    assert len(removed) > 1
+    for v in removed:
+        assert v not in g
+        assert v not in g.property('length')
+        assert v not in g.property('label')
+        assert v not in g.vertices(scale=g.max_scale())
+    assert g._containment_index is None
+    for v in g:
+        assert g.parent(v) not in removed
+        assert set(g.children(v)).isdisjoint(removed)
+        assert set(g.components(v)).isdisjoint(removed)
+    check_scale_index(g)
+
+    # the root, a vertex without its children or its components
+    v = g.component_roots_at_scale(g.root, g.max_scale())[0]
+    for bunch in ([g.root], [v], [g.complex(v)]):
+        try:
+            g.remove_vertices(bunch)
+            assert False
+        except InvalidVertex:
+            pass
+
+def test_memory_report():
+    g = read_mtg_file('data/test10_agraf.mtg')
+    report = g.memory_report()
+    assert set(report['topology']) == set(['_parent', '_children', '_complex', '_components', '_scale'])
+    assert report['topology']['_scale']['count'] == len(g)
+    assert set(report['properties']) == set(g.property_names())
+
+    label = report['properties']['label']
+    assert label['count'] == len(g.property('label'))
+    assert label['types'] == {'str': label['count']}
+    assert label['compact_dtype'] == 'categorical'
+    assert 0 < label['compact_nbytes'] < label['nbytes']
+    assert label['saving'] == label['nbytes'] - label['compact_nbytes']
+    assert report['nbytes'] > sum(r['nbytes'] for r in report['topology'].itervalues())
+
+    g.add_property('length', dtype='float64')
+    g.add_property('shape')
+    for v in g.vertices(scale=g.max_scale()):
+        g.property('length')[v] = 1.
+        g.property('shape')[v] = [v]
+    g.build_containment_index()
+    report = g.memory_report()
+    assert report['properties']['length']['saving'] == 0
+    assert report['properties']['shape']['compact_nbytes'] is None
+    assert report['caches']['_containment_index'] > 0
+    assert report['caches']['_traversal_orders'] == 0
+    g.traversal_index(g.max_scale())
+    assert g.memory_report()['caches']['_traversal_orders'] > 0
+
+def test_traversal_cache():
+    from openalea.mtg import traversal
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    version = g.topology_version()
+
+    def check(g):
+        assert list(traversal.iter_mtg2(g, g.root)) == list(traversal._iter_mtg2(g, g.root))
+        for scale in g.scales():
+            for v in g.vertices(scale=scale)[::7]:
+                assert list(traversal.pre_order2(g, v)) == list(traversal._pre_order2(g, v))
+                assert list(traversal.post_order2(g, v)) == list(traversal._post_order2(g, v))
+
+    check(g)
+    assert g.topology_version() == version
+    # only the order from the root is kept
+    cache = g._traversal_cache()
+    assert 'iter_mtg2' in cache
+    assert not [k for k in cache if isinstance(k, tuple) and k[0] == 'iter_mtg2']
+    index = g.traversal_index(g.max_scale())
+    assert len(index) == g.nb_vertices(scale=g.max_scale())
+    assert g.traversal_index(g.max_scale()) is index
+
+    # edit the topology
+    v = g.vertices(scale=g.max_scale())[-1]
+    g.add_child(v, edge_type='+', label='I1000')
+    assert g.topology_version() != version
+    # the traversals do not build the index again
+    check(g)
+    assert g.traversal_index(g.max_scale(), build=False) is None
+    assert g.traversal_index(g.max_scale()) is not index
+    check(g)
+
+    # edit the edge types in place
+    g.cache_descriptors()
+    index = g.traversal_index(g.max_scale())
+    v = [u for u in g.vertices(scale=g.max_scale()) if g.edge_type(u) == '<'][-1]
+    order = g.order(v)
+    g.property('edge_type')[v] = '+'
+    assert g.traversal_index(g.max_scale()) is not index
+    assert g.order(v) == order + 1
+    check(g)
+
+    g2 = g.copy()
+    g2.remove_tree(g2.vertices(scale=g2.max_scale())[5])
+    check(g2)
+    check(g)
+
+def test_deep_traversal():
+    from openalea.mtg import traversal
+
+    g = MTG()
+    vid = g.add_component(g.root)
+    axis = [vid]
+    for i in range(5000):
+        vid = g.add_child(vid, edge_type='<')
+        axis.append(vid)
+        if i % 100 == 0:
+            g.add_child(vid, edge_type='+')
+
+    n = len(g) - 1
+    pre = list(traversal.pre_order(g, axis[0]))
+    assert pre == list(traversal._pre_order2(g, axis[0]))
+    post = list(traversal.post_order(g, axis[0]))
+    assert len(post) == n and post[-1] == axis[0]
+    assert post.index(axis[-1]) < post.index(axis[1])
+    assert list(traversal.pre_order_with_filter(g, axis[0])) == pre
+    assert list(traversal.iter_mtg(g, g.root)) == [g.root] + pre
+
+    class Graph(object):
+        def out_neighbors(self, vid):
+            return g.children(vid)
+    assert list(traversal.topological_sort(Graph(), axis[0])) == list(traversal.pre_order(g, axis[0]))
+
+    # filters and visitors
+    class Visitor(object):
+        def __init__(self):
+            self.left = []
+        def pre_order(self, vid):
+            return vid not in axis[2500:]
+        def post_order(self, vid):
+            self.left.append(vid)
+
+    visitor = Visitor()
+    pre = list(traversal.pre_order(g, axis[0], visitor_filter=visitor))
+    assert axis[2499] in pre and axis[2500] not in pre
+    assert sorted(visitor.left) == sorted(pre)
+    assert visitor.left[-1] == axis[0]
+
+    visitor = Visitor()
+    post = list(traversal.post_order(g, axis[0], visitor_filter=visitor))
+    assert visitor.left == post
+    assert sorted(post) == sorted(pre)
+
+def test_linear_iter_mtg2():
+    from openalea.mtg import traversal
+
+    def reference(g, complex_id):
+        # previous implementation: filter the vertices of the whole sub trees
+        visited = {complex_id: True}
+        yield complex_id
+        for root in g.component_roots_at_scale_iter(complex_id, g.max_scale()):
+            for vid in traversal._pre_order2(g, root):
+                for node in traversal.iter_scale2(g, vid, complex_id, visited):
+                    yield node
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    assert list(traversal._iter_mtg2(g, g.root)) == list(reference(g, g.root))
+    assert len(list(traversal._iter_mtg2(g, g.root))) == len(g)
+    for scale in range(1, g.max_scale() + 1):
+        for vid in g.vertices(scale=scale)[::5]:
+            assert list(traversal._iter_mtg2(g, vid)) == list(reference(g, vid))
+
+def test_levels():
+    import numpy as np
+    from openalea.mtg import algo, traversal
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+
+    heights = algo.heights(g, scale=scale)
+    orders = algo.orders(g, scale=scale)
+    vertices = []
+    for vids, parents in traversal.levels(g, g.root, scale=scale):
+        if parents[0] < 0:
+            assert (parents == -1).all()
+            h = np.zeros(len(vids), dtype=int)
+            o = np.zeros(len(vids), dtype=int)
+        else:
+            h = h[parents] + 1
+            o = o[parents] + np.array([g.edge_type(v) == '+' for v in vids])
+        assert [heights[v] for v in vids] == h.tolist()
+        assert [orders[v] for v in vids] == o.tolist()
+        vertices.extend(vids.tolist())
+    assert sorted(vertices) == sorted(g.vertices(scale=scale))
+
+    levels = list(traversal.levels(g, g.root))
+    assert len(levels) == 1 and levels[0][0].tolist() == [g.root]
+
+def test_subtree_reduce():
+    from openalea.mtg import algo
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+    vertices = g.vertices(scale=scale)
+    values = dict((v, v % 7) for v in vertices[::2])
+
+    def subtree(v, edge_type=None, same_complex=False):
+        result = [v]
+        for vid in result:
+            result.extend(c for c in g.children(vid)
+                          if (edge_type is None or g.edge_type(c) == edge_type) and
+                          (not same_complex or g.complex(c) == g.complex(vid)))
+        return result
+
+    count = algo.subtree_reduce(g, op='count')
+    assert count == dict((v, len(subtree(v))) for v in vertices)
+    # default values: each vertex counts for 1
+    assert algo.subtree_reduce(g) == count
+    assert algo.subtree_reduce(g, op='max') == dict((v, 1) for v in vertices)
+
+    for kwds in (dict(), dict(edge_type='<'), dict(same_complex=True)):
+        total = algo.subtree_reduce(g, values, op='sum', **kwds)
+        maximum = algo.subtree_reduce(g, values, op='max', **kwds)
+        minimum = algo.subtree_reduce(g, values, op='min', **kwds)
+        for v in vertices:
+            x = [values[u] for u in subtree(v, **kwds) if u in values]
+            assert total[v] == sum(x)
+            assert isinstance(total[v], int)
+            if x:
+                assert maximum[v] == max(x) and minimum[v] == min(x)
+            else:
+                assert v not in maximum and v not in minimum
+
+    g.add_property('length', dtype='float64')
+    for v in vertices:
+        g.property('length')[v] = 0.5
+    length = algo.subtree_reduce(g, 'length', scale=scale)
+    assert all(length[v] == 0.5 * count[v] for v in vertices)
+
+def test_path_accumulate():
+    from openalea.mtg import algo
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+    vertices = g.vertices(scale=scale)
+
+    def path(v, stop=lambda v: False):
+        result = [v]
+        while g.parent(result[-1]) is not None and not stop(result[-1]):
+            result.append(g.parent(result[-1]))
+        return result
+
+    height = algo.path_accumulate(g, op='count', scale=scale)
+    assert dict((v, n - 1) for v, n in height.iteritems()) == algo.heights(g, scale=scale)
+    # default values: each vertex counts for 1
+    assert algo.path_accumulate(g) == height
+    plus = dict((v, 1) for v in vertices if g.edge_type(v) == '+')
+    assert algo.path_accumulate(g, plus, scale=scale) == algo.orders(g, scale=scale)
+
+    rank = algo.path_accumulate(g, op='count', reset_on='+')
+    axis_start = lambda v: g.edge_type(v) == '+'
+    assert rank == dict((v, len(path(v, axis_start))) for v in vertices)
+
+    values = dict((v, v % 5) for v in vertices[::3])
+    complex_start = lambda v: g.complex(v) != g.complex(g.parent(v))
+    for kwds, stop in ((dict(), lambda v: False),
+                       (dict(reset_on='complex'), complex_start),
+                       (dict(reset_on=['complex', '+']), lambda v: complex_start(v) or axis_start(v))):
+        total = algo.path_accumulate(g, values, **kwds)
+        maximum = algo.path_accumulate(g, values, op='max', **kwds)
+        for v in vertices:
+            x = [values[u] for u in path(v, stop) if u in values]
+            assert total[v] == sum(x)
+            assert maximum.get(v) == (max(x) if x else None)
+
+def test_lca_index():
+    import random
+    from openalea.mtg import algo
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+    vertices = g.vertices(scale=scale)
+    random.seed(1)
+    pairs = [(random.choice(vertices), random.choice(vertices)) for i in range(100)]
+    pairs += [(v, v) for v in vertices[:5]]
+    pairs += [(u, v) for v in vertices[::40] for u in list(g.Ancestors(v))[::5]]
+
+    def queries(g):
+        return [(g.AlgOrder(u, v), g.AlgRank(u, v), g.AlgHeight(u, v),
+                 algo.order(g, u, v), g.Rank(u, v), g.Height(u, v), g.Path(u, v),
+                 algo.lowestCommonAncestor(g, [u, v]))
+                for u, v in pairs]
+
+    ref = queries(g)
+    assert g.lca_index(scale, build=False) is None
+    index = g.lca_index(scale)
+    assert g.lca_index(scale, build=False) is index
+    assert queries(g) == ref
+
+    us, vs = zip(*pairs)
+    lcas = algo.lca(g, us, vs)
+    for (u, v), w in zip(pairs, lcas.tolist()):
+        assert w == algo.lca(g, u, v) == algo.lowestCommonAncestor(g, [u, v])
+        ancestors = set(g.Ancestors(u))
+        assert w in ancestors and w in g.Ancestors(v)
+        assert not any(g.parent(c) == w and c in ancestors for c in g.Ancestors(v))
+        assert algo.path_length(g, u, v) == g.Height(w, u) + g.Height(w, v)
+
+    # the index is rebuilt after an edition
+    g.add_child(vertices[0], edge_type='+')
+    assert g.lca_index(scale, build=False) is None
+
+    # vertices in disjoint trees have no common ancestor
+    g = MTG()
+    r1 = g.add_component(g.root)
+    r2 = g.add_component(g.root)
+    v1 = g.add_child(r1)
+    v2 = g.add_child(r2)
+    for pair in ([v1, v2], [r1, v2], [v1, r1, r2]):
+        assert algo.lowestCommonAncestor(g, pair) is None
+    g.lca_index(1)
+    for pair in ([v1, v2], [r1, v2], [v1, r1, r2]):
+        assert algo.lowestCommonAncestor(g, pair) is None
+    assert algo.lowestCommonAncestor(g, [v1, r1]) == r1
+
+def test_subtree_intervals():
+    from openalea.mtg import algo, traversal
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+    vertices = g.vertices(scale=scale)
+
+    for v in vertices[::10]:
+        descendants = list(traversal.pre_order2_with_filter(g, v))
+        assert g.Descendants(v) == descendants
+        assert sorted(g.Extremities(v)) == sorted(algo._extremities(g, v))
+        assert set(g.Extremities(v)) == set(u for u in descendants if g.is_leaf(u))
+        ancestors = set(g.Ancestors(v))
+        for u in vertices[::17]:
+            assert algo.is_ancestor(g, u, v) == (u in ancestors)
+            assert g.lca_index(scale).is_ancestor(u, v) == (u in ancestors)
+    assert not algo.is_ancestor(g, g.complex(vertices[0]), vertices[0])
+
+    # restrictions
+    v = vertices[0]
+    assert g.Descendants(v, RestrictedTo='SameAxis') == \
+        [u for u in g.Descendants(v) if all(g.edge_type(w) != '+' for w in g.Path(v, u)[1:])]
+
+    # after an edition, the index is only built again on demand
+    w = g.add_child(v, edge_type='+')
+    assert w in g.Descendants(v)
+    assert w in g.Extremities(v)
+    assert g.traversal_index(scale, build=False) is None
+    g.freeze()
+    assert g.traversal_index(scale, build=False) is not None
+
+def test_distance_matrix():
+    import numpy as np
+    from openalea.mtg import algo
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+    vids = g.vertices(scale=scale)[::40]
+    n = len(vids)
+
+    d = algo.distance_matrix(g, vids)
+    assert d.shape == (n, n)
+    plus = algo.distance_matrix(g, vids, weight='+', block_size=7)
+    length = dict((v, 0.5) for v in g.vertices(scale=scale))
+    weighted = algo.distance_matrix(g, vids, weight=length, block_size=5)
+
+    for a, u in enumerate(vids):
+        for b, v in enumerate(vids):
+            w = algo.lca(g, u, v)
+            assert d[a, b] == algo.path_length(g, u, v)
+            assert weighted[a, b] == 0.5 * d[a, b]
+            path = g.Path(w, u)[1:] + g.Path(w, v)[1:]
+            assert plus[a, b] == sum(1 for x in path if g.edge_type(x) == '+')
+    assert (d == d.T).all()
+
+    condensed = algo.distance_matrix(g, vids, weight='+', condensed=True, block_size=4)
+    assert condensed.tolist() == plus[np.triu_indices(n, 1)].tolist()
+
+    rows = np.vstack([block for start, block in algo.distance_blocks(g, vids, block_size=3)])
+    assert (rows == d).all()
+
+    # the default blocks are sized from the number of vertices
+    for n in (1, 1000, 10**6):
+        rows = algo._distance_block_size(n)
+        assert rows >= 1
+        assert rows == 1 or rows * n * algo._DISTANCE_PAIR_BYTES <= algo._DISTANCE_BLOCK_BYTES
+
+def test_branching_orders():
+    from openalea.mtg import algo
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+    vertices = g.vertices(scale=scale)
+    orders = algo.branching_orders(g, scale, kinds=algo._BRANCHING_ORDERS)
+
+    # reference implementation, one vertex at a time
+    strahler, size, leaf_distance = {}, {}, {}
+    for root in g.roots(scale=scale):
+        for v in post_order(g, root):
+            children = g.children(v)
+            size[v] = 1 + sum(size[c] for c in children)
+            leaf_distance[v] = 1 + max(leaf_distance[c] for c in children) if children else 0
+            s = [strahler[c] for c in children]
+            strahler[v] = max(s) + (s.count(max(s)) >= 2) if s else 1
+    assert orders['strahler'] == strahler
+    assert orders['size'] == size
+    assert orders['leaf_distance'] == leaf_distance
+
+    horton, gravelius = {}, {}
+    for root in g.roots(scale=scale):
+        horton[root], gravelius[root] = strahler[root], 1
+        for v in pre_order(g, root):
+            children = g.children(v)
+            if not children:
+                continue
+            key = lambda c: (leaf_distance[c], g.edge_type(c) == '<', -children.index(c))
+            main = max(children, key=lambda c: (strahler[c],) + key(c))
+            for c in children:
+                horton[c] = horton[v] if c == main else strahler[c]
+            main = max(children, key=key)
+            for c in children:
+                gravelius[c] = gravelius[v] if c == main else gravelius[v] + 1
+    assert orders['horton'] == horton
+    assert orders['gravelius'] == gravelius
+    assert max(gravelius.values()) > 1
+
+    vids, arrays = algo.branching_orders(g, kinds='strahler', as_arrays=True)
+    assert sorted(vids.tolist()) == sorted(vertices)
+    assert dict(zip(vids.tolist(), arrays['strahler'].tolist())) == strahler
+
+def test_aml_sequences():
+    import numpy as np
+    from openalea.mtg import aml
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    aml.Activate(g)
+    vids = g.vertices(scale=3)[::7] + g.vertices(scale=2)[::7] + [g.root, 100000]
+
+    def check(result, expected):
+        assert len(result) == len(expected)
+        for x, y in zip(result, expected):
+            if isinstance(x, float) and np.isnan(x):
+                assert y is None
+            else:
+                assert x == y
+
+    defined = lambda f: lambda v: f(v) if v in g else None
+    check(aml.Class(vids), map(defined(aml.Class), vids))
+    check(aml.Index(np.array(vids)), map(defined(aml.Index), vids))
+    check(aml.Scale(vids), map(defined(aml.Scale), vids))
+    check(aml.Feature(vids, 'XX'), [aml.Feature(v, 'XX') for v in vids])
+    check(aml.Father(vids, EdgeType='+'), map(defined(lambda v: aml.Father(v, EdgeType='+')), vids))
+    check(aml.Complex(vids), map(defined(aml.Complex), vids))
+    check(aml.Sons(vids, EdgeType='<'), map(defined(lambda v: aml.Sons(v, EdgeType='<')), vids))
+    assert aml.Father(vids).dtype == float
+
+    for f in (aml.Order, aml.Rank, aml.Height):
+        result = f(vids)
+        check(result, map(defined(f), vids))
+        assert f(vids[:-1]).dtype == int
+        v2 = [g.Father(v) or v for v in vids[:-1]]
+        check(f(vids[:-1], v2), map(f, vids[:-1], v2))
+
+    g.add_property('length', dtype='float64')
+    g.property('length')[vids[0]] = 1.5
+    lengths = aml.Feature(vids + [-1], 'length')
+    assert lengths[0] == 1.5 and np.isnan(lengths[1:]).all()
+    column = g.property('length')
+    assert column.mask([vids[0], -1]).tolist() == [True, False]
+
+def test_descriptor_cache():
+    from openalea.mtg import algo
+
+    g = read_mtg_file('data/test10_agraf.mtg')
+    scale = g.max_scale()
+    vids = g.vertices(scale=scale)[::11]
+    pairs = zip(vids, vids[3:]) + [(v, g.parent(v) or v) for v in vids]
+    assert g.descriptor_index(scale) is None
+
+    def descriptors():
+        single = [(g.order(v), g.Rank(v), g.Height(v)) for v in vids]
+        double = [(g.AlgOrder(*p), g.AlgRank(*p), g.AlgHeight(*p), g.Rank(*p)) for p in pairs]
+        return single, double
+
+    expected = descriptors()
+    g.cache_descriptors()
+    assert descriptors() == expected
+    index = g.descriptor_index(scale)
+    assert len(index) == len(g.vertices(scale=scale))
+    for v in vids:
+        assert index.axis[v] == [x for x in algo.ancestors(g, v) if g.edge_type(x) != '<'][0]
+
+    # topological edition
+    v = vids[5]
+    child = g.add_child(v, edge_type='+', label='E1')
+    g.add_child(child, edge_type='<', label='E2')
+    assert g.descriptor_index(scale) is not index
+    leaf = g.children(child)[0]
+    assert g.order(leaf) == g.order(v) + 1
+    assert g.Rank(leaf) == 1
+    assert g.Height(leaf) == g.Height(v) + 2
+    assert g.descriptor_index(scale).axis[leaf] == child
+
+    g.cache_descriptors(False)
+    assert g.descriptor_index(scale) is None
+    assert g.order(leaf) == g.order(v) + 1
+
+def test_dynamic_mtg():
+    import datetime
+    from openalea.mtg import aml
+
+    g = read_mtg_file('data/mtg_dynamic.mtg')
+    aml.Activate(g)
+    d = lambda s: datetime.datetime.strptime(s, '%d/%m/%Y').date()
+
+    v = [x for x in g.vertices(scale=3) if g.label(x) == 'U7'][0]
+    assert aml.DateSample(v) == [d('16/07/2007'), d('31/12/2007'), d('01/12/2008')]
+    assert aml.DateSample(v, MinDate='01/08/2007', MaxDate=d('31/12/2007')) == [d('31/12/2007')]
+    assert aml.Feature(v, 'Long', '31/12/2007') == 152
+    assert aml.Feature(v, 'Long', d('01/12/2008')) is None
+    assert aml.Feature(v, 'Cultivar', '16/07/2007') == 'b'
+    assert aml.FirstDefinedFeature(v, 'Long') == d('16/07/2007')
+    assert aml.LastDefinedFeature(v, 'Long') == d('31/12/2007')
+    assert aml.LastDefinedFeature(v, 'BottomDia', MaxDate='30/11/2008') == d('31/12/2007')
+    assert aml.FirstDefinedFeature(v, 'Long', MinDate='01/01/2008') is None
+    assert aml.NextDate(v, '16/07/2007') == d('31/12/2007')
+    assert aml.NextDate(v, '01/12/2008') is None
+    assert aml.PreviousDate(v, '01/01/2008') == d('31/12/2007')
+    assert aml.PreviousDate(v, '16/07/2007') is None
+
+    # vertex observed once
+    e = g.children(v)[0] if g.children(v) else g.component_roots(v)[0]
+    assert len(aml.DateSample(e)) == 1
+    assert aml.Feature(e, 'Mod', aml.DateSample(e)[0]) == g.property('Mod')[e]
+
+    # observation earlier than the only observation of a vertex
+    from openalea.mtg import dynamic
+    e = [x for x in g.vertices(scale=3) if len(aml.DateSample(x)) == 1 and
+         not isinstance(g.property('Long').get(x, 0), dynamic.TimeSeries) and
+         g.property('Long').get(x) is not None][0]
+    first, long = aml.DateSample(e)[0], g.property('Long')[e]
+    earlier = first - datetime.timedelta(days=30)
+    dynamic.add_observation(g, e, earlier, {'Long': long / 2.})
+    assert aml.DateSample(e) == [earlier, first]
+    assert aml.Feature(e, 'Long', earlier) == long / 2.
+    assert aml.Feature(e, 'Long', first) == long
+
+def test_at_date():
+    from openalea.mtg import dynamic
+
+    g = read_mtg_file('data/mtg_dynamic.mtg')
+    n = len(g)
+    dates = sorted(set(d for v in g for d in dynamic.date_sample(g, v)))
+    sizes = []
+    for d in dates:
+        h = g.at_date(d)
+        sizes.append(len(h))
+        assert h.is_frozen()
+        for v in h.vertices(scale=3):
+            assert dynamic.date_sample(g, v)[0] <= d
+            assert all(c in h for c in h.children(v))
+            long = g.property('Long').get(v)
+            if isinstance(long, dynamic.TimeSeries):
+                previous = [x for x, value in long.items() if x <= d]
+                assert h.property('Long').get(v) == (long[previous[-1]] if previous else None)
+        for root in h.roots(scale=3):
+            assert all(v in h for v in pre_order2(h, root))
+    assert sizes == sorted(sizes) and sizes[0] < sizes[-1] == n
+
+    h = g.at_date(dates[0])
+    hidden = [v for v in g.vertices(scale=3) if v not in h]
+    assert hidden and all(h.parent(v) is None for v in hidden)
+    try:
+        h.add_child(h.roots(scale=3)[0], label='U1')
+        assert False
+    except FrozenGraphError:
+        pass
+    assert len(g) == n and not g.is_frozen()
+
+    # an earlier observation of a hidden vertex
+    v = hidden[0]
+    assert v not in g.at_date(dates[0])
+    dynamic.add_observation(g, v, dates[0], {})
+    assert v in g.at_date(dates[0])
+
+def test_streaming_reader():
+    from StringIO import StringIO
+    from openalea.mtg import io
+
+    fn = 'data/test10_agraf.mtg'
+    txt = open(fn).read()
+    g = read_mtg(txt)
+
+    def same(h):
+        assert sorted(h._parent.items()) == sorted(g._parent.items())
+        assert sorted(h._complex.items()) == sorted(g._complex.items())
+        for name in g.property_names():
+            assert h.property(name) == g.property(name)
+
+    reader = io.Reader(StringIO(txt))
+    same(reader.parse())
+    # only the lines of the header are stored
+    assert 0 < len(reader.lines) < len(txt.splitlines()) / 10
+    same(read_mtg_file(fn))
+
+    # the code can be read piece by piece
+    s = '/I1(10,65.3)<I2(8,60.1)[+I10<I11]<I3(7,62.7)<I4(5,58.8)[+I7<I8<I9][+I5<I6]'
+    g1 = multiscale_edit(s)
+    g2 = multiscale_edit(['/I1(10,65.3)', '<I2(8,60.1)', '[', '+I10<I11', ']', '<I3(7,62.7)<I4(5,58.8)[+I7<I8<I9][+I5<I6]'])
+    assert g1._parent == g2._parent and g1.property('label') == g2.property('label')
@@ -72,6 +72,11 @@ def test_dynamic():
     s = '/I1(date=10/01/92,x=10,y=65.3)*(date=20/01/92,x=12,y=69.3)*(date=02/02/92,x=15,y=70.1)<I2(date=10/01/92,x=8,y=60.1)*(date=20/01/92,x=9,y=61.3)*(date=02/02/92,x=10,y=66.3)[+I<I]<I3(date=20/01/92,x=7,y=62.7,z=3)*(date=02/02/92,x=9,y=65.5,z=1)<I4(date=02/02/92,x=5,y=58.8,status=Dead)[+I7<I<I][+I5<I]'
     class_type = {'date':'DD/MM/YY', 'x':'REAL', 'y': 'REAL', 'z':'REAL' ,'status':'STRING' }
     g = multiscale_edit(s, class_type=class_type, has_date=True)
+    x = g.property('x')[1]
+    assert x.values == [10, 12, 15]
+    assert x['20/01/92'] == 12
+    assert g.property('z')[5].items()[-1][1] == 1
+    assert g.property('x')[6] == 5
 
 def test_tree():
     # Tree from Godin et al. 2005